@@ -1,734 +1,53 @@
 import streamlit as st
-import re
 import pandas as pd
-import numpy as np
-from io import BytesIO
-from PIL import Image, ImageFilter, ImageOps
-import openai
-from openai import OpenAI
-import base64
-import gspread
 from datetime import datetime
 import os
+import queue
 import time
-from dateutil import parser
-from typing import List, Tuple, Dict, Any, Optional
-import hashlib
-import json
-import unicodedata
-import jellyfish  # Pour la distance de Jaro-Winkler
-
-# ============================================================
-# STANDARDISATION INTELLIGENTE DES PRODUITS - MIS À JOUR
-# ============================================================
-
-# Liste officielle des produits mise à jour
-STANDARD_PRODUCTS = [
-    "Côte de Fianar Rouge 75 cl",
-    "Côte de Fianar Rouge 37 cl",
-    "Côte de Fianar Rouge 3L",
-    "Côte de Fianar Blanc 3L",
-    "Côte de Fianar Rosé 3L",
-    "Blanc doux Maroparasy 3L",
-    "Côte de Fianar Blanc 75 cl",
-    "Côte de Fianar Blanc 37 cl",
-    "Côte de Fianar Rosé 75 cl",
-    "Côte de Fianar Rosé 37 cl",
-    "Côte de Fianar Gris 75 cl",
-    "Côte de Fianar Gris 37 cl",
-    "Maroparasy Rouge 75 cl",
-    "Maroparasy Rouge 37 cl",
-    "Blanc doux Maroparasy 75 cl",
-    "Blanc doux Maroparasy 37 cl",
-    "Côteau d'Ambalavao Rouge 75 cl",
-    "Côteau d'Ambalavao Blanc 75 cl",
-    "Côteau d'Ambalavao Rosé 75 cl",
-    "Côteau d'Ambalavao Spécial 75 cl",
-    "Aperao Orange 75 cl",
-    "Aperao Pêche 75 cl",
-    "Aperao Ananas 75 cl",
-    "Aperao Epices 75 cl",
-    "Aperao Ratafia 75 cl",
-    "Aperao Eau de vie 75 cl",
-    "Aperao Eau de vie 37 cl",
-    "Vin de Champêtre 100 cl",
-    "Vin de Champêtre 50 cl",
-    "Jus de raisin Rouge 70 cl",
-    "Jus de raisin Rouge 20 cl",
-    "Jus de raisin Blanc 70 cl",
-    "Jus de raisin Blanc 20 cl",
-    "Rhum Sambatra 20 cl",
-    "Consignation Btl 75 cl",
-    # Ajout des nouveaux produits demandés
-    "Côte de Fianar Gris 3L",
-    "Côteau d'Ambalavao Special 75 cl",  # Alternative orthographe
-    "Aperao Peche 37 cl",  # Alternative orthographe
-    "Côteau d'Ambalavao Special 75 cl",  # Pour "Côteau d'Ambalavao Rouge" conversion
-    "Cuvee Speciale 75cls"  # Conversion demandée
-]
-
-# ============================================================
-# FONCTION POUR EXTRACTION DU NUMERO FACT MANUSCRIT
-# ============================================================
-def extract_fact_number_from_handwritten(text: str) -> str:
-    """Extrait le numéro après 'F' ou 'Fact' manuscrit - pour TOUS les BDC"""
-    if not text:
-        return ""
-    
-    # Normaliser le texte
-    text = text.replace('\n', ' ').replace('\r', ' ')
-    
-    # Chercher les motifs avec "Fact" ou "F" manuscrit suivi de chiffres
-    patterns = [
-        r'\bFact\s*[:.]?\s*(\d{4,})\b',      # Fact 12345 ou Fact: 12345
-        r'\bF\s*[:.]?\s*(\d{4,})\b',         # F 12345 ou F: 12345
-        r'\bfact\s*[:.]?\s*(\d{4,})\b',      # fact 12345 (minuscule)
-        r'\bf\s*[:.]?\s*(\d{4,})\b',         # f 12345 (minuscule)
-        r'Fact\.?\s*(\d{4,})',               # Fact.12345
-        r'F\.?\s*(\d{4,})',                  # F.12345
-    ]
-    
-    all_matches = []
-    for pattern in patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
-            number = match.group(1)
-            all_matches.append({
-                'number': number,
-                'pattern': pattern,
-                'position': match.start(),
-                'is_fact': 'fact' in pattern.lower()
-            })
-    
-    if not all_matches:
-        return ""
-    
-    # 1. Priorité aux matches qui contiennent "Fact" (pas juste "F")
-    fact_matches = [m for m in all_matches if m['is_fact']]
-    if fact_matches:
-        fact_matches.sort(key=lambda x: x['position'], reverse=True)
-        return fact_matches[0]['number']
-    
-    # 2. Sinon, prendre le dernier "F" trouvé
-    all_matches.sort(key=lambda x: x['position'], reverse=True)
-    return all_matches[0]['number']
-
-# ============================================================
-# FONCTION POUR EXTRACTION DU NOM MAGASIN DEPUIS "DOIT M :"
-# ============================================================
-def extract_motel_name_from_doit(text: str) -> str:
-    """
-    Extrait le nom du magasin après "DOIT M :" pour les factures CLIENT EN COMPTE
-    lorsque le client n'est pas ULYS, DLP, S2M
-    """
-    if not text:
-        return ""
-    
-    text_upper = text.upper()
-    
-    # Chercher le motif "DOIT M :" (avec variations)
-    patterns = [
-        r'DOIT\s+M\s*:\s*(.+)',
-        r'DOIT\s+M\s*:\s*(.+?)(?:\n|$)',
-        r'DOIT\s*M\s*:\s*(.+)',
-        r'DOIT\s*:\s*(.+?)(?:\n|$)',  # Fallback pour "DOIT :"
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-        if match:
-            motel_name = match.group(1).strip()
-            
-            # Nettoyer les caractères spéciaux
-            motel_name = re.sub(r'[\n\r\t]', ' ', motel_name)
-            motel_name = ' '.join(motel_name.split())
-            
-            # Retirer les espaces en trop et normaliser
-            motel_name = motel_name.strip()
-            
-            if motel_name:
-                return motel_name
-    
-    return ""
-
-# ============================================================
-# FONCTION POUR NETTOYER LE QUARTIER S2M
-# ============================================================
-def clean_quartier(quartier: str) -> str:
-    """Nettoie le nom du quartier pour S2M"""
-    if not quartier:
-        return ""
-    
-    # Supprimer les guillemets, deux-points, etc.
-    quartier = re.sub(r'["\'\[\]:]', '', quartier)
-    
-    # Supprimer "quartier_s2m" et variations
-    quartier = re.sub(r'quartier[_\-]?s2m', '', quartier, flags=re.IGNORECASE)
-    
-    # Nettoyer les espaces
-    quartier = ' '.join(quartier.split())
-    
-    return quartier.strip()
-
-# ============================================================
-# FONCTION POUR NETTOYER L'ADRESSE S2M
-# ============================================================
-def clean_adresse(adresse: str) -> str:
-    """Nettoie l'adresse extraite pour S2M"""
-    if not adresse:
-        return ""
-    
-    # Si l'adresse contient le format JSON-like
-    if '"quartier_s2m"' in adresse or "quartier_s2m" in adresse:
-        # Extraire juste le quartier
-        match = re.search(r'"quartier_s2m":\s*"([^"]+)"', adresse)
-        if match:
-            quartier = match.group(1)
-            return f"Supermaki {quartier}"
-        
-        # Autre format
-        match = re.search(r'quartier_s2m[":\s]+([^",}\]]+)', adresse)
-        if match:
-            quartier = match.group(1).strip()
-            quartier = clean_quartier(quartier)
-            return f"Supermaki {quartier}"
-    
-    # Si c'est déjà "Supermaki" suivi de quelque chose
-    if "Supermaki" in adresse:
-        # Nettoyer les caractères spéciaux
-        adresse = re.sub(r'["\'\[\]:]', ' ', adresse)
-        adresse = re.sub(r'\s+', ' ', adresse)
-        return adresse.strip()
-    
-    return adresse.strip()
-
-# Dictionnaire de synonymes et normalisations MIS À JOUR
-SYNONYMS = {
-    # Marques principales
-    "cote de fianar": "côte de fianar",
-    "cote de fianara": "côte de fianar",
-    "fianara": "fianar",
-    "fianar": "fianar",
-    "flanar": "fianar",
-    "côte de flanar": "côte de fianar",
-    "cote de flanar": "côte de fianar",
-    "coteau": "côteau",
-    "ambalavao": "ambalavao",
-    "coteau d'amb": "côteau d'ambalavao",
-    "coteau d'amb/vao": "côteau d'ambalavao",
-    "maroparasy": "maroparasy",
-    "maroparas": "maroparasy",
-    "aperao": "aperao",
-    "aperitif": "aperitif",
-    "sambatra": "sambatra",
-    "champetre": "champêtre",
-    
-    # Types de vins
-    "vin rouge": "rouge",
-    "vin blanc": "blanc",
-    "vin rose": "rosé",
-    "vin rosé": "rosé",
-    "vin gris": "gris",
-    "rouge doux": "rouge doux",
-    "blanc doux": "blanc doux",
-    "doux": "doux",
-    
-    # Abréviations communes
-    "btl": "",
-    "bouteille": "",
-    "nu": "",
-    "lp7": "",
-    "cl": "cl",
-    "ml": "ml",
-    "l": "l",
-    "cons": "",
-    "cons.": "",
-    "foul": "foui",
-    "chan foul": "chan foui",
-    "cons. chan foul": "consignation btl",
-    "cons chan foul": "consignation btl",
-    "cons.chan foui": "consignation btl",
-    "cons.chan foui 75cl": "consignation btl 75cl",
-    "cons chan foui 75cl": "consignation btl 75cl",
-    
-    # Unités
-    "750ml": "75 cl",
-    "750 ml": "75 cl",
-    "700ml": "70 cl",
-    "700 ml": "70 cl",
-    "370ml": "37 cl",
-    "370 ml": "37 cl",
-    "3000ml": "3l",
-    "3000 ml": "3l",
-    "3 l": "3l",
-    "3l": "3l",
-    "1000ml": "100 cl",
-    "1000 ml": "100 cl",
-    "500ml": "50 cl",
-    "500 ml": "50 cl",
-    "200ml": "20 cl",
-    "200 ml": "20 cl",
-    
-    # NOUVEAUX SYNONYMES POUR AMÉLIORATION
-    "coteau d'ambalavao rouge": "cuvee speciale 75cls",  # Conversion demandée
-    "coteau d ambalavao rouge": "cuvee speciale 75cls",
-    "ambalavao rouge": "cuvee speciale 75cls",
-    "coteau ambalavao rouge": "cuvee speciale 75cls",
-    "côteau d'ambalavao rouge": "cuvee speciale 75cls",
-    "côteau ambalavao rouge": "cuvee speciale 75cls",
-    
-    # Standardisation améliorée
-    "cote fianar": "côte de fianar",
-    "cote de fianar 3l": "côte de fianar 3l",
-    "cote fianar 3l": "côte de fianar 3l",
-    "maroparasy doux": "blanc doux maroparasy",
-    "maroparas doux": "blanc doux maroparasy",
-    "aperao peche": "aperao pêche",
-    "aperitif aperao": "aperao",
-    "vin champetre": "vin de champêtre",
-    "jus raisin": "jus de raisin",
-    "rhum": "sambatra",
-    "consignation": "consignation btl",
-}
-
-# Mapping des équivalences de volume
-VOLUME_EQUIVALENTS = {
-    "750": "75",
-    "750ml": "75",
-    "750 ml": "75",
-    "700": "70",
-    "700ml": "70",
-    "700 ml": "70",
-    "370": "37",
-    "370ml": "37",
-    "370 ml": "37",
-    "300": "3",
-    "3000": "3",
-    "3000ml": "3",
-    "3000 ml": "3",
-    "1000": "100",
-    "1000ml": "100",
-    "1000 ml": "100",
-    "500": "50",
-    "500ml": "50",
-    "500 ml": "50",
-    "200": "20",
-    "200ml": "20",
-    "200 ml": "20",
-    "75cl": "75",
-    "75 cl": "75",
-    "37cl": "37",
-    "37 cl": "37",
-    "70cl": "70",
-    "70 cl": "70",
-    "20cl": "20",
-    "20 cl": "20",
-    "100cl": "100",
-    "100 cl": "100",
-    "50cl": "50",
-    "50 cl": "50",
-}
-
-def preprocess_text(text: str) -> str:
-    """Prétraitement avancé du texte"""
-    if not text:
-        return ""
-    
-    # Convertir en minuscules
-    text = text.lower()
-    
-    # Supprimer les accents
-    text = unicodedata.normalize('NFD', text).encode('ascii', 'ignore').decode('ascii')
-    
-    # Remplacer les apostrophes et tirets
-    text = text.replace("'", " ").replace("-", " ").replace("_", " ").replace("/", " ")
-    
-    # Supprimer les caractères spéciaux (garder lettres, chiffres, espaces)
-    text = re.sub(r'[^a-z0-9\s]', ' ', text)
-    
-    # Remplacer les synonymes
-    words = text.split()
-    cleaned_words = []
-    for word in words:
-        if word in SYNONYMS:
-            replacement = SYNONYMS[word]
-            if replacement:  # Ne pas ajouter si le synonyme est vide
-                cleaned_words.append(replacement)
-        else:
-            cleaned_words.append(word)
-    
-    text = ' '.join(cleaned_words)
-    
-    # Supprimer les espaces multiples
-    text = re.sub(r'\s+', ' ', text).strip()
-    
-    return text
-
-def extract_volume_info(text: str) -> Tuple[str, Optional[str]]:
-    """Extrait et normalise l'information de volume"""
-    # Chercher des motifs de volume
-    volume_patterns = [
-        r'(\d+)\s*cl',
-        r'(\d+)\s*ml',
-        r'(\d+)\s*l',
-        r'(\d+)\s*litre',
-        r'(\d+)\s*litres',
-    ]
-    
-    volume = None
-    text_without_volume = text
-    
-    for pattern in volume_patterns:
-        matches = re.findall(pattern, text)
-        if matches:
-            volume = matches[0]
-            # Normaliser le volume
-            if 'ml' in pattern:
-                # Convertir ml en cl
-                try:
-                    ml = int(volume)
-                    if ml >= 1000:
-                        volume = f"{ml//100}l" if ml % 1000 == 0 else f"{ml/10:.0f} cl"
-                    else:
-                        volume = f"{ml/10:.0f} cl" if ml % 10 == 0 else f"{ml/10:.1f} cl"
-                except:
-                    pass
-            elif 'l' in pattern and 'cl' not in pattern and 'ml' not in pattern:
-                # Convertir litres en cl
-                try:
-                    liters = float(volume)
-                    if liters >= 1:
-                        volume = f"{liters:.0f}l" if liters.is_integer() else f"{liters}l"
-                except:
-                    pass
-            
-            # Supprimer le volume du texte pour faciliter la correspondance
-            text_without_volume = re.sub(pattern, '', text_without_volume)
-            break
-    
-    # Chercher aussi des volumes sans unité spécifique
-    if not volume:
-        match = re.search(r'\b(\d+)\b', text)
-        if match:
-            vol_num = match.group(1)
-            # Deviner l'unité basée sur la valeur
-            if vol_num in VOLUME_EQUIVALENTS:
-                volume = f"{VOLUME_EQUIVALENTS[vol_num]} cl"
-                text_without_volume = re.sub(r'\b' + vol_num + r'\b', '', text_without_volume)
-    
-    return text_without_volume.strip(), volume
-
-def extract_product_features(text: str) -> Dict[str, str]:
-    """Extrait les caractéristiques clés du produit"""
-    features = {
-        'type': '',
-        'marque': '',
-        'couleur': '',
-        'volume': '',
-        'original': text
-    }
-    
-    # Normaliser le texte
-    normalized = preprocess_text(text)
-    
-    # Extraire le volume
-    text_without_volume, volume = extract_volume_info(normalized)
-    if volume:
-        features['volume'] = volume
-    
-    # Détecter la couleur
-    colors = ['rouge', 'blanc', 'rose', 'gris', 'orange', 'peche', 'ananas', 'epices', 'ratafia']
-    for color in colors:
-        if color in text_without_volume:
-            features['couleur'] = color
-            text_without_volume = text_without_volume.replace(color, '')
-            break
-    
-    # Détecter le type
-    types = ['vin', 'jus', 'aperitif', 'eau de vie', 'cuvee', 'cuvee special', 'special', 'consigne']
-    for type_ in types:
-        if type_ in text_without_volume:
-            features['type'] = type_
-            text_without_volume = text_without_volume.replace(type_, '')
-            break
-    
-    # Détecter la marque
-    marques = [
-        ('cote de fianar', 'côte de fianar'),
-        ('maroparasy', 'maroparasy'),
-        ('coteau d ambalavao', 'côteau d\'ambalavao'),
-        ('ambalavao', 'côteau d\'ambalavao'),
-        ('aperao', 'aperao'),
-        ('champetre', 'vin de champêtre'),
-        ('sambatra', 'sambatra'),
-        ('chan foui', 'chan foui'),
-    ]
-    
-    for marque_pattern, marque_std in marques:
-        if marque_pattern in text_without_volume:
-            features['marque'] = marque_std
-            text_without_volume = text_without_volume.replace(marque_pattern, '')
-            break
-    
-    # Nettoyer le texte restant
-    text_without_volume = re.sub(r'\s+', ' ', text_without_volume).strip()
-    if text_without_volume:
-        features['autres'] = text_without_volume
-    
-    return features
-
-def calculate_similarity_score(features1: Dict, features2: Dict) -> float:
-    """Calcule un score de similarité entre deux ensembles de caractéristiques"""
-    score = 0.0
-    max_score = 0.0
-    
-    # Poids pour chaque caractéristique
-    weights = {
-        'marque': 0.4,
-        'couleur': 0.3,
-        'volume': 0.2,
-        'type': 0.1,
-    }
-    
-    for key, weight in weights.items():
-        if features1.get(key) and features2.get(key):
-            if features1[key] == features2[key]:
-                score += weight
-            # Similarité partielle pour les couleurs (rose/rosé)
-            elif key == 'couleur':
-                if ('rose' in features1[key] and 'rosé' in features2[key]) or \
-                   ('rosé' in features1[key] and 'rose' in features2[key]):
-                    score += weight * 0.8
-        max_score += weight
-    
-    # Bonus pour correspondance exacte du volume
-    if features1.get('volume') and features2.get('volume'):
-        if features1['volume'] == features2['volume']:
-            score += 0.1
-            max_score += 0.1
-    
-    return score / max_score if max_score > 0 else 0.0
-
-def find_best_match(ocr_designation: str, standard_products: List[str]) -> Tuple[Optional[str], float]:
-    """
-    Trouve le meilleur match pour une désignation OCR
-    
-    Returns:
-        Tuple (produit_standard, score_confidence)
-    """
-    # Prétraiter la désignation OCR
-    ocr_features = extract_product_features(ocr_designation)
-    
-    best_match = None
-    best_score = 0.0
-    
-    # Pré-calculer les caractéristiques des produits standards
-    standard_features = []
-    for product in standard_products:
-        std_features = extract_product_features(product)
-        standard_features.append((product, std_features))
-    
-    # Chercher le meilleur match
-    for product, std_features in standard_features:
-        score = calculate_similarity_score(ocr_features, std_features)
-        
-        # Bonus pour correspondance exacte (après normalisation)
-        ocr_normalized = preprocess_text(ocr_designation)
-        std_normalized = preprocess_text(product)
-        
-        # Utiliser Jaro-Winkler pour la similarité textuelle
-        jaro_score = jellyfish.jaro_winkler_similarity(ocr_normalized, std_normalized)
-        
-        # Combiner les scores
-        combined_score = (score * 0.7) + (jaro_score * 0.3)
-        
-        if combined_score > best_score:
-            best_score = combined_score
-            best_match = product
-    
-    # Seuil de confiance minimum
-    if best_score < 0.6:
-        return None, best_score
-    
-    return best_match, best_score
-
-def intelligent_product_matcher(ocr_designation: str) -> Tuple[Optional[str], float, Dict]:
-    """
-    Standardise intelligemment une désignation produit OCR
-    
-    Returns:
-        Tuple (produit_standard, score_confidence, details)
-    """
-    details = {
-        'original': ocr_designation,
-        'features': {},
-        'matches': []
-    }
-    
-    # 1. Extraction des caractéristiques
-    features = extract_product_features(ocr_designation)
-    details['features'] = features
-    
-    # 2. Recherche du meilleur match
-    best_match, confidence = find_best_match(ocr_designation, STANDARD_PRODUCTS)
-    
-    # 3. Calcul des alternatives (top 3)
-    alternatives = []
-    for product in STANDARD_PRODUCTS:
-        product_features = extract_product_features(product)
-        score = calculate_similarity_score(features, product_features)
-        jaro_score = jellyfish.jaro_winkler_similarity(
-            preprocess_text(ocr_designation),
-            preprocess_text(product)
-        )
-        combined_score = (score * 0.7) + (jaro_score * 0.3)
-        
-        if combined_score >= 0.4:  # Seuil bas pour voir les alternatives
-            alternatives.append((product, combined_score))
-    
-    # Trier par score décroissant
-    alternatives.sort(key=lambda x: x[1], reverse=True)
-    details['matches'] = alternatives[:3]  # Top 3 seulement
-    
-    return best_match, confidence, details
-
-# ============================================================
-# FONCTION AMÉLIORÉE DE STANDARDISATION
-# ============================================================
-def standardize_product_name_improved(product_name: str) -> Tuple[str, float, str]:
-    """
-    Standardise le nom du produit avec score de confiance
-    
-    Args:
-        product_name: Nom du produit issu de l'OCR
-        
-    Returns:
-        Tuple (nom_standardisé, score_confiance, status)
-    """
-    if not product_name or not product_name.strip():
-        return "", 0.0, "empty"
-    
-    # Essayer d'abord avec le matching intelligent
-    best_match, confidence, details = intelligent_product_matcher(product_name)
-    
-    if best_match and confidence >= 0.7:
-        return best_match, confidence, "matched"
-    elif best_match and confidence >= 0.6:
-        # Match à confiance moyenne
-        return best_match, confidence, "partial_match"
-    else:
-        # Aucun bon match trouvé
-        return product_name.title(), confidence, "no_match"
-
-# ============================================================
-# FONCTION DE STANDARDISATION SPÉCIFIQUE POUR BDC
-# ============================================================
-def standardize_product_for_bdc(product_name: str) -> Tuple[str, str, float, str]:
-    """
-    Standardise spécifiquement pour les produits BDC ULYS
-    
-    Returns:
-        Tuple (produit_brut, produit_standard, confidence, status)
-    """
-    # Garder le produit brut original
-    produit_brut = product_name.strip()
-    
-    # Standardiser avec la méthode améliorée
-    produit_standard, confidence, status = standardize_product_name_improved(product_name)
-    
-    # Corrections spécifiques pour ULYS
-    produit_upper = produit_brut.upper()
-    
-    # Gestion spéciale pour "CONS. CHAN FOUI 75CL" - FILTRE 2
-    if "CONS" in produit_upper and "CHAN" in produit_upper and "FOUI" in produit_upper:
-        # Remplacer par "Consignation btl 75cl"
-        if "75" in produit_upper or "750" in produit_upper:
-            produit_standard = "Consignation btl 75cl"
-        else:
-            produit_standard = "Consignation btl"
-        confidence = 0.95
-        status = "matched"
-    
-    # Gestion spéciale pour les vins avec "NU"
-    if "NU" in produit_upper and "750" in produit_upper:
-        # Essayer de déterminer le type exact
-        if "ROUGE" in produit_upper and "FIANAR" in produit_upper:
-            produit_standard = "Côte de Fianar Rouge 75 cl"
-            confidence = 0.9
-            status = "matched"
-        elif "BLANC" in produit_upper and "FIANAR" in produit_upper:
-            produit_standard = "Côte de Fianar Blanc 75 cl"
-            confidence = 0.9
-            status = "matched"
-        elif "GRIS" in produit_upper and "FIANAR" in produit_upper:
-            produit_standard = "Côte de Fianar Gris 75 cl"
-            confidence = 0.9
-            status = "matched"
-        elif "ROUGE" in produit_upper and "MAROPARASY" in produit_upper:
-            produit_standard = "Maroparasy Rouge 75 cl"
-            confidence = 0.9
-            status = "matched"
-        elif "BLANC" in produit_upper and "MAROPARASY" in produit_upper:
-            produit_standard = "Blanc doux Maroparasy 75 cl"
-            confidence = 0.9
-            status = "matched"
-    
-    # Gestion spéciale pour les 3L
-    if "3L" in produit_upper or "3 L" in produit_upper:
-        if "ROUGE" in produit_upper and "FIANAR" in produit_upper:
-            produit_standard = "Côte de Fianar Rouge 3L"
-            confidence = 0.9
-            status = "matched"
-        elif "BLANC" in produit_upper and "FIANAR" in produit_upper:
-            produit_standard = "Côte de Fianar Blanc 3L"
-            confidence = 0.9
-            status = "matched"
-        elif "ROSE" in produit_upper and "FIANAR" in produit_upper:
-            produit_standard = "Côte de Fianar Rosé 3L"
-            confidence = 0.9
-            status = "matched"
-        elif "GRIS" in produit_upper and "FIANAR" in produit_upper:
-            produit_standard = "Côte de Fianar Gris 3L"
-            confidence = 0.9
-            status = "matched"
-    
-    # CONVERSION SPÉCIFIQUE DEMANDÉE : "Coteau d'Ambalavao Rouge" -> "Cuvee Speciale 75cls"
-    if "COTEAU" in produit_upper and "AMBALAVAO" in produit_upper and "ROUGE" in produit_upper:
-        produit_standard = "Cuvee Speciale 75cls"
-        confidence = 0.95
-        status = "matched"
-    
-    # Standardisation améliorée pour les produits avec fautes d'orthographe
-    if "COTEAU" in produit_upper and "DAMBALAVAO" in produit_upper:
-        if "ROUGE" in produit_upper:
-            produit_standard = "Cuvee Speciale 75cls"
-            confidence = 0.9
-            status = "matched"
-        elif "BLANC" in produit_upper:
-            produit_standard = "Côteau d'Ambalavao Blanc 75 cl"
-            confidence = 0.9
-            status = "matched"
-        elif "ROSE" in produit_upper:
-            produit_standard = "Côteau d'Ambalavao Rosé 75 cl"
-            confidence = 0.9
-            status = "matched"
-    
-    # Standardisation pour Aperao Peche
-    if "APERAO" in produit_upper and "PECHE" in produit_upper:
-        if "37" in produit_upper or "370" in produit_upper:
-            produit_standard = "Aperao Peche 37 cl"
-        else:
-            produit_standard = "Aperao Pêche 75 cl"
-        confidence = 0.9
-        status = "matched"
-    
-    # Standardisation pour Côteau d'Ambalavao Special
-    if "COTEAU" in produit_upper and "AMBALAVAO" in produit_upper and "SPECIAL" in produit_upper:
-        produit_standard = "Côteau d'Ambalavao Special 75 cl"
-        confidence = 0.9
-        status = "matched"
-    
-    return produit_brut, produit_standard, confidence, status
+from concurrent.futures import wait
+from typing import List
+
+from chanfoui.backends import DEFAULT_OCR_BACKEND, OCR_BACKENDS
+from chanfoui.dedup import describe_document, get_document_index, index_document, phash
+from chanfoui.documents import (
+    clean_adresse,
+    detect_document_type_from_text,
+    extract_fact_number_from_handwritten,
+    extract_motel_name_from_doit,
+    format_date_french,
+    get_month_from_date,
+    map_client,
+    normalize_document_type,
+    prepare_rows_for_sheet,
+    sheet_columns,
+)
+from chanfoui.images import DOCUMENT_CORRECTION, load_document_pages
+from chanfoui.matching import (
+    CATEGORY_CODE_MARKERS,
+    CATEGORY_MARKERS,
+    build_standardized_articles_df,
+    standardize_product_for_bdc,
+    standardize_product_name_improved,
+)
+from chanfoui import ocr
+from chanfoui.ocr import ANALYSIS_CONTEXT_KEYS, new_analysis_context
+from chanfoui.pipeline import (
+    PIPELINE_STAGES,
+    analyze_pages,
+    build_articles_df,
+    build_sheet_data,
+    build_streamed_articles_df,
+    resolve_document_type,
+)
+from chanfoui.scheduler import OCRScheduler
+from chanfoui.sheets import (
+    SHEET_GIDS,
+    SHEET_ID,
+    check_for_duplicates,
+    find_table_range,
+    get_worksheet_by_gid,
+    open_spreadsheet,
+)
 
 # ============================================================
 # CONFIGURATION STREAMLIT
@@ -756,8 +75,8 @@ if "locked_until" not in st.session_state:
 # Initialisation des états pour l'application principale
 if "uploaded_file" not in st.session_state:
     st.session_state.uploaded_file = None
-if "uploaded_image" not in st.session_state:
-    st.session_state.uploaded_image = None
+if "document_pages" not in st.session_state:
+    st.session_state.document_pages = []
 if "ocr_result" not in st.session_state:
     st.session_state.ocr_result = None
 if "show_results" not in st.session_state:
@@ -798,6 +117,12 @@ if "nom_magasin_ulys" not in st.session_state:
     st.session_state.nom_magasin_ulys = ""
 if "fact_manuscrit" not in st.session_state:
     st.session_state.fact_manuscrit = ""
+if "document_fingerprint" not in st.session_state:
+    st.session_state.document_fingerprint = None
+if "near_duplicates" not in st.session_state:
+    st.session_state.near_duplicates = []
+if "image_metrics" not in st.session_state:
+    st.session_state.image_metrics = {}
 
 # ============================================================
 # FONCTION DE NORMALISATION DES PRODUITS (COMPATIBILITÉ)
@@ -856,7 +181,7 @@ def logout():
     st.session_state.authenticated = False
     st.session_state.username = ""
     st.session_state.uploaded_file = None
-    st.session_state.uploaded_image = None
+    st.session_state.document_pages = []
     st.session_state.ocr_result = None
     st.session_state.show_results = False
     st.session_state.detected_document_type = None
@@ -1709,856 +1034,26 @@ st.markdown(f"""
 </style>
 """, unsafe_allow_html=True)
 
-# ============================================================
-# GOOGLE SHEETS CONFIGURATION - VERSION PRODUCTION
-# ============================================================
-SHEET_ID = "1h4xT-cw9Ys1HbkhMWVtRnDOxsZ0fBOaskjPgRyIj3K8"
-
-SHEET_GIDS = {
-    "FACTURE EN COMPTE": 541435939,
-    "BDC LEADERPRICE": 541435939,
-    "BDC S2M": 541435939,
-    "BDC ULYS": 541435939
-}
-
-# ============================================================
-# FONCTION DE NORMALISATION DU TYPE DE DOCUMENT - VERSION AMÉLIORÉE V1.1
-# ============================================================
-def normalize_document_type(doc_type: str) -> str:
-    """Normalise le type de document pour correspondre aux clés SHEET_GIDS - VERSION AMÉLIORÉE V1.1"""
-    if not doc_type:
-        return "DOCUMENT INCONNU"
-    
-    doc_type_upper = doc_type.upper()
-    
-    facture_keywords = [
-        "FACTURE", "INVOICE", "BILL", "FACTURA",
-        "FACTURE EN COMPTE", "FACTURE N°", "FACTURE NO",
-        "DOIT", "AU NOM DE", "NOM DU CLIENT", "N° FACTURE"
-    ]
-    
-    bdc_keywords = [
-        "BDC", "BON DE COMMANDE", "ORDER", "COMMANDE",
-        "BON COMMANDE", "PURCHASE ORDER", "PO",
-        "DATE ÉMISSION", "DATE EMISSION", "BON DE COMMANDE N°"
-    ]
-    
-    facture_score = sum(1 for keyword in facture_keywords if keyword in doc_type_upper)
-    bdc_score = sum(1 for keyword in bdc_keywords if keyword in doc_type_upper)
-    
-    if facture_score > bdc_score:
-        return "FACTURE EN COMPTE"
-    
-    elif bdc_score > facture_score:
-        if "LEADERPRICE" in doc_type_upper or "DLP" in doc_type_upper:
-            return "BDC LEADERPRICE"
-        elif "ULYS" in doc_type_upper:
-            return "BDC ULYS"
-        elif "S2M" in doc_type_upper or "SUPERMAKI" in doc_type_upper:
-            return "BDC S2M"
-        else:
-            return "BDC LEADERPRICE"
-    
-    else:
-        if "FACTURE" in doc_type_upper and "COMPTE" in doc_type_upper:
-            return "FACTURE EN COMPTE"
-        elif "BDC" in doc_type_upper or "BON DE COMMANDE" in doc_type_upper:
-            if "LEADERPRICE" in doc_type_upper or "DLP" in doc_type_upper:
-                return "BDC LEADERPRICE"
-            elif "S2M" in doc_type_upper or "SUPERMAKI" in doc_type_upper:
-                return "BDC S2M"
-            elif "ULYS" in doc_type_upper:
-                return "BDC ULYS"
-            else:
-                return "BDC LEADERPRICE"
-        else:
-            if any(word in doc_type_upper for word in ["FACTURE", "INVOICE", "BILL", "DOIT"]):
-                return "FACTURE EN COMPTE"
-            elif any(word in doc_type_upper for word in ["COMMANDE", "ORDER", "PO", "BDC"]):
-                return "BDC LEADERPRICE"
-            else:
-                return "DOCUMENT INCONNU"
 
 # ============================================================
 # OPENAI CONFIGURATION
 # ============================================================
 def get_openai_client():
-    """Initialise et retourne le client OpenAI"""
+    """Client OpenAI partagé par les sessions (clé lue dans les secrets Streamlit si présente)"""
     try:
-        if "openai" in st.secrets:
-            api_key = st.secrets["openai"]["api_key"]
-        else:
-            api_key = os.environ.get("OPENAI_API_KEY")
-        
-        if not api_key:
-            st.error("❌ Clé API OpenAI non configurée")
-            return None
-        
-        client = OpenAI(api_key=api_key)
-        return client
+        api_key = st.secrets["openai"]["api_key"] if "openai" in st.secrets else None
+        return ocr.get_openai_client(api_key)
+    except RuntimeError as e:
+        st.error(f"❌ {str(e)}")
+        return None
     except Exception as e:
         st.error(f"❌ Erreur d'initialisation OpenAI: {str(e)}")
         return None
 
-# ============================================================
-# FONCTION DE DÉTECTION PRÉCISE DU TYPE DE DOCUMENT
-# ============================================================
-def detect_document_type_from_text(text: str) -> Dict[str, Any]:
-    """Détecte précisément le type de document basé sur les indices fournis"""
-    text_upper = text.upper()
-    
-    dlp_indicators = [
-        "DISTRIBUTION LEADER PRICE",
-        "D.L.P.M.S.A.R.L",
-        "NIF : 2000003904",
-        "2000003904"
-    ]
-    
-    s2m_indicators = [
-        "SUPERMAKI",
-        "RAYON"
-    ]
-    
-    ulys_indicators = [
-        "BON DE COMMANDE FOURNISSEUR",
-        "NOM DU MAGASIN"
-    ]
-    
-    facture_indicators = [
-        "FACTURE EN COMPTE",
-        "FACTURE À PAYER AVANT LE",
-        "FACTURE A PAYER AVANT LE"
-    ]
-    
-    dlp_score = sum(1 for indicator in dlp_indicators if indicator in text_upper)
-    s2m_score = sum(1 for indicator in s2m_indicators if indicator in text_upper)
-    ulys_score = sum(1 for indicator in ulys_indicators if indicator in text_upper)
-    facture_score = sum(1 for indicator in facture_indicators if indicator in text_upper)
-    
-    detection_result = {
-        "type": "UNKNOWN",
-        "scores": {
-            "DLP": dlp_score,
-            "S2M": s2m_score,
-            "ULYS": ulys_score,
-            "FACTURE": facture_score
-        },
-        "indicators_found": []
-    }
-    
-    max_score = max(dlp_score, s2m_score, ulys_score, facture_score)
-    
-    if max_score == 0:
-        detection_result["type"] = "UNKNOWN"
-    elif dlp_score == max_score:
-        detection_result["type"] = "DLP"
-        detection_result["indicators_found"] = [ind for ind in dlp_indicators if ind in text_upper]
-    elif s2m_score == max_score:
-        detection_result["type"] = "S2M"
-        detection_result["indicators_found"] = [ind for ind in s2m_indicators if ind in text_upper]
-        
-        if "SUPERMAKI" in text_upper:
-            lines = text.split('\n')
-            for i, line in enumerate(lines):
-                if "SUPERMAKI" in line.upper():
-                    if i + 1 < len(lines):
-                        next_line = lines[i + 1].strip()
-                        if next_line and len(next_line) > 0:
-                            st.session_state.quartier_s2m = next_line
-                            break
-    elif ulys_score == max_score:
-        detection_result["type"] = "ULYS"
-        detection_result["indicators_found"] = [ind for ind in ulys_indicators if ind in text_upper]
-        
-        if "NOM DU MAGASIN" in text_upper:
-            lines = text.split('\n')
-            for i, line in enumerate(lines):
-                if "NOM DU MAGASIN" in line.upper():
-                    if i + 1 < len(lines):
-                        next_line = lines[i + 1].strip()
-                        if next_line and len(next_line) > 0:
-                            st.session_state.nom_magasin_ulys = next_line
-                            break
-    elif facture_score == max_score:
-        detection_result["type"] = "FACTURE"
-        detection_result["indicators_found"] = [ind for ind in facture_indicators if ind in text_upper]
-    
-    return detection_result
-
-# ============================================================
-# FONCTIONS OCR AMÉLIORÉES POUR MEILLEURE DÉTECTION - V1.3
-# ============================================================
-def extract_text_features_for_detection(text: str) -> Dict[str, Any]:
-    """Extrait les caractéristiques du texte pour aider à la détection du type de document"""
-    text_upper = text.upper()
-    
-    features = {
-        'has_facture': False,
-        'has_bdc': False,
-        'facture_keywords': [],
-        'bdc_keywords': [],
-        'facture_score': 0,
-        'bdc_score': 0
-    }
-    
-    facture_keywords = [
-        "FACTURE", "FACTURE EN COMPTE", "N° FACTURE", "NUMERO FACTURE",
-        "DOIT", "AU NOM DE", "CLIENT", "ADRESSE DE LIVRAISON",
-        "SUIVANT VOTRE BON DE COMMANDE", "BON DE COMMANDE",
-        "QUANTITE", "BOUTEILLES", "MONTANT", "TOTAL", "TVA"
-    ]
-    
-    bdc_keywords = [
-        "BDC", "BON DE COMMANDE", "COMMANDE", "DATE EMISSION",
-        "DATE ÉMISSION", "ADRESSE FACTURATION", "ADRESSE LIVRAISON",
-        "DESIGNATION", "QTÉ", "QUANTITE", "ARTICLE", "REFERENCE",
-        "CODE ARTICLE", "PRIX UNITAIRE", "SOUS TOTAL"
-    ]
-    
-    for keyword in facture_keywords:
-        if keyword in text_upper:
-            features['facture_keywords'].append(keyword)
-            features['facture_score'] += 1
-            features['has_facture'] = True
-    
-    for keyword in bdc_keywords:
-        if keyword in text_upper:
-            features['bdc_keywords'].append(keyword)
-            features['bdc_score'] += 1
-            features['has_bdc'] = True
-    
-    if "FACTURE" in text_upper and "COMPTE" in text_upper:
-        features['facture_score'] += 3
-    
-    if "BDC" in text_upper or "BON DE COMMANDE" in text_upper:
-        features['bdc_score'] += 2
-    
-    if "DOIT" in text_upper:
-        features['facture_score'] += 2
-    
-    if "DATE EMISSION" in text_upper or "DATE ÉMISSION" in text_upper:
-        features['bdc_score'] += 2
-    
-    return features
-
-def openai_vision_ocr_improved(image_bytes: bytes) -> Dict:
-    """Utilise OpenAI Vision pour analyser le document avec un prompt amélioré pour la détection V1.3"""
-    try:
-        client = get_openai_client()
-        if not client:
-            return None
-        
-        base64_image = encode_image_to_base64(image_bytes)
-        
-        # PROMPT AMÉLIORÉ AVEC EXTRACTION "DOIT M :"
-        prompt = """
-        ANALYSE CE DOCUMENT ET EXTRACT LES INFORMATIONS SUIVANTES:
-
-        IMPORTANT RÈGLE SPÉCIALE POUR LES BONS DE COMMANDE (BDC):
-        - Pour TOUS les BDC (DLP, S2M, ULYS), cherche TOUJOURS le numéro manuscrit écrit à la main
-        - Ce numéro est généralement écrit après "F" ou "Fact" (exemple: Fact 251193 → 251193)
-        - Il se trouve souvent en haut à droite de l'entête, parfois sur le côté droit
-        - Si tu vois deux valeurs manuscrites différentes (ex: f 4567 et Fact 7890), 
-          prends TOUJOURS la valeur de Fact 7890 (donc 7890)
-        - Si aucun "F" ou "Fact" manuscrit n'est trouvé, laisse ce champ vide
-        
-        IMPORTANT RÈGLE SPÉCIALE POUR LES FACTURES:
-        - Pour les FACTURES EN COMPTE, cherche le texte après "DOIT M :" ou "DOIT M:"
-        - Ce texte contient le nom du magasin/client
-        - Exemple: "DOIT M : Motel d'Antananarivo -anosy- Antananarivo" → 
-          doit_m = "Motel d'Antananarivo -anosy- Antananarivo"
-        
-        Pour TOUS les documents, extrais:
-        {
-            "type_document": "BDC" ou "FACTURE",
-            "document_subtype": "DLP", "S2M", "ULYS", ou "FACTURE",
-            "client": "...",
-            "adresse_livraison": "...",
-            "quartier_s2m": "...",  (uniquement si S2M: le quartier sous "SUPERMAKI")
-            "nom_magasin_ulys": "...",  (uniquement si ULYS: le nom du magasin)
-            "doit_m": "...",  (uniquement si FACTURE: texte après "DOIT M :")
-            "fact_manuscrit_trouve": "oui" ou "non",
-            "fact_manuscrit": "...",  (le numéro exact après F ou Fact, SANS le F/Fact)
-        }
-        
-        Puis selon le type:
-        
-        1. SI C'EST UNE FACTURE (FACTURE EN COMPTE):
-            "numero_facture": "...",
-            "date": "...",  (IMPORTANT: extraire la date de la facture, pas la date du scan)
-            "bon_commande": "...",
-            "articles": [
-                {
-                    "article_brut": "TEXT EXACT de l'article (colonne 'Désignation')",
-                    "quantite": nombre  (colonne 'Nb bills', PAS 'Btlls/colis')
-                }
-            ]
-        
-        2. SI C'EST UN BDC (DLP, S2M, ULYS):
-            "numero": "...",  (IMPORTANT: utiliser TOUJOURS le fact_manuscrit si disponible, sinon vide)
-            "date": "...",  (IMPORTANT: extraire la date du BDC, pas la date du scan)
-            "articles": [
-                {
-                    "article_brut": "TEXT EXACT de la colonne Désignation",
-                    "quantite": nombre
-                }
-            ]
-        
-        RÈGLES SPÉCIFIQUES POUR CHAQUE TYPE:
-        • DLP: client = "DLP", adresse = "Leader Price Akadimbahoaka"  (TOUJOURS CETTE ADRESSE POUR DLP)
-        • S2M: client = "S2M", adresse = "Supermaki " + quartier_s2m (nettoyer format)
-        • ULYS: client = "ULYS", adresse = nom_magasin_ulys
-        • FACTURE: 
-          - Pour les colonnes: utiliser "Désignation" pour article_brut et "Nb bills" pour quantité
-          - Si le client est "Autre client" (pas DLP, ULYS ou S2M), forcer client = adresse
-          - NOUVEAU: Si "doit_m" est présent, utiliser doit_m pour client et adresse
-        
-        IMPORTANT POUR LES FACTURES:
-        - Utiliser la colonne "Désignation" pour les articles
-        - Utiliser la colonne "Nb bills" pour la quantité (PAS "Btlls/colis")
-        
-        INDICES DÉCISIFS:
-        • "DISTRIBUTION LEADER PRICE" = TOUJOURS DLP
-        • "SUPERMAKI" = TOUJOURS S2M
-        • "BON DE COMMANDE FOURNISSEUR" = TOUJOURS ULYS
-        • "FACTURE EN COMPTE" = TOUJOURS FACTURE
-        • "DOIT M :" = TOUJOURS EXTRAIRE LE TEXTE APRÈS
-        
-        EXEMPLE CORRECT POUR UNE FACTURE:
-        Si tu vois "DOIT M : Motel d'Antananarivo -anosy- Antananarivo" → 
-        "doit_m": "Motel d'Antananarivo -anosy- Antananarivo"
-        Si client n'est pas DLP, ULYS, S2M → 
-        "client": "Motel d'Antananarivo -anosy- Antananarivo"
-        "adresse_livraison": "Motel d'Antananarivo -anosy- Antananarivo"
-        
-        IMPORTANT POUR LA DATE: 
-        - Extraire la date qui est écrite sur le document (facture ou BDC)
-        - Ne pas utiliser la date actuelle ou une date estimée
-        - Formater la date en format clair (ex: 15/01/2024)
-        """
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=4000,
-            temperature=0.1
-        )
-        
-        content = response.choices[0].message.content
-        
-        st.session_state.ocr_raw_text = content
-        
-        json_match = re.search(r'\{.*\}', content, re.DOTALL)
-        if json_match:
-            json_str = json_match.group()
-            try:
-                data = json.loads(json_str)
-                
-                document_subtype = data.get("document_subtype", "").upper()
-                
-                if document_subtype in ["DLP", "S2M", "ULYS"]:
-                    fact_manuscrit = data.get("fact_manuscrit", "")
-                    
-                    st.session_state.fact_manuscrit = fact_manuscrit
-                    
-                    data["numero"] = fact_manuscrit
-                
-                # CORRECTION DLP: FORCER L'ADRESSE À "Leader Price Akadimbahoaka"
-                if document_subtype == "DLP":
-                    data["client"] = "DLP"
-                    data["adresse_livraison"] = "Leader Price Akadimbahoaka"
-                
-                # Correction S2M
-                elif document_subtype == "S2M":
-                    data["client"] = "S2M"
-                    quartier = data.get("quartier_s2m", "")
-                    if quartier:
-                        quartier_nettoye = clean_quartier(quartier)
-                        adresse_nettoyee = clean_adresse(f"Supermaki {quartier_nettoye}")
-                        data["adresse_livraison"] = adresse_nettoyee
-                        st.session_state.quartier_s2m = quartier_nettoye
-                    else:
-                        adresse = data.get("adresse_livraison", "")
-                        data["adresse_livraison"] = clean_adresse(adresse) if adresse else "Supermaki"
-                
-                # Correction ULYS
-                elif document_subtype == "ULYS":
-                    data["client"] = "ULYS"
-                    nom_magasin = data.get("nom_magasin_ulys", "")
-                    if nom_magasin:
-                        data["adresse_livraison"] = nom_magasin
-                        st.session_state.nom_magasin_ulys = nom_magasin
-                    else:
-                        data["adresse_livraison"] = "ULYS Magasin"
-                
-                # NOUVELLE CORRECTION: Pour les factures avec "doit_m", forcer client = adresse = doit_m
-                elif document_subtype == "FACTURE":
-                    client_value = data.get("client", "").upper()
-                    adresse_value = data.get("adresse_livraison", "")
-                    doit_m = data.get("doit_m", "")
-                    
-                    # Si le client n'est pas DLP, ULYS, S2M et on a un doit_m
-                    if client_value not in ["DLP", "ULYS", "S2M"] and doit_m:
-                        data["client"] = doit_m
-                        data["adresse_livraison"] = doit_m
-                    # Si le client n'est pas DLP, ULYS, S2M (même sans doit_m)
-                    elif client_value not in ["DLP", "ULYS", "S2M"]:
-                        data["client"] = adresse_value
-                
-                return data
-                
-            except json.JSONDecodeError:
-                json_str = re.sub(r'[\x00-\x1f\x7f]', '', json_str)
-                try:
-                    data = json.loads(json_str)
-                    return data
-                except:
-                    return guess_document_type_from_text(content)
-        else:
-            return guess_document_type_from_text(content)
-            
-    except Exception as e:
-        st.error(f"❌ Erreur OpenAI Vision: {str(e)}")
-        return None
-
-def guess_document_type_from_text(text: str) -> Dict:
-    """Devine le type de document à partir du texte OCR"""
-    detection = detect_document_type_from_text(text)
-    
-    fact_manuscrit = extract_fact_number_from_handwritten(text)
-    
-    if detection["type"] == "DLP":
-        return {
-            "type_document": "BDC",
-            "document_subtype": "DLP",
-            "client": "DLP",
-            "adresse_livraison": "Leader Price Akadimbahoaka",
-            "fact_manuscrit": fact_manuscrit,
-            "numero": fact_manuscrit,
-            "articles": []
-        }
-    elif detection["type"] == "S2M":
-        quartier = st.session_state.quartier_s2m or ""
-        return {
-            "type_document": "BDC",
-            "document_subtype": "S2M",
-            "client": "S2M",
-            "adresse_livraison": clean_adresse(f"Supermaki {quartier}" if quartier else "Supermaki"),
-            "fact_manuscrit": fact_manuscrit,
-            "numero": fact_manuscrit,
-            "articles": []
-        }
-    elif detection["type"] == "ULYS":
-        nom_magasin = st.session_state.nom_magasin_ulys or ""
-        return {
-            "type_document": "BDC",
-            "document_subtype": "ULYS",
-            "client": "ULYS",
-            "adresse_livraison": nom_magasin if nom_magasin else "ULYS Magasin",
-            "fact_manuscrit": fact_manuscrit,
-            "numero": fact_manuscrit,
-            "articles": []
-        }
-    elif detection["type"] == "FACTURE":
-        return {
-            "type_document": "FACTURE",
-            "document_subtype": "FACTURE",
-            "articles": []
-        }
-    else:
-        features = extract_text_features_for_detection(text)
-        
-        if features['facture_score'] > features['bdc_score']:
-            return {"type_document": "FACTURE", "document_subtype": "FACTURE", "articles": []}
-        else:
-            return {"type_document": "BDC", "document_subtype": "UNKNOWN", "fact_manuscrit": fact_manuscrit, "numero": fact_manuscrit, "articles": []}
-#=============================================================
-def analyze_document_with_backup(image_bytes: bytes) -> Dict:
-    """Analyse le document avec vérification de cohérence - VERSION MISE À JOUR"""
-    
-    result = openai_vision_ocr_improved(image_bytes)
-    
-    if not result:
-        return {"type_document": "DOCUMENT INCONNU", "articles": []}
-
-    ocr_text = st.session_state.ocr_raw_text or ""
-
-    # ============================================================
-    # 1. CAS BDC : extraction numéro manuscrit
-    # ============================================================
-    if ocr_text and result.get("type_document") == "BDC":
-        fact_manuscrit = extract_fact_number_from_handwritten(ocr_text)
-        
-        if fact_manuscrit and not result.get("fact_manuscrit"):
-            result["fact_manuscrit"] = fact_manuscrit
-            result["numero"] = fact_manuscrit
-            
-            st.session_state.document_analysis_details = {
-                "action": "Fact manuscrit extrait du texte brut",
-                "fact": fact_manuscrit
-            }
-
-    # ============================================================
-    # 2. CAS FACTURE : règle métier DOIT M (VERSION SÉCURISÉE)
-    # ============================================================
-    if ocr_text and result.get("type_document") == "FACTURE":
-        client_upper = result.get("client", "").upper()
-        adresse_upper = result.get("adresse_livraison", "").upper()
-
-        clients_bloques = ["DLP", "ULYS", "S2M"]
-
-        # Appliquer UNIQUEMENT pour autres clients
-        if client_upper not in clients_bloques:
-            doit_m_from_text = extract_motel_name_from_doit(ocr_text)
-
-            # 🔥 On corrige seulement si :
-            # - DOIT M existe
-            # - adresse absente OU adresse générique (MGTE)
-            if doit_m_from_text and (
-                not result.get("adresse_livraison")
-                or "MGTE" in adresse_upper
-            ):
-                result["doit_m"] = doit_m_from_text
-                result["client"] = doit_m_from_text
-                result["adresse_livraison"] = doit_m_from_text
-
-    # ============================================================
-    # 3. CONTRÔLE CROISÉ : détection par TEXTE vs IA
-    # ============================================================
-    if ocr_text:
-        text_detection = detect_document_type_from_text(ocr_text)
-        
-        ai_subtype = result.get("document_subtype", "").upper()
-        text_type = text_detection["type"]
-
-        if text_type != "UNKNOWN" and ai_subtype != text_type:
-            st.session_state.document_analysis_details = {
-                "original_type": ai_subtype,
-                "adjusted_type": text_type,
-                "reason": "Contradiction détectée: détection par texte plus fiable",
-                "indicators": text_detection["indicators_found"]
-            }
-
-            if text_type == "DLP":
-                result["type_document"] = "BDC"
-                result["document_subtype"] = "DLP"
-                result["client"] = "DLP"
-                result["adresse_livraison"] = "Leader Price Akadimbahoaka"
-
-            elif text_type == "S2M":
-                result["type_document"] = "BDC"
-                result["document_subtype"] = "S2M"
-                result["client"] = "S2M"
-                quartier = st.session_state.quartier_s2m or ""
-                result["adresse_livraison"] = clean_adresse(
-                    f"Supermaki {quartier}" if quartier else "Supermaki"
-                )
-
-            elif text_type == "ULYS":
-                result["type_document"] = "BDC"
-                result["document_subtype"] = "ULYS"
-                result["client"] = "ULYS"
-                nom_magasin = st.session_state.nom_magasin_ulys or ""
-                result["adresse_livraison"] = nom_magasin if nom_magasin else "ULYS Magasin"
-
-            elif text_type == "FACTURE":
-                result["type_document"] = "FACTURE"
-                result["document_subtype"] = "FACTURE"
-
-                # Réappliquer proprement la règle DOIT M
-                client_upper = result.get("client", "").upper()
-                if client_upper not in ["DLP", "ULYS", "S2M"]:
-                    doit_m_from_text = extract_motel_name_from_doit(ocr_text)
-                    if doit_m_from_text:
-                        result["client"] = doit_m_from_text
-                        result["adresse_livraison"] = doit_m_from_text
-
-    return result
-
-#===============================================================
-# FONCTIONS UTILITAIRES
-# ============================================================
-def preprocess_image(b: bytes) -> bytes:
-    """Prétraitement de l'image pour améliorer la qualité"""
-    img = Image.open(BytesIO(b)).convert("RGB")
-    img = ImageOps.autocontrast(img)
-    img = img.filter(ImageFilter.UnsharpMask(radius=1.2, percent=180))
-    out = BytesIO()
-    img.save(out, format="PNG", optimize=True, quality=95)
-    return out.getvalue()
-
-def encode_image_to_base64(image_bytes: bytes) -> str:
-    """Encode l'image en base64 pour OpenAI Vision"""
-    return base64.b64encode(image_bytes).decode('utf-8')
-
-def clean_text(text: str) -> str:
-    """Nettoie le texte"""
-    text = text.replace("\r", "\n")
-    text = re.sub(r"[^\S\r\n]+", " ", text)
-    return text.strip()
-
-def format_date_french(date_str: str) -> str:
-    """Formate la date au format français JJ/MM/AAAA"""
-    try:
-        # Essayer de parser la date avec différents formats
-        formats = [
-            "%d/%m/%Y", "%d-%m-%Y", "%d %m %Y",
-            "%d/%m/%y", "%d-%m-%y", "%d %m %y",
-            "%d %B %Y", "%d %b %Y", "%Y-%m-%d"
-        ]
-        
-        for fmt in formats:
-            try:
-                date_obj = datetime.strptime(date_str, fmt)
-                return date_obj.strftime("%d/%m/%Y")  # FORMAT CORRIGÉ: JJ/MM/AAAA
-            except:
-                continue
-        
-        # Essayer avec dateutil.parser
-        try:
-            date_obj = parser.parse(date_str, dayfirst=True)
-            return date_obj.strftime("%d/%m/%Y")  # FORMAT CORRIGÉ: JJ/MM/AAAA
-        except:
-            # Si aucune date n'est trouvée, retourner la date d'aujourd'hui
-            return datetime.now().strftime("%d/%m/%Y")
-    except:
-        return datetime.now().strftime("%d/%m/%Y")
-
-def get_month_from_date(date_str: str) -> str:
-    """Extrait le mois français d'une date"""
-    months_fr = {
-        1: "janvier", 2: "février", 3: "mars", 4: "avril",
-        5: "mai", 6: "juin", 7: "juillet", 8: "août",
-        9: "septembre", 10: "octobre", 11: "novembre", 12: "décembre"
-    }
-    
-    try:
-        # Essayer de parser la date
-        date_obj = parser.parse(date_str, dayfirst=True)
-        return months_fr[date_obj.month]
-    except:
-        # Si la date n'est pas valide, utiliser le mois actuel
-        return months_fr[datetime.now().month]
-
-def format_quantity(qty: Any) -> str:
-    """Formate la quantité - GARANTIT QUE C'EST UN NOMBRE ENTIER SANS VIRGULE"""
-    if qty is None:
-        return "0"
-    
-    try:
-        if isinstance(qty, str):
-            qty = qty.replace(',', '.')
-        
-        qty_num = float(qty)
-        
-        qty_int = int(round(qty_num))
-        
-        if qty_int < 0:
-            qty_int = 0
-            
-        return str(qty_int)
-        
-    except (ValueError, TypeError):
-        return "0"
-
-def map_client(client: str) -> str:
-    """Mappe le nom du client vers la forme standard"""
-    client_upper = client.upper()
-    
-    if "ULYS" in client_upper:
-        return "ULYS"
-    elif "SUPERMAKI" in client_upper or "S2M" in client_upper:
-        return "S2M"
-    elif "LEADER" in client_upper or "LEADERPRICE" in client_upper or "DLP" in client_upper:
-        return "DLP"
-    else:
-        return client
-
-# ============================================================
-# FONCTIONS POUR PRÉPARER LES DONNÉES POUR GOOGLE SHEETS (PRODUCTION)
-# ============================================================
-def prepare_facture_rows(data: dict, articles_df: pd.DataFrame) -> List[List[str]]:
-    """Prépare les lignes pour les factures (PRODUCTION - 8 colonnes) - CORRECTION DATE APPLIQUÉE"""
-    rows = []
-    
-    try:
-        mois = data.get("mois", get_month_from_date(data.get("date", "")))
-        
-        # CORRECTION 1: Utiliser la date extraite et la formater en JJ/MM/AAAA
-        date_facture = data.get("date", "")
-        date_formatted = format_date_french(date_facture)  # FORMAT CORRIGÉ
-        
-        client = data.get("client", "")
-        numero_facture = data.get("numero_facture", "")
-        magasin = data.get("adresse_livraison", "")
-        editeur = st.session_state.username
-        
-        for _, row in articles_df.iterrows():
-            quantite = row.get("Quantité", 0)
-            if pd.isna(quantite) or quantite == 0 or str(quantite).strip() == "0":
-                continue
-            
-            quantite_str = format_quantity(quantite)
-            
-            try:
-                quantite_int = int(float(quantite_str))
-                quantite_str = str(quantite_int)
-            except:
-                quantite_str = "0"
-                continue
-            
-            designation = str(row.get("Produit Standard", "")).strip()
-            if not designation:
-                designation = str(row.get("Produit Brute", "")).strip()
-            
-            rows.append([
-                mois,           # Mois
-                date_formatted, # Date au format JJ/MM/AAAA (CORRIGÉ)
-                client,         # Client
-                numero_facture, # N* facture
-                magasin,        # Magasin
-                designation,    # Désignation
-                quantite_str,   # Quantité
-                editeur         # Editeur
-            ])
-        
-        return rows
-        
-    except Exception as e:
-        st.error(f"❌ Erreur lors de la préparation des données facture: {str(e)}")
-        return []
-
-def prepare_bdc_rows(data: dict, articles_df: pd.DataFrame) -> List[List[str]]:
-    """Prépare les lignes pour les BDC (PRODUCTION - 8 colonnes) - CORRECTION DATE APPLIQUÉE"""
-    rows = []
-    
-    try:
-        date_emission = data.get("date", "")
-        mois = get_month_from_date(date_emission)
-        
-        # CORRECTION 1: Utiliser la date extraite et la formater en JJ/MM/AAAA
-        date_formatted = format_date_french(date_emission)  # FORMAT CORRIGÉ
-        
-        client = data.get("client", "")
-        numero_bdc = data.get("numero", "")
-        magasin = data.get("adresse_livraison", "")
-        editeur = st.session_state.username
-        
-        for _, row in articles_df.iterrows():
-            quantite = row.get("Quantité", 0)
-            if pd.isna(quantite) or quantite == 0 or str(quantite).strip() == "0":
-                continue
-            
-            quantite_str = format_quantity(quantite)
-            
-            try:
-                quantite_int = int(float(quantite_str))
-                quantite_str = str(quantite_int)
-            except:
-                quantite_str = "0"
-                continue
-            
-            designation = str(row.get("Produit Standard", "")).strip()
-            if not designation:
-                designation = str(row.get("Produit Brute", "")).strip()
-            
-            rows.append([
-                mois,           # Colonne 1 (mois)
-                date_formatted, # Date au format JJ/MM/AAAA (CORRIGÉ)
-                client,         # Client
-                numero_bdc,     # FACT
-                magasin,        # Magasin
-                designation,    # Désignation
-                quantite_str,   # Quantité
-                editeur         # Editeur
-            ])
-        
-        return rows
-        
-    except Exception as e:
-        st.error(f"❌ Erreur lors de la préparation des données BDC: {str(e)}")
-        return []
-
-def prepare_rows_for_sheet(document_type: str, data: dict, articles_df: pd.DataFrame) -> List[List[str]]:
-    """Prépare les lignes pour l'insertion dans Google Sheets selon le type de document"""
-    if "FACTURE" in document_type.upper():
-        return prepare_facture_rows(data, articles_df)
-    else:
-        return prepare_bdc_rows(data, articles_df)
-
-# ============================================================
-# FONCTIONS DE DÉTECTION DE DOUBLONS - FILTRE 3: Même logique pour BDC et factures
-# ============================================================
-def check_for_duplicates(document_type: str, extracted_data: dict, worksheet) -> Tuple[bool, List[Dict]]:
-    """Vérifie si un document existe déjà dans Google Sheets"""
-    try:
-        all_data = worksheet.get_all_values()
-        
-        if len(all_data) <= 1:
-            return False, []
-        
-        client_col = 2
-        current_client = extracted_data.get('client', '')
-        
-        if "FACTURE" in document_type.upper():
-            doc_num_col = 3
-            current_doc_num = extracted_data.get('numero_facture', '')
-        else:
-            doc_num_col = 3
-            current_doc_num = extracted_data.get('numero', '')
-        
-        duplicates = []
-        for i, row in enumerate(all_data[1:], start=2):
-            if len(row) > max(doc_num_col, client_col):
-                row_client = row[client_col] if len(row) > client_col else ''
-                row_doc_num = row[doc_num_col] if len(row) > doc_num_col else ''
-                
-                if (row_client == current_client and 
-                    row_doc_num == current_doc_num and 
-                    current_client != '' and current_doc_num != ''):
-                    
-                    match_type = 'Client et Numéro identiques'
-                    
-                    if "ULYS" in current_client.upper() and "BDC" in document_type.upper():
-                        date_col = 1
-                        current_date = ""
-                        date_facture = extracted_data.get('date', '')
-                        if date_facture:
-                            try:
-                                date_obj = parser.parse(date_facture, dayfirst=True)
-                                current_date = date_obj.strftime("%d/%m/%Y")
-                            except:
-                                current_date = ""
-                        
-                        row_date = row[date_col] if len(row) > date_col else ''
-                        
-                        if row_date == current_date and current_date != '':
-                            match_type = 'Client, Numéro et Date identiques'
-                    
-                    duplicates.append({
-                        'row_number': i,
-                        'data': row,
-                        'match_type': match_type
-                    })
-        
-        return len(duplicates) > 0, duplicates
-            
-    except Exception as e:
-        st.error(f"❌ Erreur lors de la vérification des doublons: {str(e)}")
-        return False, []
+@st.cache_resource
+def get_ocr_scheduler():
+    """Pool OCR partagé par toutes les sessions (concurrence bornée, reprise sur limite de débit)"""
+    return OCRScheduler(max_concurrency=4)
 
 # ============================================================
 # GOOGLE SHEETS FUNCTIONS
@@ -2576,9 +1071,7 @@ def get_worksheet(document_type: str):
             st.warning(f"⚠️ Type de document '{document_type}' non reconnu. Utilisation de la feuille par défaut.")
             normalized_type = "FACTURE EN COMPTE"
         
-        sa_info = dict(st.secrets["gcp_sheet"])
-        gc = gspread.service_account_from_dict(sa_info)
-        sh = gc.open_by_key(SHEET_ID)
+        sh = open_spreadsheet(dict(st.secrets["gcp_sheet"]))
         
         target_gid = SHEET_GIDS.get(normalized_type)
         
@@ -2586,9 +1079,9 @@ def get_worksheet(document_type: str):
             st.error(f"❌ GID non trouvé pour le type: {normalized_type}")
             return sh.get_worksheet(0)
         
-        for worksheet in sh.worksheets():
-            if int(worksheet.id) == target_gid:
-                return worksheet
+        worksheet = get_worksheet_by_gid(sh, target_gid)
+        if worksheet:
+            return worksheet
         
         st.warning(f"⚠️ Feuille avec GID {target_gid} non trouvée. Utilisation de la première feuille.")
         return sh.get_worksheet(0)
@@ -2597,34 +1090,6 @@ def get_worksheet(document_type: str):
         st.error(f"❌ Erreur lors de la connexion à Google Sheets: {str(e)}")
         return None
 
-def find_table_range(worksheet, num_columns=8):
-    """Trouve la plage de table dans la feuille avec un nombre de colonnes spécifique"""
-    try:
-        all_data = worksheet.get_all_values()
-        
-        if not all_data:
-            return "A1:H1"
-        
-        headers = ["Mois", "Date", "Client", "N* facture", "Magasin", "Désignation", "Quantité", "Editeur"]
-        
-        first_row = all_data[0] if all_data else []
-        header_found = any(header in str(first_row) for header in headers)
-        
-        if header_found:
-            last_row = len(all_data) + 1
-            if len(all_data) <= 1:
-                return "A2:H2"
-            else:
-                return f"A{last_row}:H{last_row}"
-        else:
-            for i, row in enumerate(all_data, start=1):
-                if not any(cell.strip() for cell in row):
-                    return f"A{i}:H{i}"
-            
-            return f"A{len(all_data)+1}:H{len(all_data)+1}"
-            
-    except Exception as e:
-        return "A2:H2"
 
 def save_to_google_sheets(document_type: str, data: dict, articles_df: pd.DataFrame, 
                          duplicate_action: str = None, duplicate_rows: List[int] = None):
@@ -2636,7 +1101,11 @@ def save_to_google_sheets(document_type: str, data: dict, articles_df: pd.DataFr
             st.error("❌ Impossible de se connecter à Google Sheets")
             return False, "Erreur de connexion"
         
-        new_rows = prepare_rows_for_sheet(document_type, data, articles_df)
+        try:
+            new_rows = prepare_rows_for_sheet(document_type, data, articles_df, st.session_state.username)
+        except Exception as e:
+            st.error(f"❌ Erreur lors de la préparation des données: {str(e)}")
+            return False, str(e)
         
         if not new_rows:
             st.warning("⚠️ Aucune donnée à enregistrer (toutes les lignes ont une quantité de 0)")
@@ -2660,12 +1129,7 @@ def save_to_google_sheets(document_type: str, data: dict, articles_df: pd.DataFr
         
         st.info(f"📋 **Aperçu des données à enregistrer (lignes avec quantité > 0):**")
         
-        if "FACTURE" in document_type.upper():
-            columns = ["Mois", "Date", "Client", "N* facture", "Magasin", "Désignation", "Quantité", "Editeur"]
-        else:
-            columns = ["Mois", "Date", "Client", "FACT", "Magasin", "Désignation", "Quantité", "Editeur"]
-        
-        preview_df = pd.DataFrame(new_rows, columns=columns)
+        preview_df = pd.DataFrame(new_rows, columns=sheet_columns(document_type))
         st.dataframe(preview_df, use_container_width=True)
         
         table_range = find_table_range(ws, num_columns=8)
@@ -2793,12 +1257,29 @@ st.markdown("""
 st.markdown('<div class="upload-box">', unsafe_allow_html=True)
 uploaded = st.file_uploader(
     "**Déposez votre document ici ou cliquez pour parcourir**",
-    type=["jpg", "jpeg", "png"],
+    type=["jpg", "jpeg", "png", "pdf"],
+    accept_multiple_files=True,
     label_visibility="collapsed",
-    help="Formats supportés : JPG, JPEG, PNG | Taille max : 10MB",
+    help="Formats supportés : JPG, JPEG, PNG, PDF | Plusieurs photos ou un PDF multipage = un seul document | Taille max : 10MB",
     key="file_uploader_main"
 )
 st.markdown('</div>', unsafe_allow_html=True)
+st.checkbox(
+    "📐 Redresser la page (perspective, inclinaison) avant l'analyse",
+    value=DOCUMENT_CORRECTION,
+    key="document_correction",
+    help="Correction OpenCV : photo de travers, prise en biais ou mal éclairée"
+)
+st.radio(
+    "Moteur d'analyse",
+    options=list(OCR_BACKENDS),
+    index=list(OCR_BACKENDS).index(DEFAULT_OCR_BACKEND) if DEFAULT_OCR_BACKEND in OCR_BACKENDS else 0,
+    format_func=lambda name: OCR_BACKENDS[name].label,
+    horizontal=True,
+    key="ocr_backend_choice",
+    help="OCR local : hors connexion, pour les documents imprimés (numéros manuscrits moins bien lus). "
+         "Hybride : OCR local, puis OpenAI Vision si la lecture n'est pas fiable"
+)
 
 st.markdown(f"""
 <div style="display: flex; justify-content: center; gap: 20px; margin-top: 20px; font-size: 0.85rem; color: #333333 !important;">
@@ -2828,16 +1309,26 @@ st.markdown('</div>', unsafe_allow_html=True)
 # ============================================================
 if uploaded and uploaded != st.session_state.uploaded_file:
     st.session_state.uploaded_file = uploaded
-    st.session_state.uploaded_image = Image.open(uploaded)
+    # Pages du document (octets d'origine, décodés une seule fois par le
+    # prétraitement) : photos dans l'ordre de leur nom, puis pages des PDF
+    try:
+        st.session_state.document_pages = [
+            page
+            for uploaded_file in sorted(uploaded, key=lambda f: f.name)
+            for page in load_document_pages(uploaded_file.getvalue())
+        ]
+    except Exception as e:
+        st.error(f"❌ Lecture du document impossible: {str(e)}")
+        st.session_state.document_pages = []
     st.session_state.ocr_result = None
     st.session_state.show_results = False
-    st.session_state.processing = True
+    st.session_state.processing = bool(st.session_state.document_pages)
     st.session_state.detected_document_type = None
     st.session_state.duplicate_check_done = False
     st.session_state.duplicate_found = False
     st.session_state.duplicate_action = None
-    st.session_state.image_preview_visible = True
-    st.session_state.document_scanned = True
+    st.session_state.image_preview_visible = bool(st.session_state.document_pages)
+    st.session_state.document_scanned = bool(st.session_state.document_pages)
     st.session_state.export_triggered = False
     st.session_state.export_status = None
     st.session_state.product_matching_scores = {}
@@ -2846,7 +1337,40 @@ if uploaded and uploaded != st.session_state.uploaded_file:
     st.session_state.quartier_s2m = ""
     st.session_state.nom_magasin_ulys = ""
     st.session_state.fact_manuscrit = ""
+    st.session_state.image_metrics = {}
     
+    # Quasi-doublon d'un document déjà analysé : confirmation avant l'appel OCR
+    if st.session_state.document_pages:
+        st.session_state.document_fingerprint = phash(st.session_state.document_pages[0])
+        st.session_state.near_duplicates = get_document_index().find_near_duplicates(st.session_state.document_fingerprint)
+    else:
+        st.session_state.document_fingerprint = None
+        st.session_state.near_duplicates = []
+
+# ============================================================
+# CONFIRMATION DES QUASI-DOUBLONS AVANT ANALYSE
+# ============================================================
+if st.session_state.processing and st.session_state.near_duplicates:
+    st.markdown('<div class="card fade-in">', unsafe_allow_html=True)
+    st.warning("⚠️ Ce document ressemble fortement à un document déjà analysé :")
+    for entry in st.session_state.near_duplicates[:3]:
+        st.write(f"- {describe_document(entry)}")
+    
+    col_analyse, col_ignore = st.columns(2)
+    with col_analyse:
+        if st.button("🔁 Analyser quand même", key="near_duplicate_analyse", use_container_width=True):
+            st.session_state.near_duplicates = []
+            st.rerun()
+    with col_ignore:
+        if st.button("⏸️ Ignorer ce document", key="near_duplicate_skip", use_container_width=True):
+            st.session_state.near_duplicates = []
+            st.session_state.processing = False
+            st.session_state.document_scanned = False
+            st.session_state.image_preview_visible = False
+            st.rerun()
+    st.markdown('</div>', unsafe_allow_html=True)
+
+elif st.session_state.processing and st.session_state.document_pages:
     progress_container = st.empty()
     with progress_container.container():
         st.markdown('<div class="progress-container">', unsafe_allow_html=True)
@@ -2856,68 +1380,90 @@ if uploaded and uploaded != st.session_state.uploaded_file:
         
         progress_bar = st.progress(0)
         status_text = st.empty()
+        # Entête et articles affichés au fil de la génération (réponse diffusée)
+        live_header = st.empty()
+        live_table = st.empty()
         
-        steps = [
-            "Chargement de l'image...",
-            "Prétraitement des données...",
-            "Analyse par IA...",
-            "Détection avancée du type...",
-            "Extraction du FACT manuscrit...",
-            "Extraction DOIT M...",
-            "Vérification de cohérence...",
-            "Extraction des données...",
-            "Finalisation..."
-        ]
-        
-        for i in range(101):
-            time.sleep(0.03)
-            progress_bar.progress(i)
-            if i < 12:
-                status_text.text(steps[0])
-            elif i < 25:
-                status_text.text(steps[1])
-            elif i < 40:
-                status_text.text(steps[2])
-            elif i < 55:
-                status_text.text(steps[3])
-            elif i < 70:
-                status_text.text(steps[4])
-            elif i < 82:
-                status_text.text(steps[5])
-            elif i < 90:
-                status_text.text(steps[6])
-            elif i < 98:
-                status_text.text(steps[7])
-            else:
-                status_text.text(steps[8])
+        def show_stage(stage: str):
+            label, percent = PIPELINE_STAGES[stage]
+            progress_bar.progress(percent)
+            status_text.text(label)
         
         st.markdown('</div>', unsafe_allow_html=True)
     
     try:
-        buf = BytesIO()
-        st.session_state.uploaded_image.save(buf, format="JPEG")
-        image_bytes = buf.getvalue()
-        
-        img_processed = preprocess_image(image_bytes)
-        
-        result = analyze_document_with_backup(img_processed)
+        analysis_context = new_analysis_context()
+        show_stage("preprocess")
+        
+        ocr_backend = OCR_BACKENDS[st.session_state.ocr_backend_choice]
+        client = get_openai_client() if ocr_backend.name != "local" else None
+        if not ocr_backend.available():
+            st.error(f"❌ {ocr_backend.label} indisponible sur ce serveur")
+            result = {"type_document": "DOCUMENT INCONNU", "articles": []}
+        elif client or ocr_backend.name != "openai":
+            # L'analyse (pages en parallèle) tourne dans le pool OCR ; ses
+            # étapes et ses résultats partiels sont relayés par des files et
+            # affichés depuis le thread Streamlit
+            stage_events = queue.Queue()
+            partial_events = queue.Queue()
+            future = get_ocr_scheduler().submit(
+                analyze_pages, st.session_state.document_pages, context=analysis_context,
+                client=client, progress=stage_events.put,
+                correct_geometry=st.session_state.document_correction, backend=ocr_backend.name,
+                partial_result=lambda kind, payload: partial_events.put((kind, payload))
+            )
+            streamed_articles = {}
+            header_shown = False
+            while True:
+                wait([future], timeout=0.1)
+                while not stage_events.empty():
+                    show_stage(stage_events.get_nowait())
+                
+                refresh_table = False
+                while not partial_events.empty():
+                    kind, payload = partial_events.get_nowait()
+                    page = payload.pop("page", 1)
+                    if kind == "header" and not header_shown:
+                        header_shown = True
+                        live_header.info(f"📄 {payload.get('document_subtype') or payload.get('type_document', '')} "
+                                         f"{payload.get('date', '')} — extraction des articles en cours...")
+                    elif kind == "reset":
+                        streamed_articles[page] = []
+                        refresh_table = True
+                    elif kind == "article":
+                        streamed_articles.setdefault(page, []).append(payload)
+                        refresh_table = True
+                if refresh_table:
+                    # Désignations déjà standardisées (sans cache) par le worker
+                    live_table.dataframe(
+                        build_streamed_articles_df([article for page in sorted(streamed_articles)
+                                                    for article in streamed_articles[page]]),
+                        use_container_width=True, hide_index=True
+                    )
+                
+                if future.done():
+                    break
+            result = future.result()
+            st.session_state.image_metrics = analysis_context["image_metrics"]
+        else:
+            result = {"type_document": "DOCUMENT INCONNU", "articles": []}
+        for key in ANALYSIS_CONTEXT_KEYS:
+            if key != "errors":
+                setattr(st.session_state, key, analysis_context[key])
+        for error in analysis_context["errors"]:
+            st.error(f"❌ {error}")
+        if analysis_context.get("ocr_fallback"):
+            st.warning(f"⚠️ Service IA principal indisponible : document analysé avec le modèle de secours "
+                       f"{analysis_context['ocr_fallback']}, vérifiez attentivement les articles")
+        if analysis_context.get("ocr_confidence") is not None:
+            st.caption(f"🔎 Confiance de l'OCR local : {analysis_context['ocr_confidence']:.0%}")
+        routing = analysis_context.get("ocr_routing")
+        if routing and routing["backend"] != "local":
+            st.caption(f"🔀 Analyse confiée à OpenAI Vision : {', '.join(routing['reasons'])}")
         
         if result:
-            raw_doc_type = result.get("type_document", "DOCUMENT INCONNU")
             document_subtype = result.get("document_subtype", "").upper()
-            
-            if document_subtype == "DLP":
-                final_doc_type = "BDC LEADERPRICE"
-            elif document_subtype == "S2M":
-                final_doc_type = "BDC S2M"
-            elif document_subtype == "ULYS":
-                final_doc_type = "BDC ULYS"
-            elif document_subtype == "FACTURE":
-                final_doc_type = "FACTURE EN COMPTE"
-            else:
-                final_doc_type = normalize_document_type(raw_doc_type)
-            
-            st.session_state.detected_document_type = final_doc_type
+            st.session_state.detected_document_type = resolve_document_type(result)
             
             if st.session_state.document_analysis_details:
                 correction = st.session_state.document_analysis_details
@@ -2932,31 +1478,20 @@ if uploaded and uploaded != st.session_state.uploaded_file:
             st.session_state.processing = False
             
             if "articles" in result:
-                std_data = []
-                for article in result["articles"]:
-                    raw_name = article.get("article_brut", article.get("article", ""))
-                    
-                    if any(cat in raw_name.upper() for cat in ["VINS ROUGES", "VINS BLANCS", "VINS ROSES", "LIQUEUR", "CONSIGNE"]):
-                        std_data.append({
-                            "Produit Brute": raw_name,
-                            "Produit Standard": raw_name,
-                            "Quantité": 0,
-                            "Confiance": "0%",
-                            "Auto": False
-                        })
-                    else:
-                        produit_brut, produit_standard, confidence, status = standardize_product_for_bdc(raw_name)
-                        
-                        std_data.append({
-                            "Produit Brute": produit_brut,
-                            "Produit Standard": produit_standard,
-                            "Quantité": article.get("quantite", 0),
-                            "Confiance": f"{confidence*100:.1f}%",
-                            "Auto": confidence >= 0.7
-                        })
-                
-                st.session_state.edited_standardized_df = pd.DataFrame(std_data)
+                show_stage("standardization")
+                st.session_state.edited_standardized_df = build_articles_df(result)
+            
+            # Seuls les documents exploitables servent de référence pour les doublons
+            if result.get("articles") and st.session_state.detected_document_type in SHEET_GIDS:
+                index_document(
+                    get_document_index(),
+                    st.session_state.document_fingerprint,
+                    st.session_state.detected_document_type,
+                    build_sheet_data(result, analysis_context),
+                    source=", ".join(uploaded_file.name for uploaded_file in st.session_state.uploaded_file)
+                )
             
+            show_stage("done")
             progress_container.empty()
             st.rerun()
         else:
@@ -2970,21 +1505,39 @@ if uploaded and uploaded != st.session_state.uploaded_file:
 # ============================================================
 # APERÇU DU DOCUMENT (TOUJOURS VISIBLE SI SCANNÉ)
 # ============================================================
-if st.session_state.uploaded_image and st.session_state.image_preview_visible:
+if st.session_state.document_pages and st.session_state.image_preview_visible:
     st.markdown('<div class="card fade-in">', unsafe_allow_html=True)
     st.markdown('<h4>👁️ Aperçu du document analysé</h4>', unsafe_allow_html=True)
     
     col_img, col_info = st.columns([2, 1])
     
     with col_img:
-        st.image(st.session_state.uploaded_image, use_column_width=True)
+        pages = st.session_state.document_pages
+        st.image(pages, use_column_width=True,
+                 caption=[f"Page {number}/{len(pages)}" for number in range(1, len(pages) + 1)] if len(pages) > 1 else None)
     
     with col_info:
+        metrics = st.session_state.image_metrics
+        if metrics:
+            width, height = metrics["sent_size"]
+            resolution = f"{width}×{height} px"
+            if metrics.get("pages"):
+                resolution += f" ({metrics['pages']} pages)"
+            image_format = f"{metrics['sent_format']}, {metrics['sent_bytes'] / 1024:.0f} Ko envoyés (sur {metrics['original_bytes'] / 1024:.0f} Ko)"
+            corrections = [label for key, label in (("perspective_corrected", "perspective"),
+                                                    ("deskew_angle", f"inclinaison {metrics.get('deskew_angle', 0):+.1f}°"),
+                                                    ("binarized", "binarisation")) if metrics.get(key)]
+            preparation = f"{', '.join(corrections) or 'aucune correction'} ({metrics['duration_ms']:.0f} ms dont {metrics.get('correction_ms', 0):.0f} ms de correction)"
+        else:
+            resolution = "Haute définition"
+            image_format = "Image numérique"
+            preparation = "—"
         st.markdown(f"""
         <div class="info-box" style="height: 100%;">
             <strong style="color: {PALETTE['text_dark']} !important;">📊 Métadonnées :</strong><br><br>
-            • Résolution : Haute définition<br>
-            • Format : Image numérique<br>
+            • Résolution : {resolution}<br>
+            • Format : {image_format}<br>
+            • Préparation : {preparation}<br>
             • Statut : Analysé par IA V1.3<br>
             • Confiance : Élevée<br><br>
             <small style="color: {PALETTE['text_light']} !important;">Document prêt pour traitement</small>
@@ -3351,30 +1904,11 @@ if st.session_state.show_results and st.session_state.ocr_result and not st.sess
         if st.button("🔄 Re-standardiser tous les produits", 
                     key="restandardize_button",
                     help="Appliquer la standardisation intelligente à tous les produits"):
-            new_data = []
-            for _, row in edited_df.iterrows():
-                produit_brut = row["Produit Brute"]
-                
-                if any(cat in produit_brut.upper() for cat in ["VINS ROUGES", "VINS BLANCS", "VINS ROSES", "LIQUEUR", "CONSIGNE", "122111", "122112", "122113"]):
-                    new_data.append({
-                        "Produit Brute": produit_brut,
-                        "Produit Standard": produit_brut,
-                        "Quantité": row["Quantité"],
-                        "Confiance": "0%",
-                        "Auto": False
-                    })
-                else:
-                    produit_brut, produit_standard, confidence, status = standardize_product_for_bdc(produit_brut)
-                    
-                    new_data.append({
-                        "Produit Brute": produit_brut,
-                        "Produit Standard": produit_standard,
-                        "Quantité": row["Quantité"],
-                        "Confiance": f"{confidence*100:.1f}%",
-                        "Auto": confidence >= 0.7
-                    })
-            
-            st.session_state.edited_standardized_df = pd.DataFrame(new_data)
+            st.session_state.edited_standardized_df = build_standardized_articles_df(
+                edited_df["Produit Brute"].tolist(),
+                edited_df["Quantité"].tolist(),
+                CATEGORY_MARKERS + CATEGORY_CODE_MARKERS
+            )
             st.rerun()
         
         st.markdown('</div>', unsafe_allow_html=True)
@@ -3479,11 +2013,15 @@ if st.session_state.show_results and st.session_state.ocr_result and not st.sess
             ws = get_worksheet(normalized_doc_type)
             
             if ws:
-                duplicate_found, duplicates = check_for_duplicates(
-                    normalized_doc_type,
-                    st.session_state.data_for_sheets,
-                    ws
-                )
+                try:
+                    duplicate_found, duplicates = check_for_duplicates(
+                        normalized_doc_type,
+                        st.session_state.data_for_sheets,
+                        ws
+                    )
+                except Exception as e:
+                    st.error(f"❌ Erreur lors de la vérification des doublons: {str(e)}")
+                    duplicate_found, duplicates = False, []
                 
                 if not duplicate_found:
                     st.session_state.duplicate_found = False
@@ -3641,7 +2179,7 @@ if st.session_state.show_results and st.session_state.ocr_result and not st.sess
                 st.session_state.edited_standardized_df = None
                 st.session_state.product_matching_scores = {}
                 st.session_state.uploaded_file = None
-                st.session_state.uploaded_image = None
+                st.session_state.document_pages = []
                 st.session_state.image_preview_visible = False
                 st.session_state.show_results = False
                 st.session_state.detected_document_type = None
@@ -3675,7 +2213,7 @@ if st.session_state.show_results and st.session_state.ocr_result and not st.sess
                         key="restart_main_nav",
                         help="Recommencer l'analyse du document actuel"):
                 st.session_state.uploaded_file = None
-                st.session_state.uploaded_image = None
+                st.session_state.document_pages = []
                 st.session_state.ocr_result = None
                 st.session_state.show_results = False
                 st.session_state.detected_document_type = None
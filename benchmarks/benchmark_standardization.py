@@ -0,0 +1,303 @@
+"""
+Benchmark et non-régression de la standardisation des produits
+
+Exécute standardize_product_for_bdc, find_best_match et preprocess_text sur
+un jeu de référence (désignation brute -> produit standard attendu, par
+catégorie de produit) et rapporte précision globale et par catégorie,
+latences par appel (p50 / p90 / p99) et débit.
+
+Compare aussi, pour plusieurs tailles de lot, le classement par lot
+(rank_product_matches_batch) au classement désignation par désignation
+(rank_product_matches) : le code de sortie est 1 si le lot est plus lent,
+au-delà d'une marge de bruit, sur le meilleur de plusieurs passes alternées.
+
+Usage :
+    python benchmarks/benchmark_standardization.py
+    python benchmarks/benchmark_standardization.py --repeat 20 --min-accuracy 100
+    python benchmarks/benchmark_standardization.py --dataset autre.csv --json
+    python benchmarks/benchmark_standardization.py --batch-sizes 1,100,1000,10000
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARK_DIR)
+# Jeu synthétique : variantes d'écriture construites à la main, faute d'export
+# des lignes de commande réelles (à fournir avec --dataset quand il existera)
+DEFAULT_DATASET = os.path.join(BENCHMARK_DIR, "synthetic_golden_designations.csv")
+DEFAULT_BATCH_SIZES = "1,10,100,1000"
+# Marge de bruit de mesure tolérée avant de signaler une régression du scoring :
+# facteur relatif, plus un écart absolu sous lequel l'horloge n'est pas fiable
+DEFAULT_MAX_SLOWDOWN = 1.25
+RANKING_SLACK_MS = 0.05
+DEFAULT_RANKING_RUNS = 7
+# Durée minimale d'une passe de mesure (les petits lots sont répétés)
+RANKING_MIN_RUN_SECONDS = 0.02
+
+# Pas de cache persistant pendant les mesures
+os.environ["CHANFOUI_STANDARDIZATION_CACHE"] = ""
+sys.path.insert(0, ROOT_DIR)
+
+# La logique métier s'importe sans Streamlit
+from chanfoui import matching  # noqa: E402
+
+
+def load_dataset(path: str) -> List[Dict[str, str]]:
+    """Charge le jeu de référence (colonnes designation, expected, category)"""
+    with open(path, newline="", encoding="utf-8") as f:
+        return [row for row in csv.DictReader(f) if row.get("designation")]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentile par interpolation linéaire"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * pct / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def measure(func: Callable[[str], Any], inputs: List[str], repeat: int) -> Dict[str, float]:
+    """Latence par appel (en ms) et débit (appels/s) de func sur inputs"""
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for value in inputs:
+            t0 = time.perf_counter()
+            func(value)
+            latencies.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "calls": len(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.fmean(latencies) if latencies else 0.0,
+        "throughput_per_s": len(latencies) / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def measure_batch(inputs: List[str], repeat: int) -> Dict[str, float]:
+    """Débit de standardize_batch sur tout le jeu (cache vidé à chaque passe)"""
+    durations = []
+    for _ in range(repeat):
+        matching.get_standardization_cache().clear()
+        t0 = time.perf_counter()
+        matching.standardize_batch(inputs)
+        durations.append(time.perf_counter() - t0)
+
+    total = sum(durations)
+    return {
+        "calls": len(inputs) * repeat,
+        "batch_p50_ms": percentile([d * 1000 for d in durations], 50),
+        "throughput_per_s": len(inputs) * repeat / total if total > 0 else 0.0,
+    }
+
+
+def synthetic_designations(designations: List[str], size: int, seed: int = 0) -> List[str]:
+    """
+    size désignations tirées du jeu, dont environ une sur deux altérée comme
+    par l'OCR (caractères remplacés ou supprimés) ; reproductible
+    """
+    rng = random.Random(seed)
+    noise = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 ."
+    result = []
+    for _ in range(size):
+        chars = list(rng.choice(designations))
+        for _ in range(rng.choice((0, 0, 1, 2))):
+            position = rng.randrange(len(chars))
+            if rng.random() < 0.5:
+                chars[position] = rng.choice(noise)
+            elif len(chars) > 1:
+                del chars[position]
+        result.append("".join(chars))
+    return result
+
+
+def compare_ranking_engines(designations: List[str], batch_sizes: List[int],
+                            runs: int = DEFAULT_RANKING_RUNS) -> List[Dict[str, Any]]:
+    """
+    Durée du classement par lot (rank_product_matches_batch) et désignation
+    par désignation (rank_product_matches) pour chaque taille de lot
+
+    Les deux chemins sont mesurés en alternance sur runs passes d'au moins
+    RANKING_MIN_RUN_SECONDS ; seule la meilleure passe de chacun est retenue.
+    """
+    results = []
+    for size in batch_sizes:
+        inputs = synthetic_designations(designations, size)
+        engines = {
+            "lot": lambda: matching.rank_product_matches_batch(inputs),
+            "unitaire": lambda: [matching.rank_product_matches(value) for value in inputs],
+        }
+        t0 = time.perf_counter()
+        engines["unitaire"]()
+        rounds = max(1, int(RANKING_MIN_RUN_SECONDS / max(time.perf_counter() - t0, 1e-6)))
+
+        best = {name: float("inf") for name in engines}
+        for _ in range(max(runs, 1)):
+            for name, engine in engines.items():
+                t0 = time.perf_counter()
+                for _ in range(rounds):
+                    engine()
+                best[name] = min(best[name], (time.perf_counter() - t0) / rounds)
+        results.append({"batch_size": size, **{f"{name}_ms": value * 1000 for name, value in best.items()}})
+    return results
+
+
+def evaluate_accuracy(dataset: List[Dict[str, str]]) -> Dict[str, Any]:
+    """Précision de standardize_product_for_bdc par rapport aux produits attendus, globale et par catégorie"""
+    failures = []
+    categories: Dict[str, Dict[str, Any]] = {}
+    for row in dataset:
+        _, produit_standard, confidence, status = matching.standardize_product_for_bdc_uncached(row["designation"])
+        category = categories.setdefault(row.get("category") or "", {"total": 0, "correct": 0})
+        category["total"] += 1
+        if produit_standard == row["expected"]:
+            category["correct"] += 1
+        else:
+            failures.append({
+                "category": row.get("category") or "",
+                "designation": row["designation"],
+                "expected": row["expected"],
+                "got": produit_standard,
+                "confidence": round(confidence, 3),
+                "status": status,
+            })
+
+    for category in categories.values():
+        category["accuracy_pct"] = 100.0 * category["correct"] / category["total"]
+
+    total = len(dataset)
+    return {
+        "total": total,
+        "correct": total - len(failures),
+        "accuracy_pct": 100.0 * (total - len(failures)) / total if total else 0.0,
+        "by_category": dict(sorted(categories.items())),
+        "failures": failures,
+    }
+
+
+def run_benchmark(dataset: List[Dict[str, str]], repeat: int,
+                  batch_sizes: List[int] = (), runs: int = DEFAULT_RANKING_RUNS) -> Dict[str, Any]:
+    """Précision + performances de chaque étape du pipeline de standardisation"""
+    designations = [row["designation"] for row in dataset]
+
+    def cached_lookup(value: str):
+        return matching.standardize_product_for_bdc(value)
+
+    # Préchauffer le cache pour mesurer les accès chauds
+    matching.get_standardization_cache().clear()
+    for value in designations:
+        cached_lookup(value)
+
+    return {
+        "dataset_size": len(dataset),
+        "catalog_version": matching.compute_catalog_version(),
+        "accuracy": evaluate_accuracy(dataset),
+        "latency": {
+            "preprocess_text": measure(matching.preprocess_text, designations, repeat),
+            "find_best_match": measure(
+                lambda value: matching.find_best_match(value, matching.STANDARD_PRODUCTS), designations, repeat
+            ),
+            "standardize_product_for_bdc (sans cache)": measure(
+                matching.standardize_product_for_bdc_uncached, designations, repeat
+            ),
+            "standardize_product_for_bdc (cache chaud)": measure(cached_lookup, designations, repeat),
+            "standardize_batch": measure_batch(designations, repeat),
+        },
+        "ranking_engines": compare_ranking_engines(designations, list(batch_sizes), runs),
+    }
+
+
+def ranking_regressions(report: Dict[str, Any], max_slowdown: float) -> List[str]:
+    """Tailles de lot où le classement par lot est plus lent que désignation par désignation"""
+    return [
+        f"lot de {row['batch_size']} : par lot {row['lot_ms']:.2f} ms, "
+        f"désignation par désignation {row['unitaire_ms']:.2f} ms"
+        for row in report["ranking_engines"]
+        if row["lot_ms"] > row["unitaire_ms"] * max_slowdown + RANKING_SLACK_MS
+    ]
+
+
+def print_report(report: Dict[str, Any]):
+    """Affiche le rapport sous forme lisible"""
+    accuracy = report["accuracy"]
+    print(f"Jeu de référence {report.get('dataset', '')} : {report['dataset_size']} désignations "
+          f"(catalogue {report['catalog_version']})")
+    print(f"Précision : {accuracy['accuracy_pct']:.1f}% ({accuracy['correct']}/{accuracy['total']})")
+    for name, category in accuracy["by_category"].items():
+        print(f"  {name or '(sans catégorie)':<20} {category['accuracy_pct']:>6.1f}% "
+              f"({category['correct']}/{category['total']})")
+    for failure in accuracy["failures"]:
+        print(f"  ✗ [{failure['category']}] {failure['designation']!r} -> {failure['got']!r} "
+              f"(attendu {failure['expected']!r}, {failure['status']}, {failure['confidence']})")
+
+    print()
+    print(f"{'Étape':<45} {'appels':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'appels/s':>11}")
+    for name, stats in report["latency"].items():
+        print(f"{name:<45} {stats['calls']:>8} "
+              f"{stats.get('p50_ms', stats.get('batch_p50_ms', 0.0)):>9.3f} "
+              f"{stats.get('p90_ms', float('nan')):>9.3f} "
+              f"{stats.get('p99_ms', float('nan')):>9.3f} "
+              f"{stats['throughput_per_s']:>11.0f}")
+
+    if report["ranking_engines"]:
+        print()
+        print(f"{'Classement (ms par lot)':<24} {'par lot':>11} {'unitaire':>11}")
+        for row in report["ranking_engines"]:
+            print(f"{'lot de ' + str(row['batch_size']):<24} {row['lot_ms']:>11.2f} {row['unitaire_ms']:>11.2f}")
+
+
+def main(argv: List[str] = None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Benchmark de la standardisation des produits")
+    arg_parser.add_argument("--dataset", default=DEFAULT_DATASET,
+                            help="CSV de référence (colonnes designation, expected, category)")
+    arg_parser.add_argument("--repeat", type=int, default=5,
+                            help="Nombre de passes sur le jeu pour les mesures de latence")
+    arg_parser.add_argument("--min-accuracy", type=float, default=None,
+                            help="Code de sortie 1 si la précision (en %%) est inférieure")
+    arg_parser.add_argument("--batch-sizes", default=DEFAULT_BATCH_SIZES,
+                            help="Tailles de lot (séparées par des virgules) pour comparer le classement "
+                                 "par lot et désignation par désignation")
+    arg_parser.add_argument("--runs", type=int, default=DEFAULT_RANKING_RUNS,
+                            help="Passes alternées par taille de lot (la meilleure est retenue)")
+    arg_parser.add_argument("--max-slowdown", type=float, default=DEFAULT_MAX_SLOWDOWN,
+                            help="Code de sortie 1 si le classement par lot est plus lent que "
+                                 "désignation par désignation au-delà de ce facteur")
+    arg_parser.add_argument("--json", action="store_true", help="Sortie JSON")
+    args = arg_parser.parse_args(argv)
+
+    batch_sizes = [int(value) for value in args.batch_sizes.split(",") if value.strip()]
+    report = run_benchmark(load_dataset(args.dataset), max(args.repeat, 1), batch_sizes, args.runs)
+    report["dataset"] = os.path.basename(args.dataset)
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report)
+
+    if args.min_accuracy is not None and report["accuracy"]["accuracy_pct"] < args.min_accuracy:
+        print(f"❌ Précision inférieure au seuil de {args.min_accuracy:.1f}%", file=sys.stderr)
+        return 1
+    regressions = ranking_regressions(report, args.max_slowdown)
+    if regressions:
+        for regression in regressions:
+            print(f"❌ Classement par lot plus lent que désignation par désignation ({regression})",
+                  file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,8 @@
+"""
+Chan Foui & Fils — traitement des documents (factures, BDC)
+
+Logique métier importable sans Streamlit : standardisation des produits
+(matching), analyse des documents (documents, ocr), prétraitement des images
+(images) et accès Google Sheets (sheets). L'interface Streamlit (app.py) et
+les scripts en ligne de commande s'appuient sur ces modules.
+"""
@@ -0,0 +1,255 @@
+"""
+Moteurs d'OCR interchangeables
+
+Un moteur prépare la page à sa résolution utile puis la lit, avec le même
+contrat que openai_vision_ocr_improved (résultat de la forme VisionResult,
+ou None et un message dans context["errors"]). La vérification de
+cohérence (analyze_document_with_backup) est commune à tous les moteurs.
+
+- "openai" : OpenAI Vision (par défaut)
+- "local" : Tesseract, hors ligne (voir chanfoui.local_ocr)
+- "hybrid" : Tesseract d'abord, OpenAI Vision seulement si la lecture
+  locale n'est pas fiable (voir assess_local_reading)
+
+Le moteur est choisi par document, ou par défaut avec CHANFOUI_OCR_BACKEND.
+Si OpenAI Vision échoue (service ou clé indisponible), la page est relue
+par l'OCR local quand Tesseract est installé (CHANFOUI_LOCAL_OCR_FALLBACK) ;
+le moteur hybride reprend alors sa propre lecture locale.
+"""
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Optional, Union
+
+from .documents import detect_document_type_from_text
+from .images import preprocess_image
+from .local_ocr import local_ocr, preprocess_for_local_ocr, tesseract_available
+from .matching import CATEGORY_MARKERS, standardize_product_for_bdc_uncached
+from .ocr import (
+    PartialResultCallback,
+    analyze_document_with_backup,
+    new_analysis_context,
+    openai_vision_ocr_improved,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OCR_BACKEND = os.environ.get("CHANFOUI_OCR_BACKEND", "openai")
+LOCAL_OCR_FALLBACK = os.environ.get("CHANFOUI_LOCAL_OCR_FALLBACK", "1").lower() not in ("0", "false", "non", "")
+
+# Routage hybride : seuils en dessous desquels la lecture locale est refaite par OpenAI Vision
+HYBRID_MIN_OCR_CONFIDENCE = float(os.environ.get("CHANFOUI_HYBRID_MIN_OCR_CONFIDENCE", 0.75))
+HYBRID_MIN_MATCH_CONFIDENCE = 0.7
+HYBRID_MIN_MATCHED_RATIO = float(os.environ.get("CHANFOUI_HYBRID_MIN_MATCHED_RATIO", 0.8))
+# Sous-types dont le numéro de document est écrit à la main
+HANDWRITTEN_NUMBER_SUBTYPES = ("DLP", "S2M", "ULYS")
+
+
+class OCRBackend(ABC):
+    """Moteur d'OCR : préparation de la page (preprocess) puis lecture (recognize)"""
+    name = ""
+    label = ""
+    # Relecture par l'OCR local si l'analyse échoue (inutile si le moteur a déjà lu la page localement)
+    local_fallback = True
+
+    def available(self) -> bool:
+        return True
+
+    def preprocess(self, page: bytes, metrics: Optional[Dict[str, Any]] = None,
+                   correct_geometry: Optional[bool] = None) -> bytes:
+        return preprocess_image(page, metrics=metrics, correct_geometry=correct_geometry)
+
+    @abstractmethod
+    def recognize(self, image_bytes: bytes, context: Dict[str, Any], client=None,
+                  partial_result: Optional[PartialResultCallback] = None) -> Optional[Dict]:
+        """Lit la page préparée (même contrat que openai_vision_ocr_improved)"""
+
+    def analyze(self, page: bytes, context: Dict[str, Any], client=None,
+                progress: Optional[Callable[[str], None]] = None,
+                partial_result: Optional[PartialResultCallback] = None,
+                correct_geometry: Optional[bool] = None) -> Dict[str, Any]:
+        """Prépare et lit la page, puis vérifie la cohérence du résultat"""
+        context["ocr_backend"] = self.name
+        image_bytes = self.preprocess(page, context["image_metrics"], correct_geometry)
+        return analyze_document_with_backup(image_bytes, context, client, progress, partial_result,
+                                            ocr=self.recognize)
+
+
+class OpenAIVisionBackend(OCRBackend):
+    name = "openai"
+    label = "OpenAI Vision"
+
+    def recognize(self, image_bytes, context, client=None, partial_result=None):
+        return openai_vision_ocr_improved(image_bytes, context, client, partial_result)
+
+
+class TesseractBackend(OCRBackend):
+    name = "local"
+    label = "OCR local (Tesseract)"
+    local_fallback = False
+
+    def available(self) -> bool:
+        return tesseract_available()
+
+    def preprocess(self, page, metrics=None, correct_geometry=None):
+        return preprocess_for_local_ocr(page, metrics, correct_geometry)
+
+    def recognize(self, image_bytes, context, client=None, partial_result=None):
+        return local_ocr(image_bytes, context, client, partial_result)
+
+
+def _is_failed(result: Dict[str, Any]) -> bool:
+    return result.get("type_document") == "DOCUMENT INCONNU" and not result.get("articles")
+
+
+def assess_local_reading(result: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fiabilité d'une lecture par l'OCR local
+
+    Retourne les indicateurs (confiance de Tesseract, indices du type trouvés
+    dans le texte, part des articles reconnus dans le catalogue) et les
+    raisons de refaire la lecture avec OpenAI Vision (liste vide si la
+    lecture locale est fiable) : échec, type non confirmé par le texte,
+    numéro manuscrit requis mais absent, aucun article, confiance ou part
+    d'articles reconnus sous les seuils HYBRID_*. Les articles sont évalués
+    sans le cache de standardisation, pour ne pas y conserver des lectures
+    qui seront peut-être écartées.
+    """
+    text = context.get("ocr_raw_text") or ""
+    detection = detect_document_type_from_text(text)
+    articles = [article.get("article_brut", "") for article in result.get("articles") or []]
+    products = [name for name in articles
+                if not any(marker in name.upper() for marker in CATEGORY_MARKERS)]
+    matched_ratio = 0.0
+    if products:
+        confidences = [standardize_product_for_bdc_uncached(name)[2] for name in products]
+        matched_ratio = sum(confidence >= HYBRID_MIN_MATCH_CONFIDENCE for confidence in confidences) / len(products)
+    ocr_confidence = context.get("ocr_confidence") or 0.0
+
+    reasons = []
+    if result.get("type_document") == "DOCUMENT INCONNU" or context.get("errors"):
+        reasons.append("lecture locale en échec")
+    elif detection["type"] == "UNKNOWN":
+        reasons.append("type non reconnu dans le texte")
+    if (result.get("document_subtype", "").upper() in HANDWRITTEN_NUMBER_SUBTYPES
+            and not result.get("fact_manuscrit")):
+        reasons.append("numéro manuscrit requis")
+    if not products:
+        reasons.append("aucun article lu")
+    elif matched_ratio < HYBRID_MIN_MATCHED_RATIO:
+        reasons.append(f"{matched_ratio:.0%} des articles reconnus")
+    if ocr_confidence < HYBRID_MIN_OCR_CONFIDENCE:
+        reasons.append(f"confiance OCR {ocr_confidence:.0%}")
+
+    return {
+        "ocr_confidence": ocr_confidence,
+        "type_indicators": len(detection["indicators_found"]),
+        "matched_ratio": matched_ratio,
+        "reasons": reasons,
+    }
+
+
+class HybridBackend(OCRBackend):
+    """
+    OCR local d'abord ; la page n'est envoyée à OpenAI Vision que si la
+    lecture locale n'est pas fiable (voir assess_local_reading)
+
+    La décision est notée dans context["ocr_routing"] : moteur retenu,
+    indicateurs et raisons de l'escalade. Si OpenAI Vision échoue, la
+    lecture locale déjà faite est retenue (context["ocr_fallback"]) plutôt
+    que de relire la page.
+    """
+    name = "hybrid"
+    label = "Hybride (OCR local, OpenAI Vision si besoin)"
+    local_fallback = False
+
+    def __init__(self, local: OCRBackend, vision: OCRBackend):
+        self.local = local
+        self.vision = vision
+
+    def preprocess(self, page, metrics=None, correct_geometry=None):
+        return self.local.preprocess(page, metrics, correct_geometry)
+
+    def recognize(self, image_bytes, context, client=None, partial_result=None):
+        # L'escalade demande la page d'origine (préparée autrement pour
+        # OpenAI Vision) : elle est décidée dans analyze, pas ici
+        return self.local.recognize(image_bytes, context, client, partial_result)
+
+    def analyze(self, page, context, client=None, progress=None, partial_result=None, correct_geometry=None):
+        if not self.local.available():
+            context["ocr_routing"] = {"backend": self.vision.name, "reasons": ["OCR local indisponible"]}
+            return self.vision.analyze(page, context, client, progress, partial_result, correct_geometry)
+
+        local_context = new_analysis_context()
+        result = self.local.analyze(page, local_context, client, progress, partial_result, correct_geometry)
+        assessment = assess_local_reading(result, local_context)
+        if not assessment["reasons"]:
+            context.update(local_context)
+            context["ocr_routing"] = dict(assessment, backend=self.local.name)
+            return result
+
+        logger.info("Lecture locale insuffisante (%s) : analyse avec %s",
+                    ", ".join(assessment["reasons"]), self.vision.label)
+        context["ocr_routing"] = dict(assessment, backend=self.vision.name)
+        vision_result = self.vision.analyze(page, context, client, progress, partial_result, correct_geometry)
+        if not _is_failed(vision_result) or _is_failed(result):
+            return vision_result
+
+        logger.warning("%s en échec (%s) : lecture locale conservée", self.vision.label,
+                       "; ".join(context.get("errors") or []))
+        context.update(local_context)
+        context["ocr_routing"] = dict(assessment, backend=self.local.name)
+        context["ocr_fallback"] = self.local.label
+        if partial_result is not None:
+            partial_result("reset", {})
+            partial_result("header", {key: value for key, value in result.items() if key != "articles"})
+            for article in result.get("articles") or []:
+                partial_result("article", article)
+        return result
+
+
+_VISION_BACKEND = OpenAIVisionBackend()
+_LOCAL_BACKEND = TesseractBackend()
+OCR_BACKENDS: Dict[str, OCRBackend] = {
+    backend.name: backend
+    for backend in (_VISION_BACKEND, _LOCAL_BACKEND, HybridBackend(_LOCAL_BACKEND, _VISION_BACKEND))
+}
+
+
+def get_ocr_backend(backend: Union[str, OCRBackend, None] = None) -> OCRBackend:
+    """Moteur désigné par son nom (DEFAULT_OCR_BACKEND si None) ; ValueError s'il est inconnu"""
+    if isinstance(backend, OCRBackend):
+        return backend
+    name = (backend or DEFAULT_OCR_BACKEND).lower()
+    if name not in OCR_BACKENDS:
+        raise ValueError(f"Moteur d'OCR inconnu : {name} (choix : {', '.join(OCR_BACKENDS)})")
+    return OCR_BACKENDS[name]
+
+
+def analyze_page(page: bytes, context: Dict[str, Any], client=None,
+                 backend: Union[str, OCRBackend, None] = None,
+                 progress: Optional[Callable[[str], None]] = None,
+                 partial_result: Optional[PartialResultCallback] = None,
+                 correct_geometry: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Prépare et analyse une page avec le moteur choisi
+
+    Le moteur utilisé est noté dans context["ocr_backend"]. Si l'analyse
+    échoue et que l'OCR local est disponible (LOCAL_OCR_FALLBACK), la page
+    est relue par Tesseract, sauf si le moteur l'a déjà lue localement
+    (local_fallback) : son libellé est alors noté dans context["ocr_fallback"]
+    et les erreurs du premier moteur sont journalisées.
+    """
+    backend = get_ocr_backend(backend)
+    result = backend.analyze(page, context, client, progress, partial_result, correct_geometry)
+    fallback = _LOCAL_BACKEND
+    if _is_failed(result) and backend.local_fallback and LOCAL_OCR_FALLBACK and fallback.available():
+        errors = context.get("errors") or []
+        logger.warning("%s en échec (%s) : analyse avec %s", backend.label, "; ".join(errors), fallback.label)
+        context["errors"] = []
+        result = fallback.analyze(page, context, client, progress, partial_result, correct_geometry)
+        if _is_failed(result):
+            context["errors"] = errors + context["errors"]
+        else:
+            context["ocr_fallback"] = fallback.label
+    return result
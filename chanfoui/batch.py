@@ -0,0 +1,294 @@
+"""
+Traitement par lots des documents scannés, sans interface
+
+Traite un dossier (ou des motifs glob) d'images JPG/PNG et de PDF (une
+analyse par fichier, toutes pages fusionnées) : prétraitement,
+analyse OCR, standardisation et préparation des lignes, puis écrit toutes
+les lignes en une fois dans un fichier CSV/Parquet et/ou dans Google Sheets.
+Les analyses OCR s'exécutent en parallèle (voir chanfoui.scheduler).
+
+Usage :
+    python -m chanfoui.batch scans/ --output lignes.csv --editeur "Elodie R."
+    python -m chanfoui.batch "scans/*.jpg" --output lignes.parquet --concurrency 8
+    python -m chanfoui.batch scans/ --sheets-credentials compte_service.json
+    python -m chanfoui.batch scans/ --output lignes.csv --backend local
+
+La clé OpenAI est lue dans la variable d'environnement OPENAI_API_KEY ; elle
+n'est pas nécessaire avec l'OCR local (--backend local, Tesseract).
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+from concurrent.futures import as_completed
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from .dedup import DocumentIndex, describe_document, get_document_index, index_document, phash
+from .documents import sheet_columns
+from .backends import DEFAULT_OCR_BACKEND, OCR_BACKENDS, get_ocr_backend
+from .images import load_document_pages
+from .ocr import get_openai_client
+from .pipeline import PIPELINE_STAGES, process_document
+from .scheduler import OCRScheduler
+from .sheets import SHEET_GIDS, find_duplicates, find_table_range, get_worksheet_by_gid, open_spreadsheet
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".pdf")
+
+# Colonnes du fichier de sortie : fichier source, type, puis les 8 colonnes de la feuille
+OUTPUT_COLUMNS = ["Fichier", "Type document"] + sheet_columns("FACTURE")
+
+
+def collect_images(inputs: List[str]) -> List[str]:
+    """Liste triée et sans doublon des images et PDF désignés par des dossiers, fichiers ou motifs glob"""
+    paths = []
+    for value in inputs:
+        if os.path.isdir(value):
+            candidates = [os.path.join(value, name) for name in os.listdir(value)]
+        else:
+            candidates = glob.glob(value) or [value]
+        paths.extend(
+            path for path in candidates
+            if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    return sorted(set(paths))
+
+
+def find_near_duplicates(paths: List[str], index: DocumentIndex) -> Tuple[Dict[str, bytes], Dict[str, List[Dict[str, Any]]]]:
+    """
+    Empreintes des fichiers (première page pour un PDF) et quasi-doublons de chacun
+
+    Un fichier est comparé à l'index des documents déjà analysés et aux
+    fichiers qui le précèdent dans le lot.
+    """
+    fingerprints = {}
+    near_duplicates = {}
+    batch_index = DocumentIndex(path=None, max_distance=index.max_distance)
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                fingerprint = phash(load_document_pages(f.read())[0])
+        except Exception as e:
+            # Fichier illisible : l'erreur sera signalée par son traitement
+            logger.warning("Empreinte de %s impossible (%s)", path, e)
+            continue
+        fingerprints[path] = fingerprint
+        matches = index.find_near_duplicates(fingerprint) + batch_index.find_near_duplicates(fingerprint)
+        if matches:
+            near_duplicates[path] = sorted(matches, key=lambda entry: entry["distance"])
+        batch_index.add(fingerprint, source=os.path.basename(path))
+    return fingerprints, near_duplicates
+
+
+def read_and_process(path: str, client=None, editeur: str = "",
+                     correct_geometry: Optional[bool] = None,
+                     backend: Optional[str] = None) -> Dict[str, Any]:
+    """Lit et traite un fichier image ou PDF (étapes journalisées au niveau INFO)"""
+    name = os.path.basename(path)
+    with open(path, "rb") as f:
+        return process_document(load_document_pages(f.read()), client=client, editeur=editeur,
+                                progress=lambda stage: logger.info("%s : %s", name, PIPELINE_STAGES[stage][0]),
+                                correct_geometry=correct_geometry, backend=backend)
+
+
+def process_files(paths: List[str], client, editeur: str = "",
+                  concurrency: int = 4, correct_geometry: Optional[bool] = None,
+                  backend: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Traite les fichiers en parallèle et produit chaque résultat dès qu'il est prêt
+
+    Les erreurs d'un document sont enregistrées dans son résultat (clé errors)
+    sans interrompre le lot.
+    """
+    with OCRScheduler(max_concurrency=concurrency) as scheduler:
+        futures = {
+            scheduler.submit(read_and_process, path, client=client, editeur=editeur,
+                             correct_geometry=correct_geometry, backend=backend): path
+            for path in paths
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                processed = future.result()
+            except Exception as e:
+                logger.exception("Échec du traitement de %s", path)
+                processed = {"document_type": "DOCUMENT INCONNU", "rows": [], "context": {"errors": [str(e)]}}
+            processed["path"] = path
+            processed["errors"] = list(processed["context"].get("errors", []))
+            yield processed
+        logger.info("Appels OpenAI : %s", scheduler.metrics_snapshot())
+
+
+def rows_dataframe(documents: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Table de toutes les lignes produites, avec le fichier et le type d'origine"""
+    records = [
+        [os.path.basename(doc["path"]), doc["document_type"]] + list(row)
+        for doc in documents
+        for row in doc["rows"]
+    ]
+    return pd.DataFrame(records, columns=OUTPUT_COLUMNS)
+
+
+def write_output(df: pd.DataFrame, path: str):
+    """Écrit la table en CSV ou en Parquet (selon l'extension ; Parquet nécessite pyarrow)"""
+    if path.lower().endswith(".parquet"):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False, encoding="utf-8-sig")
+
+
+def export_to_sheets(documents: List[Dict[str, Any]], sa_info: Dict[str, Any],
+                     skip_duplicates: bool = True) -> Dict[str, int]:
+    """
+    Ajoute les lignes dans Google Sheets, en un appel par onglet
+
+    Chaque onglet n'est lu qu'une fois pour la détection des doublons ; les
+    documents déjà présents (dans la feuille ou plus tôt dans le lot) sont
+    ignorés si skip_duplicates est vrai.
+    """
+    spreadsheet = open_spreadsheet(sa_info)
+    stats = {"rows": 0, "documents": 0, "duplicates": 0}
+
+    by_gid: Dict[int, List[Dict[str, Any]]] = {}
+    for doc in documents:
+        if doc["rows"]:
+            by_gid.setdefault(SHEET_GIDS.get(doc["document_type"], SHEET_GIDS["FACTURE EN COMPTE"]), []).append(doc)
+
+    for gid, gid_documents in by_gid.items():
+        worksheet = get_worksheet_by_gid(spreadsheet, gid) or spreadsheet.get_worksheet(0)
+        existing = worksheet.get_all_values() if skip_duplicates else []
+
+        new_rows = []
+        for doc in gid_documents:
+            if skip_duplicates:
+                duplicate_found, _ = find_duplicates(doc["document_type"], doc["data"], existing)
+                if duplicate_found:
+                    logger.warning("%s : document déjà présent dans la feuille, ignoré", doc["path"])
+                    stats["duplicates"] += 1
+                    continue
+                existing.extend(doc["rows"])
+            new_rows.extend(doc["rows"])
+            stats["documents"] += 1
+
+        if new_rows:
+            worksheet.append_rows(new_rows, table_range=find_table_range(worksheet, num_columns=8))
+            stats["rows"] += len(new_rows)
+
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Traitement par lots des documents scannés")
+    arg_parser.add_argument("inputs", nargs="+", help="Dossiers, fichiers ou motifs glob d'images JPG/PNG ou de PDF")
+    arg_parser.add_argument("--output", help="Fichier de sortie .csv ou .parquet")
+    arg_parser.add_argument("--sheets-credentials",
+                            help="JSON du compte de service Google : ajoute les lignes dans Google Sheets")
+    arg_parser.add_argument("--allow-duplicates", action="store_true",
+                            help="Enregistrer aussi les documents déjà présents dans la feuille")
+    arg_parser.add_argument("--skip-near-duplicates", action="store_true",
+                            help="Ne pas analyser les images qui ressemblent à un document déjà traité")
+    arg_parser.add_argument("--concurrency", type=int, default=4,
+                            help="Nombre d'analyses OCR simultanées")
+    arg_parser.add_argument("--no-correction", action="store_true",
+                            help="Ne pas redresser les images avec OpenCV")
+    arg_parser.add_argument("--backend", choices=sorted(OCR_BACKENDS), default=DEFAULT_OCR_BACKEND,
+                            help="Moteur d'OCR : OpenAI Vision, Tesseract local (hors ligne) "
+                                 "ou hybride (local, OpenAI Vision si la lecture n'est pas fiable)")
+    arg_parser.add_argument("--editeur", default="", help="Nom inscrit dans la colonne Editeur")
+    arg_parser.add_argument("-v", "--verbose", action="store_true", help="Journalisation détaillée")
+    args = arg_parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(levelname)s %(name)s: %(message)s")
+
+    if not args.output and not args.sheets_credentials:
+        arg_parser.error("indiquer --output et/ou --sheets-credentials")
+
+    paths = collect_images(args.inputs)
+    if not paths:
+        print("❌ Aucune image JPG/PNG ni aucun PDF trouvé", file=sys.stderr)
+        return 1
+
+    backend = get_ocr_backend(args.backend)
+    if not backend.available():
+        print(f"❌ {backend.label} indisponible", file=sys.stderr)
+        return 1
+    client = None
+    if backend.name != "local":
+        try:
+            client = get_openai_client()
+        except Exception as e:
+            print(f"❌ Erreur d'initialisation OpenAI: {str(e)}", file=sys.stderr)
+            return 1
+
+    document_index = get_document_index()
+    fingerprints, near_duplicates = find_near_duplicates(paths, document_index)
+    for path, matches in near_duplicates.items():
+        action = "ignoré" if args.skip_near_duplicates else "traité quand même"
+        print(f"⚠️ {os.path.basename(path)} ressemble à {describe_document(matches[0])} ({action})",
+              file=sys.stderr)
+    if args.skip_near_duplicates:
+        paths = [path for path in paths if path not in near_duplicates]
+
+    documents = []
+    for doc in process_files(paths, client, args.editeur, args.concurrency,
+                             correct_geometry=False if args.no_correction else None, backend=backend.name):
+        documents.append(doc)
+        status = "❌" if doc["errors"] or not doc["rows"] else "✅"
+        cached = " (cache OCR)" if doc.get("context", {}).get("ocr_cache_hit") else ""
+        if doc.get("context", {}).get("ocr_fallback"):
+            cached += f" (modèle de secours {doc['context']['ocr_fallback']})"
+        if doc.get("context", {}).get("ocr_confidence") is not None:
+            cached += f" (confiance OCR {doc['context']['ocr_confidence']:.0%})"
+        routing = doc.get("context", {}).get("ocr_routing")
+        if routing and routing["backend"] != "local":
+            cached += f" (OpenAI Vision : {', '.join(routing['reasons'])})"
+        print(f"{status} [{len(documents)}/{len(paths)}] {os.path.basename(doc['path'])} : "
+              f"{doc['document_type']}, {len(doc['rows'])} ligne(s){cached}", file=sys.stderr)
+        for error in doc["errors"]:
+            print(f"   {error}", file=sys.stderr)
+        if doc["rows"] and doc["path"] in fingerprints:
+            index_document(document_index, fingerprints[doc["path"]], doc["document_type"], doc["data"],
+                           source=os.path.basename(doc["path"]))
+    documents.sort(key=lambda doc: doc["path"])
+
+    routings = [doc["context"]["ocr_routing"] for doc in documents if doc.get("context", {}).get("ocr_routing")]
+    if routings:
+        local = sum(1 for routing in routings if routing["backend"] == "local")
+        print(f"🔀 Routage : {local} document(s) lu(s) localement, {len(routings) - local} envoyé(s) "
+              f"à OpenAI Vision", file=sys.stderr)
+
+    sent_metrics = [doc["context"]["image_metrics"] for doc in documents
+                    if doc.get("context", {}).get("image_metrics")]
+    if sent_metrics:
+        original_bytes = sum(m["original_bytes"] for m in sent_metrics)
+        sent_bytes = sum(m["sent_bytes"] for m in sent_metrics)
+        print(f"🖼️ Images : {original_bytes / 1e6:.1f} Mo lus, {sent_bytes / 1e6:.1f} Mo préparés pour l'IA "
+              f"({100 * sent_bytes / max(original_bytes, 1):.0f}%), "
+              f"préparation {sum(m['duration_ms'] for m in sent_metrics) / len(sent_metrics):.0f} ms/image "
+              f"dont {sum(m.get('correction_ms', 0) for m in sent_metrics) / len(sent_metrics):.0f} ms de correction",
+              file=sys.stderr)
+
+    if args.output:
+        df = rows_dataframe(documents)
+        write_output(df, args.output)
+        print(f"📄 {len(df)} ligne(s) écrite(s) dans {args.output}", file=sys.stderr)
+
+    if args.sheets_credentials:
+        with open(args.sheets_credentials, encoding="utf-8") as f:
+            sa_info = json.load(f)
+        stats = export_to_sheets(documents, sa_info, skip_duplicates=not args.allow_duplicates)
+        print(f"📊 Google Sheets : {stats['rows']} ligne(s) pour {stats['documents']} document(s), "
+              f"{stats['duplicates']} doublon(s) ignoré(s)", file=sys.stderr)
+
+    failed = sum(1 for doc in documents if doc["errors"] or not doc["rows"])
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Détection des quasi-doublons de documents par empreinte perceptuelle
+
+Deux photos du même BDC prises sous des angles légèrement différents ont des
+octets différents (le cache OCR ne les reconnaît pas) mais des empreintes
+perceptuelles très proches. L'index des documents déjà traités permet de
+signaler ces quasi-doublons avant l'appel OpenAI Vision, et donc avant la
+vérification des doublons dans Google Sheets. Un document d'un même modèle
+peut rester proche : les quasi-doublons sont signalés, l'opérateur décide.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Empreinte pHash de HASH_SIZE x HASH_SIZE bits (144) : les coefficients DCT
+# basse fréquence résistent mieux qu'un dHash aux pages presque blanches, et
+# distinguent deux documents différents d'un même modèle (DLP, S2M, ULYS)
+HASH_SIZE = 12
+NEAR_DUPLICATE_MAX_DISTANCE = 20
+DOCUMENT_INDEX_TTL_SECONDS = 90 * 24 * 3600
+DOCUMENT_INDEX_PATH = os.environ.get(
+    "CHANFOUI_DOCUMENT_INDEX",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 ".cache", "document_index.sqlite")
+)
+
+DOCUMENT_INDEX_FIELDS = ("source", "document_type", "client", "numero", "date")
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)
+    return np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+
+
+def phash(image: Union[Image.Image, bytes], hash_size: int = HASH_SIZE) -> bytes:
+    """
+    Empreinte perceptuelle pHash : signe des coefficients DCT basse fréquence
+    d'une vignette en niveaux de gris par rapport à leur médiane
+
+    Retourne hash_size * hash_size bits empaquetés en octets.
+    """
+    size = hash_size * 4
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(BytesIO(image))
+        # Décodage JPEG à résolution réduite : la vignette suffit
+        image.draft("L", (size * 8, size * 8))
+    pixels = np.asarray(image.convert("L").resize((size, size), Image.LANCZOS), dtype=np.float64)
+    dct = _dct_matrix(size)
+    low = (dct @ pixels @ dct.T)[:hash_size, :hash_size].ravel()
+    # La composante continue (luminosité moyenne) n'est pas discriminante
+    bits = low > np.median(low[1:])
+    bits[0] = False
+    return np.packbits(bits).tobytes()
+
+
+def hamming_distances(fingerprint: bytes, fingerprints: np.ndarray) -> np.ndarray:
+    """Distances de Hamming entre une empreinte et une matrice d'empreintes (une par ligne)"""
+    if len(fingerprints) == 0:
+        return np.zeros(0, dtype=np.int64)
+    xor = np.bitwise_xor(fingerprints, np.frombuffer(fingerprint, dtype=np.uint8))
+    return np.unpackbits(xor, axis=1).sum(axis=1)
+
+
+class DocumentIndex:
+    """
+    Index persistant (SQLite) des empreintes des documents déjà traités
+
+    Chaque entrée garde de quoi décrire le document à l'opérateur (fichier
+    source, type, client, numéro, date). Les recherches sont vectorisées sur
+    une copie en mémoire des empreintes. Sans chemin, l'index reste en mémoire.
+    """
+
+    def __init__(self, path: Optional[str] = DOCUMENT_INDEX_PATH,
+                 max_distance: int = NEAR_DUPLICATE_MAX_DISTANCE,
+                 ttl_seconds: float = DOCUMENT_INDEX_TTL_SECONDS):
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._fingerprints: List[bytes] = []
+        self._entries: List[Dict[str, Any]] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._db = None
+        if path:
+            self._open(path)
+
+    def _open(self, path: str):
+        """Ouvre la base SQLite, purge les entrées expirées et charge les autres"""
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(path, check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "fingerprint BLOB, source TEXT, document_type TEXT, client TEXT, "
+                "numero TEXT, date TEXT, created_at REAL)"
+            )
+            db.execute("DELETE FROM documents WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            db.commit()
+            for fingerprint, *values in db.execute(
+                "SELECT fingerprint, source, document_type, client, numero, date, created_at "
+                "FROM documents ORDER BY rowid"
+            ):
+                self._fingerprints.append(bytes(fingerprint))
+                self._entries.append(dict(zip(DOCUMENT_INDEX_FIELDS + ("created_at",), values)))
+            self._db = db
+        except sqlite3.Error:
+            # Système de fichiers en lecture seule ou base corrompue : index mémoire seul
+            logger.warning("Index des documents non persistant (%s)", path)
+            self._db = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def find_near_duplicates(self, fingerprint: bytes) -> List[Dict[str, Any]]:
+        """Documents déjà traités dont l'empreinte est à au plus max_distance bits, du plus proche au plus lointain"""
+        with self._lock:
+            if not self._fingerprints:
+                return []
+            if self._matrix is None:
+                self._matrix = np.frombuffer(b"".join(self._fingerprints), dtype=np.uint8).reshape(
+                    len(self._fingerprints), -1
+                )
+            distances = hamming_distances(fingerprint, self._matrix)
+            close = np.flatnonzero(distances <= self.max_distance)
+            close = close[np.argsort(distances[close], kind="stable")]
+            return [dict(self._entries[i], distance=int(distances[i])) for i in close]
+
+    def add(self, fingerprint: bytes, **info):
+        """Enregistre un document traité (champs de DOCUMENT_INDEX_FIELDS)"""
+        entry = {field: str(info.get(field) or "") for field in DOCUMENT_INDEX_FIELDS}
+        entry["created_at"] = time.time()
+        with self._lock:
+            self._fingerprints.append(fingerprint)
+            self._entries.append(entry)
+            self._matrix = None
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT INTO documents VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (fingerprint, *(entry[field] for field in DOCUMENT_INDEX_FIELDS), entry["created_at"])
+                    )
+                    self._db.commit()
+                except sqlite3.Error:
+                    self._db = None
+
+
+def index_document(index: DocumentIndex, fingerprint: bytes, document_type: str,
+                   data: Dict[str, Any], source: str = ""):
+    """Enregistre dans l'index un document analysé à partir de ses informations extraites"""
+    index.add(
+        fingerprint,
+        source=source,
+        document_type=document_type,
+        client=data.get("client"),
+        numero=data.get("numero") or data.get("numero_facture"),
+        date=data.get("date"),
+    )
+
+
+def describe_document(entry: Dict[str, Any]) -> str:
+    """Description lisible d'une entrée de l'index (pour les avertissements)"""
+    parts = [entry.get("document_type") or "Document"]
+    if entry.get("client"):
+        parts.append(entry["client"])
+    if entry.get("numero"):
+        parts.append(f"n° {entry['numero']}")
+    if entry.get("date"):
+        parts.append(f"du {entry['date']}")
+    description = " ".join(parts)
+    if entry.get("source"):
+        description += f" ({entry['source']})"
+    return description
+
+
+# Index partagé des documents déjà analysés
+_DOCUMENT_INDEX: Optional[DocumentIndex] = None
+_DOCUMENT_INDEX_LOCK = threading.Lock()
+
+
+def get_document_index() -> DocumentIndex:
+    """Index des documents partagé, ouvert (et son fichier créé) au premier usage"""
+    global _DOCUMENT_INDEX
+    with _DOCUMENT_INDEX_LOCK:
+        if _DOCUMENT_INDEX is None:
+            _DOCUMENT_INDEX = DocumentIndex()
+        return _DOCUMENT_INDEX
@@ -0,0 +1,599 @@
+"""
+Documents : détection du type, extraction des champs et préparation des lignes
+
+Fonctions pures sur le texte OCR et les données extraites, sans dépendance à
+Streamlit. Les valeurs auparavant écrites dans st.session_state (quartier S2M,
+nom du magasin ULYS) sont renvoyées dans les résultats ou dans le contexte
+d'analyse fourni par l'appelant.
+"""
+import re
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+import pandas as pd
+from dateutil import parser
+
+
+# ============================================================
+# FONCTION POUR EXTRACTION DU NUMERO FACT MANUSCRIT
+# ============================================================
+def extract_fact_number_from_handwritten(text: str) -> str:
+    """Extrait le numéro après 'F' ou 'Fact' manuscrit - pour TOUS les BDC"""
+    if not text:
+        return ""
+    
+    # Normaliser le texte
+    text = text.replace('\n', ' ').replace('\r', ' ')
+    
+    # Chercher les motifs avec "Fact" ou "F" manuscrit suivi de chiffres
+    patterns = [
+        r'\bFact\s*[:.]?\s*(\d{4,})\b',      # Fact 12345 ou Fact: 12345
+        r'\bF\s*[:.]?\s*(\d{4,})\b',         # F 12345 ou F: 12345
+        r'\bfact\s*[:.]?\s*(\d{4,})\b',      # fact 12345 (minuscule)
+        r'\bf\s*[:.]?\s*(\d{4,})\b',         # f 12345 (minuscule)
+        r'Fact\.?\s*(\d{4,})',               # Fact.12345
+        r'F\.?\s*(\d{4,})',                  # F.12345
+    ]
+    
+    all_matches = []
+    for pattern in patterns:
+        matches = re.finditer(pattern, text, re.IGNORECASE)
+        for match in matches:
+            number = match.group(1)
+            all_matches.append({
+                'number': number,
+                'pattern': pattern,
+                'position': match.start(),
+                'is_fact': 'fact' in pattern.lower()
+            })
+    
+    if not all_matches:
+        return ""
+    
+    # 1. Priorité aux matches qui contiennent "Fact" (pas juste "F")
+    fact_matches = [m for m in all_matches if m['is_fact']]
+    if fact_matches:
+        fact_matches.sort(key=lambda x: x['position'], reverse=True)
+        return fact_matches[0]['number']
+    
+    # 2. Sinon, prendre le dernier "F" trouvé
+    all_matches.sort(key=lambda x: x['position'], reverse=True)
+    return all_matches[0]['number']
+
+# ============================================================
+# FONCTION POUR EXTRACTION DU NOM MAGASIN DEPUIS "DOIT M :"
+# ============================================================
+def extract_motel_name_from_doit(text: str) -> str:
+    """
+    Extrait le nom du magasin après "DOIT M :" pour les factures CLIENT EN COMPTE
+    lorsque le client n'est pas ULYS, DLP, S2M
+    """
+    if not text:
+        return ""
+    
+    # Chercher le motif "DOIT M :" (avec variations)
+    patterns = [
+        r'DOIT\s+M\s*:\s*(.+)',
+        r'DOIT\s+M\s*:\s*(.+?)(?:\n|$)',
+        r'DOIT\s*M\s*:\s*(.+)',
+        r'DOIT\s*:\s*(.+?)(?:\n|$)',  # Fallback pour "DOIT :"
+    ]
+    
+    for pattern in patterns:
+        match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
+        if match:
+            motel_name = match.group(1).strip()
+            
+            # Nettoyer les caractères spéciaux
+            motel_name = re.sub(r'[\n\r\t]', ' ', motel_name)
+            motel_name = ' '.join(motel_name.split())
+            
+            # Retirer les espaces en trop et normaliser
+            motel_name = motel_name.strip()
+            
+            if motel_name:
+                return motel_name
+    
+    return ""
+
+# ============================================================
+# FONCTION POUR NETTOYER LE QUARTIER S2M
+# ============================================================
+def clean_quartier(quartier: str) -> str:
+    """Nettoie le nom du quartier pour S2M"""
+    if not quartier:
+        return ""
+    
+    # Supprimer les guillemets, deux-points, etc.
+    quartier = re.sub(r'["\'\[\]:]', '', quartier)
+    
+    # Supprimer "quartier_s2m" et variations
+    quartier = re.sub(r'quartier[_\-]?s2m', '', quartier, flags=re.IGNORECASE)
+    
+    # Nettoyer les espaces
+    quartier = ' '.join(quartier.split())
+    
+    return quartier.strip()
+
+# ============================================================
+# FONCTION POUR NETTOYER L'ADRESSE S2M
+# ============================================================
+def clean_adresse(adresse: str) -> str:
+    """Nettoie l'adresse extraite pour S2M"""
+    if not adresse:
+        return ""
+    
+    # Si l'adresse contient le format JSON-like
+    if '"quartier_s2m"' in adresse or "quartier_s2m" in adresse:
+        # Extraire juste le quartier
+        match = re.search(r'"quartier_s2m":\s*"([^"]+)"', adresse)
+        if match:
+            quartier = match.group(1)
+            return f"Supermaki {quartier}"
+        
+        # Autre format
+        match = re.search(r'quartier_s2m[":\s]+([^",}\]]+)', adresse)
+        if match:
+            quartier = match.group(1).strip()
+            quartier = clean_quartier(quartier)
+            return f"Supermaki {quartier}"
+    
+    # Si c'est déjà "Supermaki" suivi de quelque chose
+    if "Supermaki" in adresse:
+        # Nettoyer les caractères spéciaux
+        adresse = re.sub(r'["\'\[\]:]', ' ', adresse)
+        adresse = re.sub(r'\s+', ' ', adresse)
+        return adresse.strip()
+    
+    return adresse.strip()
+
+# ============================================================
+# FONCTION DE NORMALISATION DU TYPE DE DOCUMENT - VERSION AMÉLIORÉE V1.1
+# ============================================================
+def normalize_document_type(doc_type: str) -> str:
+    """Normalise le type de document pour correspondre aux clés SHEET_GIDS - VERSION AMÉLIORÉE V1.1"""
+    if not doc_type:
+        return "DOCUMENT INCONNU"
+    
+    doc_type_upper = doc_type.upper()
+    
+    facture_keywords = [
+        "FACTURE", "INVOICE", "BILL", "FACTURA",
+        "FACTURE EN COMPTE", "FACTURE N°", "FACTURE NO",
+        "DOIT", "AU NOM DE", "NOM DU CLIENT", "N° FACTURE"
+    ]
+    
+    bdc_keywords = [
+        "BDC", "BON DE COMMANDE", "ORDER", "COMMANDE",
+        "BON COMMANDE", "PURCHASE ORDER", "PO",
+        "DATE ÉMISSION", "DATE EMISSION", "BON DE COMMANDE N°"
+    ]
+    
+    facture_score = sum(1 for keyword in facture_keywords if keyword in doc_type_upper)
+    bdc_score = sum(1 for keyword in bdc_keywords if keyword in doc_type_upper)
+    
+    if facture_score > bdc_score:
+        return "FACTURE EN COMPTE"
+    
+    elif bdc_score > facture_score:
+        if "LEADERPRICE" in doc_type_upper or "DLP" in doc_type_upper:
+            return "BDC LEADERPRICE"
+        elif "ULYS" in doc_type_upper:
+            return "BDC ULYS"
+        elif "S2M" in doc_type_upper or "SUPERMAKI" in doc_type_upper:
+            return "BDC S2M"
+        else:
+            return "BDC LEADERPRICE"
+    
+    else:
+        if "FACTURE" in doc_type_upper and "COMPTE" in doc_type_upper:
+            return "FACTURE EN COMPTE"
+        elif "BDC" in doc_type_upper or "BON DE COMMANDE" in doc_type_upper:
+            if "LEADERPRICE" in doc_type_upper or "DLP" in doc_type_upper:
+                return "BDC LEADERPRICE"
+            elif "S2M" in doc_type_upper or "SUPERMAKI" in doc_type_upper:
+                return "BDC S2M"
+            elif "ULYS" in doc_type_upper:
+                return "BDC ULYS"
+            else:
+                return "BDC LEADERPRICE"
+        else:
+            if any(word in doc_type_upper for word in ["FACTURE", "INVOICE", "BILL", "DOIT"]):
+                return "FACTURE EN COMPTE"
+            elif any(word in doc_type_upper for word in ["COMMANDE", "ORDER", "PO", "BDC"]):
+                return "BDC LEADERPRICE"
+            else:
+                return "DOCUMENT INCONNU"
+
+# ============================================================
+# FONCTION DE DÉTECTION PRÉCISE DU TYPE DE DOCUMENT
+# ============================================================
+def detect_document_type_from_text(text: str) -> Dict[str, Any]:
+    """Détecte précisément le type de document basé sur les indices fournis"""
+    text_upper = text.upper()
+    
+    dlp_indicators = [
+        "DISTRIBUTION LEADER PRICE",
+        "D.L.P.M.S.A.R.L",
+        "NIF : 2000003904",
+        "2000003904"
+    ]
+    
+    s2m_indicators = [
+        "SUPERMAKI",
+        "RAYON"
+    ]
+    
+    ulys_indicators = [
+        "BON DE COMMANDE FOURNISSEUR",
+        "NOM DU MAGASIN"
+    ]
+    
+    facture_indicators = [
+        "FACTURE EN COMPTE",
+        "FACTURE À PAYER AVANT LE",
+        "FACTURE A PAYER AVANT LE"
+    ]
+    
+    dlp_score = sum(1 for indicator in dlp_indicators if indicator in text_upper)
+    s2m_score = sum(1 for indicator in s2m_indicators if indicator in text_upper)
+    ulys_score = sum(1 for indicator in ulys_indicators if indicator in text_upper)
+    facture_score = sum(1 for indicator in facture_indicators if indicator in text_upper)
+    
+    detection_result = {
+        "type": "UNKNOWN",
+        "scores": {
+            "DLP": dlp_score,
+            "S2M": s2m_score,
+            "ULYS": ulys_score,
+            "FACTURE": facture_score
+        },
+        "indicators_found": []
+    }
+    
+    max_score = max(dlp_score, s2m_score, ulys_score, facture_score)
+    
+    if max_score == 0:
+        detection_result["type"] = "UNKNOWN"
+    elif dlp_score == max_score:
+        detection_result["type"] = "DLP"
+        detection_result["indicators_found"] = [ind for ind in dlp_indicators if ind in text_upper]
+    elif s2m_score == max_score:
+        detection_result["type"] = "S2M"
+        detection_result["indicators_found"] = [ind for ind in s2m_indicators if ind in text_upper]
+        
+        if "SUPERMAKI" in text_upper:
+            lines = text.split('\n')
+            for i, line in enumerate(lines):
+                if "SUPERMAKI" in line.upper():
+                    if i + 1 < len(lines):
+                        next_line = lines[i + 1].strip()
+                        if next_line and len(next_line) > 0:
+                            detection_result["quartier_s2m"] = next_line
+                            break
+    elif ulys_score == max_score:
+        detection_result["type"] = "ULYS"
+        detection_result["indicators_found"] = [ind for ind in ulys_indicators if ind in text_upper]
+        
+        if "NOM DU MAGASIN" in text_upper:
+            lines = text.split('\n')
+            for i, line in enumerate(lines):
+                if "NOM DU MAGASIN" in line.upper():
+                    if i + 1 < len(lines):
+                        next_line = lines[i + 1].strip()
+                        if next_line and len(next_line) > 0:
+                            detection_result["nom_magasin_ulys"] = next_line
+                            break
+    elif facture_score == max_score:
+        detection_result["type"] = "FACTURE"
+        detection_result["indicators_found"] = [ind for ind in facture_indicators if ind in text_upper]
+    
+    return detection_result
+
+# ============================================================
+# FONCTIONS OCR AMÉLIORÉES POUR MEILLEURE DÉTECTION - V1.3
+# ============================================================
+def extract_text_features_for_detection(text: str) -> Dict[str, Any]:
+    """Extrait les caractéristiques du texte pour aider à la détection du type de document"""
+    text_upper = text.upper()
+    
+    features = {
+        'has_facture': False,
+        'has_bdc': False,
+        'facture_keywords': [],
+        'bdc_keywords': [],
+        'facture_score': 0,
+        'bdc_score': 0
+    }
+    
+    facture_keywords = [
+        "FACTURE", "FACTURE EN COMPTE", "N° FACTURE", "NUMERO FACTURE",
+        "DOIT", "AU NOM DE", "CLIENT", "ADRESSE DE LIVRAISON",
+        "SUIVANT VOTRE BON DE COMMANDE", "BON DE COMMANDE",
+        "QUANTITE", "BOUTEILLES", "MONTANT", "TOTAL", "TVA"
+    ]
+    
+    bdc_keywords = [
+        "BDC", "BON DE COMMANDE", "COMMANDE", "DATE EMISSION",
+        "DATE ÉMISSION", "ADRESSE FACTURATION", "ADRESSE LIVRAISON",
+        "DESIGNATION", "QTÉ", "QUANTITE", "ARTICLE", "REFERENCE",
+        "CODE ARTICLE", "PRIX UNITAIRE", "SOUS TOTAL"
+    ]
+    
+    for keyword in facture_keywords:
+        if keyword in text_upper:
+            features['facture_keywords'].append(keyword)
+            features['facture_score'] += 1
+            features['has_facture'] = True
+    
+    for keyword in bdc_keywords:
+        if keyword in text_upper:
+            features['bdc_keywords'].append(keyword)
+            features['bdc_score'] += 1
+            features['has_bdc'] = True
+    
+    if "FACTURE" in text_upper and "COMPTE" in text_upper:
+        features['facture_score'] += 3
+    
+    if "BDC" in text_upper or "BON DE COMMANDE" in text_upper:
+        features['bdc_score'] += 2
+    
+    if "DOIT" in text_upper:
+        features['facture_score'] += 2
+    
+    if "DATE EMISSION" in text_upper or "DATE ÉMISSION" in text_upper:
+        features['bdc_score'] += 2
+    
+    return features
+
+def guess_document_type_from_text(text: str, context: Optional[Dict[str, Any]] = None) -> Dict:
+    """
+    Devine le type de document à partir du texte OCR
+
+    Le quartier S2M et le nom du magasin ULYS détectés sont recopiés dans
+    context (s'il est fourni) pour être réutilisés par l'appelant.
+    """
+    detection = detect_document_type_from_text(text)
+    if context is not None:
+        for key in ("quartier_s2m", "nom_magasin_ulys"):
+            if detection.get(key):
+                context[key] = detection[key]
+    
+    fact_manuscrit = extract_fact_number_from_handwritten(text)
+    
+    if detection["type"] == "DLP":
+        return {
+            "type_document": "BDC",
+            "document_subtype": "DLP",
+            "client": "DLP",
+            "adresse_livraison": "Leader Price Akadimbahoaka",
+            "fact_manuscrit": fact_manuscrit,
+            "numero": fact_manuscrit,
+            "articles": []
+        }
+    elif detection["type"] == "S2M":
+        quartier = detection.get("quartier_s2m", "")
+        return {
+            "type_document": "BDC",
+            "document_subtype": "S2M",
+            "client": "S2M",
+            "adresse_livraison": clean_adresse(f"Supermaki {quartier}" if quartier else "Supermaki"),
+            "fact_manuscrit": fact_manuscrit,
+            "numero": fact_manuscrit,
+            "articles": []
+        }
+    elif detection["type"] == "ULYS":
+        nom_magasin = detection.get("nom_magasin_ulys", "")
+        return {
+            "type_document": "BDC",
+            "document_subtype": "ULYS",
+            "client": "ULYS",
+            "adresse_livraison": nom_magasin if nom_magasin else "ULYS Magasin",
+            "fact_manuscrit": fact_manuscrit,
+            "numero": fact_manuscrit,
+            "articles": []
+        }
+    elif detection["type"] == "FACTURE":
+        return {
+            "type_document": "FACTURE",
+            "document_subtype": "FACTURE",
+            "articles": []
+        }
+    else:
+        features = extract_text_features_for_detection(text)
+        
+        if features['facture_score'] > features['bdc_score']:
+            return {"type_document": "FACTURE", "document_subtype": "FACTURE", "articles": []}
+        else:
+            return {"type_document": "BDC", "document_subtype": "UNKNOWN", "fact_manuscrit": fact_manuscrit, "numero": fact_manuscrit, "articles": []}
+
+def clean_text(text: str) -> str:
+    """Nettoie le texte"""
+    text = text.replace("\r", "\n")
+    text = re.sub(r"[^\S\r\n]+", " ", text)
+    return text.strip()
+
+def format_date_french(date_str: str) -> str:
+    """Formate la date au format français JJ/MM/AAAA"""
+    try:
+        # Essayer de parser la date avec différents formats
+        formats = [
+            "%d/%m/%Y", "%d-%m-%Y", "%d %m %Y",
+            "%d/%m/%y", "%d-%m-%y", "%d %m %y",
+            "%d %B %Y", "%d %b %Y", "%Y-%m-%d"
+        ]
+        
+        for fmt in formats:
+            try:
+                date_obj = datetime.strptime(date_str, fmt)
+                return date_obj.strftime("%d/%m/%Y")  # FORMAT CORRIGÉ: JJ/MM/AAAA
+            except:
+                continue
+        
+        # Essayer avec dateutil.parser
+        try:
+            date_obj = parser.parse(date_str, dayfirst=True)
+            return date_obj.strftime("%d/%m/%Y")  # FORMAT CORRIGÉ: JJ/MM/AAAA
+        except:
+            # Si aucune date n'est trouvée, retourner la date d'aujourd'hui
+            return datetime.now().strftime("%d/%m/%Y")
+    except:
+        return datetime.now().strftime("%d/%m/%Y")
+
+def get_month_from_date(date_str: str) -> str:
+    """Extrait le mois français d'une date"""
+    months_fr = {
+        1: "janvier", 2: "février", 3: "mars", 4: "avril",
+        5: "mai", 6: "juin", 7: "juillet", 8: "août",
+        9: "septembre", 10: "octobre", 11: "novembre", 12: "décembre"
+    }
+    
+    try:
+        # Essayer de parser la date
+        date_obj = parser.parse(date_str, dayfirst=True)
+        return months_fr[date_obj.month]
+    except:
+        # Si la date n'est pas valide, utiliser le mois actuel
+        return months_fr[datetime.now().month]
+
+def format_quantity(qty: Any) -> str:
+    """Formate la quantité - GARANTIT QUE C'EST UN NOMBRE ENTIER SANS VIRGULE"""
+    if qty is None:
+        return "0"
+    
+    try:
+        if isinstance(qty, str):
+            qty = qty.replace(',', '.')
+        
+        qty_num = float(qty)
+        
+        qty_int = int(round(qty_num))
+        
+        if qty_int < 0:
+            qty_int = 0
+            
+        return str(qty_int)
+        
+    except (ValueError, TypeError):
+        return "0"
+
+def map_client(client: str) -> str:
+    """Mappe le nom du client vers la forme standard"""
+    client_upper = client.upper()
+    
+    if "ULYS" in client_upper:
+        return "ULYS"
+    elif "SUPERMAKI" in client_upper or "S2M" in client_upper:
+        return "S2M"
+    elif "LEADER" in client_upper or "LEADERPRICE" in client_upper or "DLP" in client_upper:
+        return "DLP"
+    else:
+        return client
+
+# ============================================================
+# FONCTIONS POUR PRÉPARER LES DONNÉES POUR GOOGLE SHEETS (PRODUCTION)
+# ============================================================
+def prepare_facture_rows(data: dict, articles_df: pd.DataFrame, editeur: str = "") -> List[List[str]]:
+    """Prépare les lignes pour les factures (PRODUCTION - 8 colonnes) - CORRECTION DATE APPLIQUÉE"""
+    rows = []
+    
+    mois = data.get("mois", get_month_from_date(data.get("date", "")))
+    
+    # CORRECTION 1: Utiliser la date extraite et la formater en JJ/MM/AAAA
+    date_facture = data.get("date", "")
+    date_formatted = format_date_french(date_facture)  # FORMAT CORRIGÉ
+    
+    client = data.get("client", "")
+    numero_facture = data.get("numero_facture", "")
+    magasin = data.get("adresse_livraison", "")
+    
+    for _, row in articles_df.iterrows():
+        quantite = row.get("Quantité", 0)
+        if pd.isna(quantite) or quantite == 0 or str(quantite).strip() == "0":
+            continue
+        
+        quantite_str = format_quantity(quantite)
+        
+        try:
+            quantite_int = int(float(quantite_str))
+            quantite_str = str(quantite_int)
+        except:
+            quantite_str = "0"
+            continue
+        
+        designation = str(row.get("Produit Standard", "")).strip()
+        if not designation:
+            designation = str(row.get("Produit Brute", "")).strip()
+        
+        rows.append([
+            mois,           # Mois
+            date_formatted, # Date au format JJ/MM/AAAA (CORRIGÉ)
+            client,         # Client
+            numero_facture, # N* facture
+            magasin,        # Magasin
+            designation,    # Désignation
+            quantite_str,   # Quantité
+            editeur         # Editeur
+        ])
+    
+    return rows
+
+def prepare_bdc_rows(data: dict, articles_df: pd.DataFrame, editeur: str = "") -> List[List[str]]:
+    """Prépare les lignes pour les BDC (PRODUCTION - 8 colonnes) - CORRECTION DATE APPLIQUÉE"""
+    rows = []
+    
+    date_emission = data.get("date", "")
+    mois = get_month_from_date(date_emission)
+    
+    # CORRECTION 1: Utiliser la date extraite et la formater en JJ/MM/AAAA
+    date_formatted = format_date_french(date_emission)  # FORMAT CORRIGÉ
+    
+    client = data.get("client", "")
+    numero_bdc = data.get("numero", "")
+    magasin = data.get("adresse_livraison", "")
+    
+    for _, row in articles_df.iterrows():
+        quantite = row.get("Quantité", 0)
+        if pd.isna(quantite) or quantite == 0 or str(quantite).strip() == "0":
+            continue
+        
+        quantite_str = format_quantity(quantite)
+        
+        try:
+            quantite_int = int(float(quantite_str))
+            quantite_str = str(quantite_int)
+        except:
+            quantite_str = "0"
+            continue
+        
+        designation = str(row.get("Produit Standard", "")).strip()
+        if not designation:
+            designation = str(row.get("Produit Brute", "")).strip()
+        
+        rows.append([
+            mois,           # Colonne 1 (mois)
+            date_formatted, # Date au format JJ/MM/AAAA (CORRIGÉ)
+            client,         # Client
+            numero_bdc,     # FACT
+            magasin,        # Magasin
+            designation,    # Désignation
+            quantite_str,   # Quantité
+            editeur         # Editeur
+        ])
+    
+    return rows
+
+def sheet_columns(document_type: str) -> List[str]:
+    """En-têtes des 8 colonnes de la feuille selon le type de document"""
+    if "FACTURE" in document_type.upper():
+        return ["Mois", "Date", "Client", "N* facture", "Magasin", "Désignation", "Quantité", "Editeur"]
+    else:
+        return ["Mois", "Date", "Client", "FACT", "Magasin", "Désignation", "Quantité", "Editeur"]
+
+def prepare_rows_for_sheet(document_type: str, data: dict, articles_df: pd.DataFrame,
+                           editeur: str = "") -> List[List[str]]:
+    """Prépare les lignes pour l'insertion dans Google Sheets selon le type de document"""
+    if "FACTURE" in document_type.upper():
+        return prepare_facture_rows(data, articles_df, editeur)
+    else:
+        return prepare_bdc_rows(data, articles_df, editeur)
@@ -0,0 +1,402 @@
+"""
+Prétraitement des images avant l'analyse OCR
+
+Les photos de téléphone (plusieurs Mo, 12 Mpx) sont recadrées sur le
+document, redressées (perspective et inclinaison, avec OpenCV), réduites à
+la résolution réellement exploitée par le modèle de vision et encodées dans
+le format le plus compact parmi des encodages qui préservent la lisibilité
+du texte.
+"""
+import base64
+import logging
+import os
+import time
+from io import BytesIO
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# GPT-4o (détail "high") ramène l'image dans un carré de 2048 px puis son
+# petit côté à 768 px : au-delà, les pixels envoyés sont perdus
+VISION_MAX_LONG_SIDE = 2048
+VISION_MAX_SHORT_SIDE = 768
+DRAFT_MIN_SHORT_SIDE = int(VISION_MAX_SHORT_SIDE * 1.5)
+
+# Encodages candidats ; le plus petit est retenu
+VISION_ENCODINGS = (
+    ("JPEG", {"quality": 85, "optimize": True}),
+    ("WEBP", {"quality": 85, "method": 4}),
+    ("PNG", {"optimize": True}),
+)
+
+# Recadrage ignoré si le document détecté couvre moins de cette part de l'image
+MIN_DOCUMENT_AREA_RATIO = 0.3
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+# Documents PDF : résolution de rendu des pages et nombre maximal de pages analysées
+PDF_RENDER_DPI = 200
+MAX_DOCUMENT_PAGES = 20
+
+# Correction géométrique OpenCV (désactivable : CHANFOUI_DOCUMENT_CORRECTION=0)
+DOCUMENT_CORRECTION = os.environ.get("CHANFOUI_DOCUMENT_CORRECTION", "1").lower() not in ("0", "false", "non", "")
+QUAD_DETECTION_SIZE = 800
+MAX_DESKEW_ANGLE = 10.0
+DESKEW_ANGLE_STEP = 0.5
+BINARIZE_BLOCK_SIZE = 31
+BINARIZE_OFFSET = 15
+
+
+# ============================================================
+# FONCTIONS UTILITAIRES
+# ============================================================
+def otsu_threshold(gray: np.ndarray) -> int:
+    """Seuil d'Otsu d'une image en niveaux de gris (uint8)"""
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight_low = np.cumsum(histogram)
+    weight_high = weight_low[-1] - weight_low
+    sum_low = np.cumsum(histogram * levels)
+    mean_low = sum_low / np.maximum(weight_low, 1)
+    mean_high = (sum_low[-1] - sum_low) / np.maximum(weight_high, 1)
+    variance = weight_low * weight_high * (mean_low - mean_high) ** 2
+    return int(np.argmax(variance))
+
+
+def find_document_bounds(img: Image.Image, margin: float = 0.01) -> Optional[tuple]:
+    """
+    Boîte (gauche, haut, droite, bas) du document clair sur un fond plus sombre
+
+    Retourne None si aucun document net n'est détecté (scan pleine page,
+    fond clair) : l'image est alors conservée entière.
+    """
+    small = img.convert("L")
+    small.thumbnail((256, 256))
+    gray = np.asarray(small)
+    bright = gray > otsu_threshold(gray)
+
+    rows = np.flatnonzero(bright.mean(axis=1) > 0.5)
+    cols = np.flatnonzero(bright.mean(axis=0) > 0.5)
+    if len(rows) == 0 or len(cols) == 0:
+        return None
+
+    top, bottom = rows[0], rows[-1] + 1
+    left, right = cols[0], cols[-1] + 1
+    if (bottom - top) * (right - left) < MIN_DOCUMENT_AREA_RATIO * gray.size:
+        return None
+
+    scale_x = img.width / gray.shape[1]
+    scale_y = img.height / gray.shape[0]
+    pad_x, pad_y = margin * img.width, margin * img.height
+    box = (
+        max(0, int(left * scale_x - pad_x)),
+        max(0, int(top * scale_y - pad_y)),
+        min(img.width, int(right * scale_x + pad_x)),
+        min(img.height, int(bottom * scale_y + pad_y)),
+    )
+    if box == (0, 0, img.width, img.height):
+        return None
+    return box
+
+
+def vision_target_size(width: int, height: int, max_short_side: int = VISION_MAX_SHORT_SIDE,
+                       max_long_side: int = VISION_MAX_LONG_SIDE) -> tuple:
+    """Dimensions maximales utiles pour le modèle de vision (jamais d'agrandissement)"""
+    scale = min(
+        1.0,
+        max_long_side / max(width, height),
+        max_short_side / min(width, height),
+    )
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def encode_smallest(img: Image.Image) -> tuple:
+    """Encode l'image avec chaque encodage candidat et retourne (octets, format) du plus petit"""
+    best = None
+    for image_format, options in VISION_ENCODINGS:
+        out = BytesIO()
+        try:
+            img.save(out, format=image_format, **options)
+        except (KeyError, OSError):
+            # Encodeur absent de cette installation de Pillow
+            continue
+        if best is None or out.tell() < len(best[0]):
+            best = (out.getvalue(), image_format)
+    return best
+
+
+# ============================================================
+# CORRECTION GÉOMÉTRIQUE (OpenCV)
+# ============================================================
+def _import_cv2():
+    """Module cv2, ou None si opencv-python-headless n'est pas installé"""
+    try:
+        import cv2
+        return cv2
+    except ImportError:
+        logger.warning("OpenCV indisponible : correction géométrique ignorée")
+        return None
+
+
+def order_corners(points: np.ndarray) -> np.ndarray:
+    """Coins dans l'ordre haut-gauche, haut-droite, bas-droite, bas-gauche"""
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array([
+        points[np.argmin(sums)],
+        points[np.argmin(diffs)],
+        points[np.argmax(sums)],
+        points[np.argmax(diffs)],
+    ], dtype=np.float32)
+
+
+def find_document_quad(cv2, gray: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Quadrilatère de la page (4 coins ordonnés, en pixels de gray)
+
+    La page, plus claire que le fond, est isolée par un seuil d'Otsu sur une
+    version réduite ; son contour doit se simplifier en 4 sommets et couvrir
+    au moins MIN_DOCUMENT_AREA_RATIO de l'image. Retourne None sinon, ou si
+    la page remplit déjà toute l'image (scan).
+    """
+    scale = min(1.0, QUAD_DETECTION_SIZE / max(gray.shape))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    small = cv2.GaussianBlur(small, (5, 5), 0)
+    _, mask = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Bouche les lignes de texte pour obtenir une page pleine
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+
+    contour = max(contours, key=cv2.contourArea)
+    area = cv2.contourArea(contour)
+    if area < MIN_DOCUMENT_AREA_RATIO * small.size or area > 0.97 * small.size:
+        return None
+    hull = cv2.convexHull(contour)
+    quad = cv2.approxPolyDP(hull, 0.02 * cv2.arcLength(hull, True), True)
+    if len(quad) != 4:
+        return None
+    return order_corners(quad.reshape(4, 2).astype(np.float32) / scale)
+
+
+def warp_document(cv2, pixels: np.ndarray, corners: np.ndarray) -> np.ndarray:
+    """Redresse la page délimitée par corners en un rectangle vu de face"""
+    top_left, top_right, bottom_right, bottom_left = corners
+    width = int(max(np.linalg.norm(top_right - top_left), np.linalg.norm(bottom_right - bottom_left)))
+    height = int(max(np.linalg.norm(bottom_left - top_left), np.linalg.norm(bottom_right - top_right)))
+    target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(corners, target)
+    return cv2.warpPerspective(pixels, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_REPLICATE)
+
+
+def estimate_skew_angle(cv2, gray: np.ndarray) -> float:
+    """
+    Inclinaison des lignes de texte (en degrés, sens trigonométrique)
+
+    Profil de projection : l'angle retenu est celui qui, une fois compensé,
+    rend les sommes par ligne de l'encre les plus contrastées.
+    """
+    scale = min(1.0, QUAD_DETECTION_SIZE / max(gray.shape))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    _, ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    height, width = ink.shape
+    center = (width / 2, height / 2)
+
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-MAX_DESKEW_ANGLE, MAX_DESKEW_ANGLE + DESKEW_ANGLE_STEP / 2, DESKEW_ANGLE_STEP):
+        rotated = cv2.warpAffine(ink, cv2.getRotationMatrix2D(center, float(angle), 1.0), (width, height),
+                                 flags=cv2.INTER_NEAREST)
+        score = float(np.var(rotated.sum(axis=1, dtype=np.float64)))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def rotate_image(cv2, pixels: np.ndarray, angle: float) -> np.ndarray:
+    """Rotation de angle degrés autour du centre, bords prolongés"""
+    height, width = pixels.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(pixels, matrix, (width, height), flags=cv2.INTER_CUBIC,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+
+def binarize(cv2, gray: np.ndarray) -> np.ndarray:
+    """Seuillage adaptatif : texte noir sur fond blanc malgré les ombres et l'éclairage inégal"""
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                 BINARIZE_BLOCK_SIZE, BINARIZE_OFFSET)
+
+
+def correct_document_geometry(cv2, img: Image.Image) -> tuple:
+    """
+    Redresse la page : perspective si ses 4 coins sont trouvés, sinon
+    recadrage simple puis correction de l'inclinaison
+
+    Retourne (image corrigée, détails de la correction).
+    """
+    pixels = np.asarray(img)
+    gray = pixels if pixels.ndim == 2 else cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY)
+    details = {"perspective_corrected": False, "cropped": False, "deskew_angle": 0.0}
+
+    corners = find_document_quad(cv2, gray)
+    if corners is not None:
+        details["perspective_corrected"] = True
+        details["cropped"] = True
+        return Image.fromarray(warp_document(cv2, pixels, corners)), details
+
+    bounds = find_document_bounds(img)
+    if bounds:
+        details["cropped"] = True
+        img = img.crop(bounds)
+        pixels = np.asarray(img)
+        gray = pixels if pixels.ndim == 2 else cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY)
+
+    angle = estimate_skew_angle(cv2, gray)
+    if abs(angle) >= DESKEW_ANGLE_STEP:
+        details["deskew_angle"] = angle
+        img = Image.fromarray(rotate_image(cv2, pixels, angle))
+    return img, details
+
+
+# ============================================================
+# PRÉPARATION POUR OPENAI VISION
+# ============================================================
+def preprocess_image(b: bytes, metrics: Optional[Dict[str, Any]] = None,
+                     grayscale: bool = True, correct_geometry: Optional[bool] = None,
+                     binarization: bool = False,
+                     max_short_side: int = VISION_MAX_SHORT_SIDE,
+                     max_long_side: int = VISION_MAX_LONG_SIDE) -> bytes:
+    """
+    Prétraitement de l'image pour améliorer la qualité et réduire l'envoi
+
+    Recadrage sur le document, réduction à la résolution utile du modèle,
+    niveaux de gris, contraste et netteté, puis encodage le plus compact.
+    Avec correct_geometry (par défaut DOCUMENT_CORRECTION) et OpenCV, la page
+    est en plus redressée (perspective ou inclinaison). binarization (avec
+    OpenCV) remplace contraste et netteté par un seuillage adaptatif : utile
+    à Tesseract, il efface à la résolution du modèle de vision les traits
+    fins et l'écriture manuscrite, d'où sa désactivation par défaut.
+    L'image est décodée une seule fois (directement à résolution réduite et
+    en niveaux de gris pour un JPEG) et toutes les transformations portent
+    sur cette même image. max_short_side et max_long_side bornent la taille
+    finale (résolution du modèle de vision par défaut ; l'OCR local demande
+    davantage). metrics (facultatif) reçoit les tailles et dimensions
+    avant/après ainsi que les durées.
+    """
+    start = time.perf_counter()
+    mode = "L" if grayscale else "RGB"
+    img = Image.open(BytesIO(b))
+    original_size = img.size
+    # Réduction par le décodeur JPEG (1/2, 1/4, 1/8) en gardant de la marge
+    # pour le recadrage : le petit côté reste au moins 1,5 fois la cible
+    draft_min_short_side = max(DRAFT_MIN_SHORT_SIDE, round(max_short_side * 1.5))
+    draft_scale = min(1.0, draft_min_short_side / min(original_size))
+    img.draft(mode, (round(original_size[0] * draft_scale), round(original_size[1] * draft_scale)))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != mode:
+        img = img.convert(mode)
+
+    if correct_geometry is None:
+        correct_geometry = DOCUMENT_CORRECTION
+    cv2 = _import_cv2() if correct_geometry else None
+
+    correction_start = time.perf_counter()
+    if cv2 is not None:
+        img, correction = correct_document_geometry(cv2, img)
+    else:
+        bounds = find_document_bounds(img)
+        if bounds:
+            img = img.crop(bounds)
+        correction = {"perspective_corrected": False, "cropped": bounds is not None, "deskew_angle": 0.0}
+    correction_ms = (time.perf_counter() - correction_start) * 1000
+
+    target = vision_target_size(*img.size, max_short_side, max_long_side)
+    if target != img.size:
+        img = img.resize(target, Image.LANCZOS)
+
+    binarized = binarization and cv2 is not None and img.mode == "L"
+    if binarized:
+        img = Image.fromarray(binarize(cv2, np.asarray(img)))
+    else:
+        img = ImageOps.autocontrast(img)
+        img = img.filter(ImageFilter.UnsharpMask(radius=1.2, percent=180))
+    payload, image_format = encode_smallest(img)
+
+    if metrics is not None:
+        metrics.update(correction)
+        metrics.update({
+            "original_bytes": len(b),
+            "original_size": original_size,
+            "binarized": binarized,
+            "correction_ms": correction_ms,
+            "sent_size": img.size,
+            "sent_bytes": len(payload),
+            "sent_format": image_format,
+            "duration_ms": (time.perf_counter() - start) * 1000,
+        })
+    logger.info("Image préparée : %s -> %s px, %d -> %d octets (%s)",
+                original_size, img.size, len(b), len(payload), image_format)
+    return payload
+
+
+# ============================================================
+# DOCUMENTS DE PLUSIEURS PAGES
+# ============================================================
+def is_pdf(data: bytes) -> bool:
+    """Vrai si les octets sont ceux d'un fichier PDF"""
+    return data[:5] == b"%PDF-"
+
+
+def render_pdf_pages(pdf_bytes: bytes, dpi: int = PDF_RENDER_DPI) -> List[bytes]:
+    """Rend chaque page d'un PDF en JPEG (nécessite pypdfium2)"""
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(pdf_bytes)
+    try:
+        if len(pdf) > MAX_DOCUMENT_PAGES:
+            raise ValueError(f"PDF de {len(pdf)} pages : {MAX_DOCUMENT_PAGES} pages au maximum")
+        pages = []
+        for page in pdf:
+            out = BytesIO()
+            page.render(scale=dpi / 72).to_pil().convert("RGB").save(out, format="JPEG", quality=90)
+            pages.append(out.getvalue())
+        return pages
+    finally:
+        pdf.close()
+
+
+def load_document_pages(data: bytes) -> List[bytes]:
+    """Pages d'un fichier envoyé : chaque page d'un PDF, ou l'image elle-même"""
+    if is_pdf(data):
+        return render_pdf_pages(data)
+    return [data]
+
+
+# ============================================================
+# ENCODAGE
+# ============================================================
+def make_thumbnail(image_bytes: bytes, max_side: int) -> bytes:
+    """Vignette JPEG d'une image (grand côté ≤ max_side), pour une analyse en basse définition"""
+    img = Image.open(BytesIO(image_bytes))
+    img.draft("L", (max_side, max_side))
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+    out = BytesIO()
+    img.convert("L" if img.mode in ("1", "L") else "RGB").save(out, format="JPEG", quality=80)
+    return out.getvalue()
+
+
+def image_mime_type(image_bytes: bytes) -> str:
+    """Type MIME d'une image encodée, d'après sa signature"""
+    if image_bytes[:3] == b"\xff\xd8\xff":
+        return MIME_TYPES["JPEG"]
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return MIME_TYPES["WEBP"]
+    return MIME_TYPES["PNG"]
+
+def encode_image_to_base64(image_bytes: bytes) -> str:
+    """Encode l'image en base64 pour OpenAI Vision"""
+    return base64.b64encode(image_bytes).decode('utf-8')
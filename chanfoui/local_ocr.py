@@ -0,0 +1,256 @@
+"""
+OCR local (Tesseract) sans appel réseau
+
+Alternative hors ligne à OpenAI Vision : la page est préparée à une
+résolution plus élevée que pour le modèle de vision, lue par Tesseract
+(pytesseract, import paresseux), puis interprétée par les mêmes règles
+textuelles que le reste de l'analyse (detect_document_type_from_text,
+extract_fact_number_from_handwritten, DOIT M) et par un lecteur de lignes
+d'articles. Le résultat a la forme d'un VisionResult ; la confiance moyenne
+de Tesseract est notée dans context["ocr_confidence"] (0 à 1).
+
+L'écriture manuscrite et les tableaux irréguliers restent mieux lus par le
+modèle de vision : ce moteur sert aux documents imprimés, hors connexion, ou
+en secours quand OpenAI est indisponible (voir chanfoui.backends).
+"""
+import json
+import logging
+import os
+import re
+import threading
+from io import BytesIO
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+from .documents import (
+    extract_fact_number_from_handwritten,
+    extract_motel_name_from_doit,
+    guess_document_type_from_text,
+)
+from .images import preprocess_image
+from .ocr import PartialResultCallback, apply_subtype_corrections, new_analysis_context
+from .ocr_cache import OCRCache, compute_ocr_version
+
+logger = logging.getLogger(__name__)
+
+# Tesseract lit mieux vers 200 dpi : environ 1700 px de large pour une page A4
+LOCAL_OCR_MAX_SHORT_SIDE = 1700
+LOCAL_OCR_MAX_LONG_SIDE = 2400
+LOCAL_OCR_LANG = os.environ.get("CHANFOUI_TESSERACT_LANG", "fra")
+# Moteur LSTM, page lue comme un bloc uniforme : une ligne de tableau = une ligne de texte
+LOCAL_OCR_CONFIG = os.environ.get("CHANFOUI_TESSERACT_CONFIG", "--oem 1 --psm 6")
+
+_LOCAL_OCR_CACHE: Optional[OCRCache] = None
+_LOCAL_OCR_CACHE_LOCK = threading.Lock()
+
+# Lignes d'articles : entête du tableau, colonne quantité et fin du tableau
+ARTICLE_HEADER_PATTERN = re.compile(r"d[ée]signation|libell[ée]|article", re.IGNORECASE)
+QUANTITY_HEADER_PATTERN = re.compile(r"nb\s*b[il1t]+s|qt[ée]|quantit[ée]", re.IGNORECASE)
+ARTICLE_END_PATTERN = re.compile(r"\btotal|arr[êe]t[ée]e?\s+la|net\s+[àa]\s+payer", re.IGNORECASE)
+NUMBER_PATTERN = re.compile(r"^\d+(?:[.,]\d+)?$")
+PRODUCT_CODE_PATTERN = re.compile(r"^\d{4,}$")
+MIN_DESIGNATION_LETTERS = 3
+
+DATE_PATTERN = re.compile(r"\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4}|\d{2})\b")
+INVOICE_NUMBER_PATTERN = re.compile(r"facture\s*(?:en\s+compte\s*)?n\s*[°o]?\s*[:.]?\s*([A-Z0-9][A-Z0-9/-]*)",
+                                    re.IGNORECASE)
+ORDER_NUMBER_PATTERN = re.compile(r"(?:bon\s+de\s+commande|\bBDC|\bBC)\s*n\s*[°o]?\s*[:.]?\s*([A-Z0-9][A-Z0-9/-]*)",
+                                  re.IGNORECASE)
+
+
+def _import_pytesseract():
+    """Module pytesseract, ou None si pytesseract ou l'exécutable tesseract manque"""
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+        return pytesseract
+    except Exception:
+        return None
+
+
+_TESSERACT_AVAILABLE: Optional[bool] = None
+
+
+def tesseract_available() -> bool:
+    """Vrai si l'OCR local peut être utilisé (vérifié une seule fois)"""
+    global _TESSERACT_AVAILABLE
+    if _TESSERACT_AVAILABLE is None:
+        _TESSERACT_AVAILABLE = _import_pytesseract() is not None
+        if not _TESSERACT_AVAILABLE:
+            logger.warning("Tesseract indisponible : OCR local désactivé")
+    return _TESSERACT_AVAILABLE
+
+
+def get_local_ocr_cache() -> OCRCache:
+    """Cache des lectures Tesseract partagé, ouvert (et son fichier créé) au premier usage"""
+    global _LOCAL_OCR_CACHE
+    with _LOCAL_OCR_CACHE_LOCK:
+        if _LOCAL_OCR_CACHE is None:
+            _LOCAL_OCR_CACHE = OCRCache(compute_ocr_version("tesseract", LOCAL_OCR_LANG, LOCAL_OCR_CONFIG,
+                                                            LOCAL_OCR_MAX_SHORT_SIDE, LOCAL_OCR_MAX_LONG_SIDE))
+        return _LOCAL_OCR_CACHE
+
+
+def preprocess_for_local_ocr(page: bytes, metrics: Optional[Dict[str, Any]] = None,
+                             correct_geometry: Optional[bool] = None) -> bytes:
+    """Même préparation que pour OpenAI Vision, binarisée et à la résolution utile à Tesseract"""
+    return preprocess_image(page, metrics=metrics, correct_geometry=correct_geometry,
+                            binarization=True,
+                            max_short_side=LOCAL_OCR_MAX_SHORT_SIDE,
+                            max_long_side=LOCAL_OCR_MAX_LONG_SIDE)
+
+
+def run_tesseract(image_bytes: bytes) -> tuple:
+    """
+    Texte (une ligne par ligne détectée) et confiance moyenne des mots (0 à 1)
+
+    Les lectures sont mémorisées dans le cache de l'OCR local
+    (get_local_ocr_cache). Lève RuntimeError si Tesseract n'est pas installé.
+    """
+    cached = get_local_ocr_cache().get(image_bytes)
+    if cached is not None:
+        entry = json.loads(cached)
+        return entry["text"], entry["confidence"]
+
+    if not tesseract_available():
+        raise RuntimeError("Tesseract n'est pas installé (pytesseract et l'exécutable tesseract sont requis)")
+    import pytesseract
+    data = pytesseract.image_to_data(Image.open(BytesIO(image_bytes)), lang=LOCAL_OCR_LANG,
+                                     config=LOCAL_OCR_CONFIG, output_type=pytesseract.Output.DICT)
+
+    lines: Dict[tuple, List[str]] = {}
+    confidences = []
+    for i, word in enumerate(data["text"]):
+        word = (word or "").strip()
+        if not word:
+            continue
+        lines.setdefault((data["block_num"][i], data["par_num"][i], data["line_num"][i]), []).append(word)
+        confidence = float(data["conf"][i])
+        if confidence >= 0:
+            confidences.append(confidence)
+    text = "\n".join(" ".join(words) for words in lines.values())
+    confidence = sum(confidences) / len(confidences) / 100 if confidences else 0.0
+
+    get_local_ocr_cache().put(image_bytes, json.dumps({"text": text, "confidence": confidence}))
+    return text, confidence
+
+
+def _parse_number(token: str) -> float:
+    return float(token.replace(",", "."))
+
+
+def parse_article_lines(text: str) -> List[Dict[str, Any]]:
+    """
+    Articles (article_brut, quantite) lus dans le texte d'un tableau
+
+    Une ligne d'article est une désignation suivie de colonnes numériques ;
+    la quantité est la colonne de l'entête "Qté" / "Nb bills" si l'entête du
+    tableau est lu (comptée après la dernière entête de désignation), sinon
+    la première. Un code produit en tête de ligne est
+    retiré de la désignation. La lecture s'arrête au total du document.
+    """
+    lines = text.splitlines()
+    quantity_column = 0
+    start = 0
+    for index, line in enumerate(lines):
+        header = ARTICLE_HEADER_PATTERN.search(line)
+        if header:
+            start = index + 1
+            quantity = QUANTITY_HEADER_PATTERN.search(line, header.end())
+            if quantity:
+                # Colonnes comptées depuis la dernière entête de désignation ("Code Article Libellé")
+                designation_end = list(ARTICLE_HEADER_PATTERN.finditer(line, 0, quantity.start()))[-1].end()
+                quantity_column = len(line[designation_end:quantity.start()].split())
+            break
+
+    articles = []
+    for line in lines[start:]:
+        if ARTICLE_END_PATTERN.search(line):
+            if articles:
+                break
+            continue
+        tokens = line.split()
+        numbers = 0
+        while numbers < len(tokens) and NUMBER_PATTERN.match(tokens[len(tokens) - 1 - numbers]):
+            numbers += 1
+        if not numbers:
+            continue
+        designation = tokens[:len(tokens) - numbers]
+        while designation and PRODUCT_CODE_PATTERN.match(designation[0]):
+            designation = designation[1:]
+        designation = " ".join(designation)
+        if sum(char.isalpha() for char in designation) < MIN_DESIGNATION_LETTERS:
+            continue
+        columns = tokens[len(tokens) - numbers:]
+        quantite = _parse_number(columns[quantity_column if quantity_column < len(columns) else 0])
+        if quantite <= 0:
+            continue
+        articles.append({"article_brut": designation, "quantite": quantite})
+    return articles
+
+
+def parse_document_header(text: str) -> Dict[str, str]:
+    """Date, numéros de facture et de bon de commande, DOIT M lus dans le texte"""
+    header = {"date": "", "numero_facture": "", "bon_commande": "", "doit_m": ""}
+    date = DATE_PATTERN.search(text)
+    if date:
+        day, month, year = date.groups()
+        if len(year) == 2:
+            year = "20" + year
+        header["date"] = f"{int(day):02d}/{int(month):02d}/{year}"
+    invoice_number = INVOICE_NUMBER_PATTERN.search(text)
+    if invoice_number:
+        header["numero_facture"] = invoice_number.group(1)
+    order_number = ORDER_NUMBER_PATTERN.search(text)
+    if order_number:
+        header["bon_commande"] = order_number.group(1)
+    # Le nom du magasin s'arrête à la fin de la ligne "DOIT M :"
+    for line in text.splitlines():
+        if "DOIT" in line.upper():
+            header["doit_m"] = extract_motel_name_from_doit(line) or ""
+            break
+    return header
+
+
+def local_ocr(image_bytes: bytes, context: Optional[Dict[str, Any]] = None, client=None,
+              partial_result: Optional[PartialResultCallback] = None) -> Optional[Dict]:
+    """
+    Analyse le document avec Tesseract (même contrat que openai_vision_ocr_improved)
+
+    image_bytes est la page préparée par preprocess_for_local_ocr ; client
+    est ignoré. Le texte lu est écrit dans context["ocr_raw_text"] et sa
+    confiance dans context["ocr_confidence"]. Retourne None en cas d'échec ;
+    le message est alors ajouté à context["errors"].
+    """
+    if context is None:
+        context = new_analysis_context()
+    try:
+        text, confidence = run_tesseract(image_bytes)
+        context["ocr_raw_text"] = text
+        context["ocr_confidence"] = confidence
+
+        data = guess_document_type_from_text(text, context)
+        header = parse_document_header(text)
+        data.setdefault("client", "")
+        data.setdefault("adresse_livraison", header["doit_m"])
+        data.setdefault("quartier_s2m", context.get("quartier_s2m") or "")
+        data.setdefault("nom_magasin_ulys", context.get("nom_magasin_ulys") or "")
+        data.setdefault("fact_manuscrit", extract_fact_number_from_handwritten(text) or "")
+        data.setdefault("numero", "")
+        for key, value in header.items():
+            data.setdefault(key, value)
+        data["articles"] = parse_article_lines(text)
+
+        if partial_result is not None:
+            partial_result("reset", {})
+            partial_result("header", {key: value for key, value in data.items() if key != "articles"})
+            for article in data["articles"]:
+                partial_result("article", article)
+
+        return apply_subtype_corrections(data, context)
+
+    except Exception as e:
+        logger.exception("Erreur OCR local")
+        context.setdefault("errors", []).append(f"Erreur OCR local: {str(e)}")
+        return None
@@ -0,0 +1,1118 @@
+"""
+Standardisation intelligente des produits
+
+Catalogue des produits standards, normalisation des désignations OCR,
+matching (caractéristiques + Jaro-Winkler), règles spécifiques BDC
+et cache des résultats. Aucune dépendance à Streamlit.
+"""
+import atexit
+import re
+import os
+import hashlib
+import heapq
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List, Tuple, Dict, Any, Optional
+
+import jellyfish
+import pandas as pd
+
+
+# ============================================================
+# STANDARDISATION INTELLIGENTE DES PRODUITS - MIS À JOUR
+# ============================================================
+
+# Liste officielle des produits mise à jour
+STANDARD_PRODUCTS = [
+    "Côte de Fianar Rouge 75 cl",
+    "Côte de Fianar Rouge 37 cl",
+    "Côte de Fianar Rouge 3L",
+    "Côte de Fianar Blanc 3L",
+    "Côte de Fianar Rosé 3L",
+    "Blanc doux Maroparasy 3L",
+    "Côte de Fianar Blanc 75 cl",
+    "Côte de Fianar Blanc 37 cl",
+    "Côte de Fianar Rosé 75 cl",
+    "Côte de Fianar Rosé 37 cl",
+    "Côte de Fianar Gris 75 cl",
+    "Côte de Fianar Gris 37 cl",
+    "Maroparasy Rouge 75 cl",
+    "Maroparasy Rouge 37 cl",
+    "Blanc doux Maroparasy 75 cl",
+    "Blanc doux Maroparasy 37 cl",
+    "Côteau d'Ambalavao Rouge 75 cl",
+    "Côteau d'Ambalavao Blanc 75 cl",
+    "Côteau d'Ambalavao Rosé 75 cl",
+    "Côteau d'Ambalavao Spécial 75 cl",
+    "Aperao Orange 75 cl",
+    "Aperao Pêche 75 cl",
+    "Aperao Ananas 75 cl",
+    "Aperao Epices 75 cl",
+    "Aperao Ratafia 75 cl",
+    "Aperao Eau de vie 75 cl",
+    "Aperao Eau de vie 37 cl",
+    "Vin de Champêtre 100 cl",
+    "Vin de Champêtre 50 cl",
+    "Jus de raisin Rouge 70 cl",
+    "Jus de raisin Rouge 20 cl",
+    "Jus de raisin Blanc 70 cl",
+    "Jus de raisin Blanc 20 cl",
+    "Rhum Sambatra 20 cl",
+    "Consignation Btl 75 cl",
+    # Ajout des nouveaux produits demandés
+    "Côte de Fianar Gris 3L",
+    "Côteau d'Ambalavao Special 75 cl",  # Alternative orthographe
+    "Aperao Peche 37 cl",  # Alternative orthographe
+    "Côteau d'Ambalavao Special 75 cl",  # Pour "Côteau d'Ambalavao Rouge" conversion
+    "Cuvee Speciale 75cls"  # Conversion demandée
+]
+
+# Dictionnaire de synonymes et normalisations MIS À JOUR
+SYNONYMS = {
+    # Marques principales
+    "cote de fianar": "côte de fianar",
+    "cote de fianara": "côte de fianar",
+    "fianara": "fianar",
+    "fianar": "fianar",
+    "flanar": "fianar",
+    "côte de flanar": "côte de fianar",
+    "cote de flanar": "côte de fianar",
+    "coteau": "côteau",
+    "ambalavao": "ambalavao",
+    "coteau d'amb": "côteau d'ambalavao",
+    "coteau d'amb/vao": "côteau d'ambalavao",
+    "maroparasy": "maroparasy",
+    "maroparas": "maroparasy",
+    "aperao": "aperao",
+    "aperitif": "aperitif",
+    "sambatra": "sambatra",
+    "champetre": "champêtre",
+    
+    # Types de vins
+    "vin rouge": "rouge",
+    "vin blanc": "blanc",
+    "vin rose": "rosé",
+    "vin rosé": "rosé",
+    "vin gris": "gris",
+    "rouge doux": "rouge doux",
+    "blanc doux": "blanc doux",
+    "doux": "doux",
+    
+    # Abréviations communes
+    "btl": "",
+    "bouteille": "",
+    "nu": "",
+    "lp7": "",
+    "cl": "cl",
+    "ml": "ml",
+    "l": "l",
+    "cons": "",
+    "cons.": "",
+    "foul": "foui",
+    "chan foul": "chan foui",
+    "cons. chan foul": "consignation btl",
+    "cons chan foul": "consignation btl",
+    "cons.chan foui": "consignation btl",
+    "cons.chan foui 75cl": "consignation btl 75cl",
+    "cons chan foui 75cl": "consignation btl 75cl",
+    
+    # Unités
+    "750ml": "75 cl",
+    "750 ml": "75 cl",
+    "700ml": "70 cl",
+    "700 ml": "70 cl",
+    "370ml": "37 cl",
+    "370 ml": "37 cl",
+    "3000ml": "3l",
+    "3000 ml": "3l",
+    "3 l": "3l",
+    "3l": "3l",
+    "1000ml": "100 cl",
+    "1000 ml": "100 cl",
+    "500ml": "50 cl",
+    "500 ml": "50 cl",
+    "200ml": "20 cl",
+    "200 ml": "20 cl",
+    
+    # NOUVEAUX SYNONYMES POUR AMÉLIORATION
+    "coteau d'ambalavao rouge": "cuvee speciale 75cls",  # Conversion demandée
+    "coteau d ambalavao rouge": "cuvee speciale 75cls",
+    "ambalavao rouge": "cuvee speciale 75cls",
+    "coteau ambalavao rouge": "cuvee speciale 75cls",
+    "côteau d'ambalavao rouge": "cuvee speciale 75cls",
+    "côteau ambalavao rouge": "cuvee speciale 75cls",
+    
+    # Standardisation améliorée
+    "cote fianar": "côte de fianar",
+    "cote de fianar 3l": "côte de fianar 3l",
+    "cote fianar 3l": "côte de fianar 3l",
+    "maroparasy doux": "blanc doux maroparasy",
+    "maroparas doux": "blanc doux maroparasy",
+    "aperao peche": "aperao pêche",
+    "aperitif aperao": "aperao",
+    "vin champetre": "vin de champêtre",
+    "jus raisin": "jus de raisin",
+    "rhum": "sambatra",
+    "consignation": "consignation btl",
+}
+
+# Mapping des équivalences de volume
+VOLUME_EQUIVALENTS = {
+    "750": "75",
+    "750ml": "75",
+    "750 ml": "75",
+    "700": "70",
+    "700ml": "70",
+    "700 ml": "70",
+    "370": "37",
+    "370ml": "37",
+    "370 ml": "37",
+    "300": "3",
+    "3000": "3",
+    "3000ml": "3",
+    "3000 ml": "3",
+    "1000": "100",
+    "1000ml": "100",
+    "1000 ml": "100",
+    "500": "50",
+    "500ml": "50",
+    "500 ml": "50",
+    "200": "20",
+    "200ml": "20",
+    "200 ml": "20",
+    "75cl": "75",
+    "75 cl": "75",
+    "37cl": "37",
+    "37 cl": "37",
+    "70cl": "70",
+    "70 cl": "70",
+    "20cl": "20",
+    "20 cl": "20",
+    "100cl": "100",
+    "100 cl": "100",
+    "50cl": "50",
+    "50 cl": "50",
+}
+
+def normalize_raw_text(text: str) -> str:
+    """Normalisation de base : minuscules, sans accents ni ponctuation"""
+    # Convertir en minuscules
+    text = text.lower()
+    
+    # Supprimer les accents
+    text = unicodedata.normalize('NFD', text).encode('ascii', 'ignore').decode('ascii')
+    
+    # Remplacer les apostrophes et tirets
+    text = text.replace("'", " ").replace("-", " ").replace("_", " ").replace("/", " ")
+    
+    # Supprimer les caractères spéciaux (garder lettres, chiffres, espaces)
+    text = re.sub(r'[^a-z0-9\s]', ' ', text)
+    
+    return text
+
+class SynonymRewriter:
+    """
+    Réécriture des synonymes multi-mots par plus long match.
+    
+    Les clés et valeurs de SYNONYMS sont normalisées comme le texte OCR puis
+    rangées dans un trie de mots ; le flux de mots est réécrit en un seul
+    parcours linéaire (le texte remplacé n'est pas réexaminé).
+    """
+
+    # Marqueur de fin de clé dans le trie
+    END = object()
+
+    def __init__(self, synonyms: Dict[str, str]):
+        self.trie: Dict[Any, Any] = {}
+        for key, replacement in synonyms.items():
+            words = normalize_raw_text(key).split()
+            if not words:
+                continue
+            node = self.trie
+            for word in words:
+                node = node.setdefault(word, {})
+            node[self.END] = normalize_raw_text(replacement).split()
+
+    def rewrite(self, words: List[str]) -> List[str]:
+        """Remplace les plus longues séquences de mots connues"""
+        output = []
+        i = 0
+        n = len(words)
+        while i < n:
+            node = self.trie
+            match_end = None
+            match_words = None
+            j = i
+            while j < n and words[j] in node:
+                node = node[words[j]]
+                j += 1
+                if self.END in node:
+                    match_end = j
+                    match_words = node[self.END]
+            
+            if match_end is None:
+                output.append(words[i])
+                i += 1
+            else:
+                # Ne pas ajouter si le synonyme est vide
+                output.extend(match_words)
+                i = match_end
+        
+        return output
+
+# Construit une seule fois à partir de SYNONYMS
+SYNONYM_REWRITER = SynonymRewriter(SYNONYMS)
+
+def preprocess_text(text: str) -> str:
+    """Prétraitement avancé du texte"""
+    if not text:
+        return ""
+    
+    text = normalize_raw_text(text)
+    
+    # Remplacer les synonymes (y compris les expressions de plusieurs mots)
+    text = ' '.join(SYNONYM_REWRITER.rewrite(text.split()))
+    
+    # Supprimer les espaces multiples
+    text = re.sub(r'\s+', ' ', text).strip()
+    
+    return text
+
+def extract_volume_info(text: str) -> Tuple[str, Optional[str]]:
+    """Extrait et normalise l'information de volume"""
+    # Chercher des motifs de volume
+    volume_patterns = [
+        r'(\d+)\s*cl',
+        r'(\d+)\s*ml',
+        r'(\d+)\s*l',
+        r'(\d+)\s*litre',
+        r'(\d+)\s*litres',
+    ]
+    
+    volume = None
+    text_without_volume = text
+    
+    for pattern in volume_patterns:
+        matches = re.findall(pattern, text)
+        if matches:
+            volume = matches[0]
+            # Normaliser le volume
+            if 'ml' in pattern:
+                # Convertir ml en cl
+                try:
+                    ml = int(volume)
+                    if ml >= 1000:
+                        volume = f"{ml//100}l" if ml % 1000 == 0 else f"{ml/10:.0f} cl"
+                    else:
+                        volume = f"{ml/10:.0f} cl" if ml % 10 == 0 else f"{ml/10:.1f} cl"
+                except:
+                    pass
+            elif 'l' in pattern and 'cl' not in pattern and 'ml' not in pattern:
+                # Convertir litres en cl
+                try:
+                    liters = float(volume)
+                    if liters >= 1:
+                        volume = f"{liters:.0f}l" if liters.is_integer() else f"{liters}l"
+                except:
+                    pass
+            
+            # Supprimer le volume du texte pour faciliter la correspondance
+            text_without_volume = re.sub(pattern, '', text_without_volume)
+            break
+    
+    # Chercher aussi des volumes sans unité spécifique
+    if not volume:
+        match = re.search(r'\b(\d+)\b', text)
+        if match:
+            vol_num = match.group(1)
+            # Deviner l'unité basée sur la valeur
+            if vol_num in VOLUME_EQUIVALENTS:
+                volume = f"{VOLUME_EQUIVALENTS[vol_num]} cl"
+                text_without_volume = re.sub(r'\b' + vol_num + r'\b', '', text_without_volume)
+    
+    return text_without_volume.strip(), volume
+
+def extract_product_features(text: str) -> Dict[str, str]:
+    """Extrait les caractéristiques clés du produit"""
+    features = {
+        'type': '',
+        'marque': '',
+        'couleur': '',
+        'volume': '',
+        'original': text
+    }
+    
+    # Normaliser le texte
+    normalized = preprocess_text(text)
+    
+    # Extraire le volume
+    text_without_volume, volume = extract_volume_info(normalized)
+    if volume:
+        features['volume'] = volume
+    
+    # Détecter la couleur
+    colors = ['rouge', 'blanc', 'rose', 'gris', 'orange', 'peche', 'ananas', 'epices', 'ratafia']
+    for color in colors:
+        if color in text_without_volume:
+            features['couleur'] = color
+            text_without_volume = text_without_volume.replace(color, '')
+            break
+    
+    # Détecter le type
+    types = ['vin', 'jus', 'aperitif', 'eau de vie', 'cuvee', 'cuvee special', 'special', 'consigne']
+    for type_ in types:
+        if type_ in text_without_volume:
+            features['type'] = type_
+            text_without_volume = text_without_volume.replace(type_, '')
+            break
+    
+    # Détecter la marque
+    marques = [
+        ('cote de fianar', 'côte de fianar'),
+        ('fianar', 'côte de fianar'),
+        ('maroparasy', 'maroparasy'),
+        ('coteau d ambalavao', 'côteau d\'ambalavao'),
+        ('ambalavao', 'côteau d\'ambalavao'),
+        ('aperao', 'aperao'),
+        ('champetre', 'vin de champêtre'),
+        ('sambatra', 'sambatra'),
+        ('chan foui', 'chan foui'),
+    ]
+    
+    for marque_pattern, marque_std in marques:
+        if marque_pattern in text_without_volume:
+            features['marque'] = marque_std
+            text_without_volume = text_without_volume.replace(marque_pattern, '')
+            break
+    
+    # Nettoyer le texte restant
+    text_without_volume = re.sub(r'\s+', ' ', text_without_volume).strip()
+    if text_without_volume:
+        features['autres'] = text_without_volume
+    
+    return features
+
+def calculate_similarity_score(features1: Dict, features2: Dict) -> float:
+    """Calcule un score de similarité entre deux ensembles de caractéristiques"""
+    score = 0.0
+    max_score = 0.0
+    
+    # Poids pour chaque caractéristique
+    weights = {
+        'marque': 0.4,
+        'couleur': 0.3,
+        'volume': 0.2,
+        'type': 0.1,
+    }
+    
+    for key, weight in weights.items():
+        if features1.get(key) and features2.get(key):
+            if features1[key] == features2[key]:
+                score += weight
+            # Similarité partielle pour les couleurs (rose/rosé)
+            elif key == 'couleur':
+                if ('rose' in features1[key] and 'rosé' in features2[key]) or \
+                   ('rosé' in features1[key] and 'rose' in features2[key]):
+                    score += weight * 0.8
+        max_score += weight
+    
+    # Bonus pour correspondance exacte du volume
+    if features1.get('volume') and features2.get('volume'):
+        if features1['volume'] == features2['volume']:
+            score += 0.1
+            max_score += 0.1
+    
+    return score / max_score if max_score > 0 else 0.0
+
+# ============================================================
+# CATALOGUE PRÉCOMPILÉ DES PRODUITS STANDARDS
+# ============================================================
+# Caractéristiques indexées : un produit ne peut obtenir un score de
+# caractéristiques non nul que s'il partage au moins l'une d'entre elles
+CATALOG_INDEX_KEYS = ('marque', 'couleur', 'volume', 'type')
+
+# Seuils de confiance du matching
+MIN_MATCH_SCORE = 0.6
+MIN_ALTERNATIVE_SCORE = 0.4  # Seuil bas pour voir les alternatives
+
+class ProductCatalog:
+    """
+    Catalogue des produits standards précalculé une seule fois :
+    noms normalisés, caractéristiques extraites et index inversé
+    par marque / couleur / volume / type.
+    """
+
+    def __init__(self, products: List[str]):
+        self.products = list(products)
+        self.normalized = [preprocess_text(product) for product in self.products]
+        self.features = [extract_product_features(product) for product in self.products]
+        
+        # Index inversé : (caractéristique, valeur) -> indices des produits
+        self.index: Dict[Tuple[str, str], List[int]] = {}
+        for i, features in enumerate(self.features):
+            for key in CATALOG_INDEX_KEYS:
+                value = features.get(key)
+                if value:
+                    self.index.setdefault((key, value), []).append(i)
+
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def candidates(self, features: Dict[str, str]) -> List[int]:
+        """Indices (dans l'ordre du catalogue) des produits partageant une caractéristique clé"""
+        found = set()
+        for key in CATALOG_INDEX_KEYS:
+            value = features.get(key)
+            if value:
+                found.update(self.index.get((key, value), ()))
+        return sorted(found)
+
+    def score(self, i: int, features: Dict[str, str], normalized: str) -> float:
+        """Score combiné (caractéristiques 70% + Jaro-Winkler 30%) avec le produit i"""
+        score = calculate_similarity_score(features, self.features[i])
+        jaro_score = jellyfish.jaro_winkler_similarity(normalized, self.normalized[i])
+        return (score * 0.7) + (jaro_score * 0.3)
+
+    def rank(self, features: Dict[str, str], normalized: str,
+             top_k: int = 3) -> Tuple[Optional[str], float, List[Tuple[str, float]]]:
+        """
+        Passe de scoring unique sur les candidats : meilleur produit, confiance
+        et top-k des alternatives (score >= MIN_ALTERNATIVE_SCORE), triées par
+        score décroissant puis par ordre du catalogue.
+        """
+        indices = self.candidates(features)
+        scored = []
+        best_match = None
+        best_score = 0.0
+        for i in indices:
+            combined_score = self.score(i, features, normalized)
+            scored.append((self.products[i], combined_score))
+            if combined_score > best_score:
+                best_score = combined_score
+                best_match = self.products[i]
+        
+        alternatives = heapq.nlargest(
+            top_k,
+            (item for item in scored if item[1] >= MIN_ALTERNATIVE_SCORE),
+            key=lambda item: item[1]
+        )
+        
+        # Seuil de confiance minimum
+        if best_score < MIN_MATCH_SCORE:
+            # Les non-candidats (plafonnés à 0.3) peuvent porter le score affiché
+            candidates = set(indices)
+            for i in range(len(self.products)):
+                if i not in candidates:
+                    best_score = max(best_score, self.score(i, features, normalized))
+            return None, best_score, alternatives
+        
+        return best_match, best_score, alternatives
+
+    def rank_many(self, features_list: List[Dict[str, str]], normalized_list: List[str],
+                  top_k: int = 3) -> List[Tuple[Optional[str], float, List[Tuple[str, float]]]]:
+        """rank pour chaque désignation du lot"""
+        return [self.rank(features, normalized, top_k)
+                for features, normalized in zip(features_list, normalized_list)]
+
+def get_product_catalog(standard_products: List[str]) -> ProductCatalog:
+    """Retourne le catalogue précompilé, ou en construit un pour une autre liste"""
+    if standard_products is STANDARD_PRODUCTS:
+        return PRODUCT_CATALOG
+    return ProductCatalog(standard_products)
+
+def rank_product_matches_batch(ocr_designations: List[str], top_k: int = 3,
+                               standard_products: List[str] = STANDARD_PRODUCTS) -> List[Dict[str, Any]]:
+    """
+    Classe les produits standards pour plusieurs désignations OCR
+    (voir ProductCatalog.rank_many)
+    
+    Returns:
+        Liste de Dict avec 'original', 'features', 'best_match', 'confidence'
+        et 'matches' (top-k des alternatives [(produit, score), ...])
+    """
+    catalog = get_product_catalog(standard_products)
+    
+    # Prétraiter les désignations OCR (une seule fois)
+    features_list = [extract_product_features(designation) for designation in ocr_designations]
+    normalized_list = [preprocess_text(designation) for designation in ocr_designations]
+    
+    rankings = catalog.rank_many(features_list, normalized_list, top_k)
+    
+    return [
+        {
+            'original': designation,
+            'features': features,
+            'best_match': best_match,
+            'confidence': confidence,
+            'matches': alternatives
+        }
+        for designation, features, (best_match, confidence, alternatives)
+        in zip(ocr_designations, features_list, rankings)
+    ]
+
+def rank_product_matches(ocr_designation: str, top_k: int = 3,
+                         standard_products: List[str] = STANDARD_PRODUCTS) -> Dict[str, Any]:
+    """
+    Classe les produits standards pour une désignation OCR en une seule passe
+    
+    Returns:
+        Dict avec 'original', 'features', 'best_match', 'confidence'
+        et 'matches' (top-k des alternatives [(produit, score), ...])
+    """
+    catalog = get_product_catalog(standard_products)
+    
+    # Prétraiter la désignation OCR (une seule fois)
+    features = extract_product_features(ocr_designation)
+    normalized = preprocess_text(ocr_designation)
+    
+    best_match, confidence, alternatives = catalog.rank(features, normalized, top_k)
+    
+    return {
+        'original': ocr_designation,
+        'features': features,
+        'best_match': best_match,
+        'confidence': confidence,
+        'matches': alternatives
+    }
+
+def find_best_match(ocr_designation: str, standard_products: List[str]) -> Tuple[Optional[str], float]:
+    """
+    Trouve le meilleur match pour une désignation OCR
+    
+    Returns:
+        Tuple (produit_standard, score_confidence)
+    """
+    ranking = rank_product_matches(ocr_designation, standard_products=standard_products)
+    return ranking['best_match'], ranking['confidence']
+
+# Catalogue construit une seule fois à l'import
+PRODUCT_CATALOG = ProductCatalog(STANDARD_PRODUCTS)
+
+def intelligent_product_matcher(ocr_designation: str) -> Tuple[Optional[str], float, Dict]:
+    """
+    Standardise intelligemment une désignation produit OCR
+    
+    Returns:
+        Tuple (produit_standard, score_confidence, details)
+    """
+    ranking = rank_product_matches(ocr_designation, top_k=3)
+    
+    details = {
+        'original': ocr_designation,
+        'features': ranking['features'],
+        'matches': ranking['matches']  # Top 3 seulement
+    }
+    
+    return ranking['best_match'], ranking['confidence'], details
+
+# ============================================================
+# FONCTION AMÉLIORÉE DE STANDARDISATION
+# ============================================================
+def standardize_product_name_improved(product_name: str) -> Tuple[str, float, str]:
+    """
+    Standardise le nom du produit avec score de confiance
+    
+    Args:
+        product_name: Nom du produit issu de l'OCR
+        
+    Returns:
+        Tuple (nom_standardisé, score_confiance, status)
+    """
+    if not product_name or not product_name.strip():
+        return "", 0.0, "empty"
+    
+    # Essayer d'abord avec le matching intelligent
+    best_match, confidence, details = intelligent_product_matcher(product_name)
+    
+    return classify_product_match(product_name, best_match, confidence)
+
+def classify_product_match(product_name: str, best_match: Optional[str],
+                           confidence: float) -> Tuple[str, float, str]:
+    """Applique les seuils de confiance au résultat du matching"""
+    if best_match and confidence >= 0.7:
+        return best_match, confidence, "matched"
+    elif best_match and confidence >= 0.6:
+        # Match à confiance moyenne
+        return best_match, confidence, "partial_match"
+    else:
+        # Aucun bon match trouvé
+        return product_name.title(), confidence, "no_match"
+
+# ============================================================
+# RÈGLES DE STANDARDISATION SPÉCIFIQUES BDC (TABLE DÉCLARATIVE)
+# ============================================================
+# Chaque règle s'applique si TOUS les motifs "all" et (si présent) AU MOINS UN
+# des motifs "any" apparaissent dans la désignation en majuscules.
+# La règle de priorité la plus haute l'emporte sur le résultat du matching.
+STANDARDIZATION_RULES = [
+    # Gestion spéciale pour "CONS. CHAN FOUI 75CL" - FILTRE 2
+    {"priority": 19, "all": ["CONS", "CHAN", "FOUI"], "any": ["75", "750"],
+     "produit": "Consignation btl 75cl", "confidence": 0.95},
+    {"priority": 18, "all": ["CONS", "CHAN", "FOUI"],
+     "produit": "Consignation btl", "confidence": 0.95},
+    # "FOUI" souvent lu "FOUL" par l'OCR
+    {"priority": 17, "all": ["CONS", "CHAN", "FOUL"], "any": ["75", "750"],
+     "produit": "Consignation btl 75cl", "confidence": 0.9},
+    {"priority": 16, "all": ["CONS", "CHAN", "FOUL"],
+     "produit": "Consignation btl", "confidence": 0.9},
+    # Sans marque ni couleur, la consignation n'atteint pas le seuil du matching
+    {"priority": 15, "all": ["CONSIGNATION"], "any": ["75", "750"],
+     "produit": "Consignation Btl 75 cl", "confidence": 0.9},
+    
+    # Gestion spéciale pour les vins avec "NU"
+    {"priority": 29, "all": ["NU", "750", "ROUGE", "FIANAR"],
+     "produit": "Côte de Fianar Rouge 75 cl", "confidence": 0.9},
+    {"priority": 28, "all": ["NU", "750", "BLANC", "FIANAR"],
+     "produit": "Côte de Fianar Blanc 75 cl", "confidence": 0.9},
+    {"priority": 27, "all": ["NU", "750", "GRIS", "FIANAR"],
+     "produit": "Côte de Fianar Gris 75 cl", "confidence": 0.9},
+    {"priority": 26, "all": ["NU", "750", "ROUGE", "MAROPARASY"],
+     "produit": "Maroparasy Rouge 75 cl", "confidence": 0.9},
+    {"priority": 25, "all": ["NU", "750", "BLANC", "MAROPARASY"],
+     "produit": "Blanc doux Maroparasy 75 cl", "confidence": 0.9},
+    
+    # Gestion spéciale pour les 3L
+    {"priority": 39, "all": ["ROUGE", "FIANAR"], "any": ["3L", "3 L"],
+     "produit": "Côte de Fianar Rouge 3L", "confidence": 0.9},
+    {"priority": 38, "all": ["BLANC", "FIANAR"], "any": ["3L", "3 L"],
+     "produit": "Côte de Fianar Blanc 3L", "confidence": 0.9},
+    {"priority": 37, "all": ["ROSE", "FIANAR"], "any": ["3L", "3 L"],
+     "produit": "Côte de Fianar Rosé 3L", "confidence": 0.9},
+    {"priority": 36, "all": ["GRIS", "FIANAR"], "any": ["3L", "3 L"],
+     "produit": "Côte de Fianar Gris 3L", "confidence": 0.9},
+    
+    # CONVERSION SPÉCIFIQUE DEMANDÉE : "Coteau d'Ambalavao Rouge" -> "Cuvee Speciale 75cls"
+    {"priority": 49, "all": ["COTEAU", "AMBALAVAO", "ROUGE"],
+     "produit": "Cuvee Speciale 75cls", "confidence": 0.95},
+    {"priority": 48, "all": ["AMBALAVAO", "ROUGE"],
+     "produit": "Cuvee Speciale 75cls", "confidence": 0.9},
+    {"priority": 47, "all": ["CUVEE", "SPECIAL"],
+     "produit": "Cuvee Speciale 75cls", "confidence": 0.95},
+    
+    # Standardisation améliorée pour les produits avec fautes d'orthographe
+    {"priority": 59, "all": ["COTEAU", "DAMBALAVAO", "ROUGE"],
+     "produit": "Cuvee Speciale 75cls", "confidence": 0.9},
+    {"priority": 58, "all": ["COTEAU", "DAMBALAVAO", "BLANC"],
+     "produit": "Côteau d'Ambalavao Blanc 75 cl", "confidence": 0.9},
+    {"priority": 57, "all": ["COTEAU", "DAMBALAVAO", "ROSE"],
+     "produit": "Côteau d'Ambalavao Rosé 75 cl", "confidence": 0.9},
+    
+    # Standardisation pour Aperao Peche
+    {"priority": 69, "all": ["APERAO", "PECHE"], "any": ["37", "370"],
+     "produit": "Aperao Peche 37 cl", "confidence": 0.9},
+    {"priority": 68, "all": ["APERAO", "PECHE"],
+     "produit": "Aperao Pêche 75 cl", "confidence": 0.9},
+    
+    # Standardisation pour Côteau d'Ambalavao Special
+    {"priority": 79, "all": ["COTEAU", "AMBALAVAO", "SPECIAL"],
+     "produit": "Côteau d'Ambalavao Special 75 cl", "confidence": 0.9},
+]
+
+class StandardizationRuleEngine:
+    """
+    Table de règles compilée en une seule expression régulière multi-motifs,
+    évaluée en un seul parcours de la désignation.
+    """
+
+    def __init__(self, rules: List[Dict[str, Any]]):
+        self.rules = sorted(rules, key=lambda rule: rule["priority"], reverse=True)
+        
+        tokens = sorted(
+            {token for rule in self.rules for token in rule["all"] + rule.get("any", [])},
+            key=len, reverse=True
+        )
+        # Lookahead : à chaque position, le motif le plus long qui commence ici
+        self.pattern = re.compile("(?=(" + "|".join(re.escape(token) for token in tokens) + "))")
+        # Un motif trouvé implique tous les motifs qu'il contient ("750" -> "75")
+        self.implied = {
+            token: frozenset(other for other in tokens if other in token)
+            for token in tokens
+        }
+        
+        # Index : premier motif obligatoire -> règles (par priorité décroissante)
+        self.by_token: Dict[str, List[int]] = {}
+        for i, rule in enumerate(self.rules):
+            self.by_token.setdefault(rule["all"][0], []).append(i)
+        
+        # Empreinte de la table compilée : change dès qu'une règle ou un motif change
+        payload = json.dumps([self.pattern.pattern, self.rules], ensure_ascii=False, sort_keys=True)
+        self.version = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def match(self, text_upper: str) -> Optional[Dict[str, Any]]:
+        """Retourne la règle applicable de plus haute priorité, ou None (insensible aux accents)"""
+        text_upper = unicodedata.normalize('NFD', text_upper).encode('ascii', 'ignore').decode('ascii')
+        
+        found = set()
+        for match in self.pattern.finditer(text_upper):
+            found |= self.implied[match.group(1)]
+        
+        candidates = sorted({i for token in found for i in self.by_token.get(token, ())})
+        for i in candidates:
+            rule = self.rules[i]
+            if not all(token in found for token in rule["all"]):
+                continue
+            if rule.get("any") and not any(token in found for token in rule["any"]):
+                continue
+            return rule
+        
+        return None
+
+STANDARDIZATION_RULE_ENGINE = StandardizationRuleEngine(STANDARDIZATION_RULES)
+
+# ============================================================
+# FONCTION DE STANDARDISATION SPÉCIFIQUE POUR BDC
+# ============================================================
+def standardize_product_for_bdc_uncached(product_name: str) -> Tuple[str, str, float, str]:
+    """
+    Standardise spécifiquement pour les produits BDC ULYS (sans cache)
+    
+    Returns:
+        Tuple (produit_brut, produit_standard, confidence, status)
+    """
+    # Garder le produit brut original
+    produit_brut = product_name.strip()
+    
+    # Corrections spécifiques pour ULYS : une règle applicable remplace
+    # entièrement le résultat du matching, inutile de le calculer
+    rule = STANDARDIZATION_RULE_ENGINE.match(produit_brut.upper())
+    if rule:
+        return produit_brut, rule["produit"], rule["confidence"], "matched"
+    
+    # Standardiser avec la méthode améliorée
+    produit_standard, confidence, status = standardize_product_name_improved(product_name)
+    
+    return produit_brut, produit_standard, confidence, status
+
+# ============================================================
+# CACHE DE STANDARDISATION (LRU + PERSISTANCE SQLITE)
+# ============================================================
+STANDARDIZATION_RULES_VERSION = STANDARDIZATION_RULE_ENGINE.version
+
+STANDARDIZATION_CACHE_SIZE = 5000
+# Écritures regroupées : enregistrées toutes les 100 ou au plus tard après 5 s
+STANDARDIZATION_CACHE_FLUSH_SIZE = 100
+STANDARDIZATION_CACHE_FLUSH_SECONDS = 5.0
+# Purge de la base quand elle dépasse maxsize de 10 %
+STANDARDIZATION_CACHE_PRUNE_MARGIN = 0.1
+STANDARDIZATION_CACHE_PATH = os.environ.get(
+    "CHANFOUI_STANDARDIZATION_CACHE",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 ".cache", "standardization_cache.sqlite")
+)
+
+def compute_code_version() -> str:
+    """
+    Empreinte du code de ce module : prétraitement, caractéristiques, poids
+    des scores, seuils et classement des matchs
+    """
+    try:
+        with open(__file__, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()[:16]
+    except OSError:
+        return ""
+
+def compute_catalog_version() -> str:
+    """
+    Empreinte du catalogue et du code de matching : change dès que les
+    produits, synonymes, règles ou le code de standardisation changent
+    """
+    payload = json.dumps(
+        [compute_code_version(), STANDARDIZATION_RULES_VERSION, STANDARD_PRODUCTS, SYNONYMS,
+         VOLUME_EQUIVALENTS],
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+class StandardizationCache:
+    """
+    Cache LRU borné des résultats de standardisation (désignation brute -> résultat),
+    optionnellement persisté dans un fichier SQLite local.
+    
+    Les entrées sont rattachées à une version du catalogue. Les écritures
+    (nouveaux résultats et dates d'accès) sont regroupées et enregistrées par
+    lots (flush) ; les entrées d'une autre version et les moins récemment
+    utilisées au-delà de maxsize sont purgées à l'ouverture, puis quand la
+    base dépasse maxsize de STANDARDIZATION_CACHE_PRUNE_MARGIN.
+    """
+
+    def __init__(self, version: str, maxsize: int = STANDARDIZATION_CACHE_SIZE,
+                 path: Optional[str] = None):
+        self.version = version
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[str, str, float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        # Écritures en attente : désignation -> (résultat, date d'accès) et désignation -> date d'accès
+        self._pending: Dict[str, Tuple[Tuple[str, str, float, str], float]] = {}
+        self._touched: Dict[str, float] = {}
+        self._last_flush = time.monotonic()
+        self._stored = 0
+        if path:
+            self._open(path)
+
+    def _open(self, path: str):
+        """Ouvre la base SQLite, la purge et charge les entrées les plus récemment utilisées"""
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(path, check_same_thread=False)
+            columns = [row[1] for row in db.execute("PRAGMA table_info(standardization)")]
+            if columns and "accessed_at" not in columns:
+                # Ancien format sans date d'accès : c'est un cache, on repart de zéro
+                db.execute("DROP TABLE standardization")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS standardization ("
+                "version TEXT, designation TEXT, produit_brut TEXT, produit_standard TEXT, "
+                "confidence REAL, status TEXT, accessed_at REAL, PRIMARY KEY (version, designation))"
+            )
+            self._prune(db)
+            db.commit()
+            rows = db.execute(
+                "SELECT designation, produit_brut, produit_standard, confidence, status "
+                "FROM standardization WHERE version = ? ORDER BY accessed_at DESC LIMIT ?",
+                (self.version, self.maxsize)
+            ).fetchall()
+            for designation, *result in reversed(rows):
+                self._entries[designation] = tuple(result)
+            self._stored = len(rows)
+            self._db = db
+        except sqlite3.Error:
+            # Système de fichiers en lecture seule ou base corrompue : cache mémoire seul
+            self._db = None
+
+    def _prune(self, db):
+        """Supprime les entrées d'une autre version et les moins récemment utilisées au-delà de maxsize"""
+        db.execute("DELETE FROM standardization WHERE version != ?", (self.version,))
+        db.execute(
+            "DELETE FROM standardization WHERE rowid NOT IN "
+            "(SELECT rowid FROM standardization ORDER BY accessed_at DESC LIMIT ?)",
+            (self.maxsize,)
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, designation: str) -> Optional[Tuple[str, str, float, str]]:
+        with self._lock:
+            result = self._entries.get(designation)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(designation)
+            self.hits += 1
+            if self._db is not None:
+                if designation in self._pending:
+                    self._pending[designation] = (result, time.time())
+                else:
+                    self._touched[designation] = time.time()
+                self._flush_if_due()
+            return result
+
+    def put(self, designation: str, result: Tuple[str, str, float, str]):
+        self.put_many([(designation, result)])
+
+    def put_many(self, items: List[Tuple[str, Tuple[str, str, float, str]]]):
+        """Mémorise plusieurs résultats ; l'écriture dans la base est différée (voir flush)"""
+        if not items:
+            return
+        with self._lock:
+            now = time.time()
+            for designation, result in items:
+                self._entries[designation] = result
+                self._entries.move_to_end(designation)
+                if self._db is not None:
+                    self._pending[designation] = (result, now)
+                    self._touched.pop(designation, None)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self._flush_if_due()
+
+    def _flush_if_due(self):
+        if (len(self._pending) + len(self._touched) >= STANDARDIZATION_CACHE_FLUSH_SIZE
+                or time.monotonic() - self._last_flush >= STANDARDIZATION_CACHE_FLUSH_SECONDS):
+            self._flush()
+
+    def _flush(self):
+        """Enregistre les écritures en attente en une transaction (verrou tenu par l'appelant)"""
+        self._last_flush = time.monotonic()
+        if self._db is None or not (self._pending or self._touched):
+            return
+        try:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO standardization VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(self.version, designation, *result, accessed_at)
+                 for designation, (result, accessed_at) in self._pending.items()]
+            )
+            self._db.executemany(
+                "UPDATE standardization SET accessed_at = ? WHERE version = ? AND designation = ?",
+                [(accessed_at, self.version, designation) for designation, accessed_at in self._touched.items()]
+            )
+            self._stored += len(self._pending)
+            if self._stored > self.maxsize * (1 + STANDARDIZATION_CACHE_PRUNE_MARGIN):
+                self._prune(self._db)
+                self._stored = self._db.execute("SELECT COUNT(*) FROM standardization").fetchone()[0]
+            self._db.commit()
+        except sqlite3.Error:
+            self._db = None
+        self._pending.clear()
+        self._touched.clear()
+
+    def flush(self):
+        """Enregistre immédiatement les écritures en attente"""
+        with self._lock:
+            self._flush()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pending.clear()
+            self._touched.clear()
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM standardization")
+                    self._db.commit()
+                    self._stored = 0
+                except sqlite3.Error:
+                    self._db = None
+
+_STANDARDIZATION_CACHE: Optional[StandardizationCache] = None
+_STANDARDIZATION_CACHE_LOCK = threading.Lock()
+
+def get_standardization_cache() -> StandardizationCache:
+    """Cache de standardisation partagé, ouvert (et son fichier créé) au premier usage"""
+    global _STANDARDIZATION_CACHE
+    with _STANDARDIZATION_CACHE_LOCK:
+        if _STANDARDIZATION_CACHE is None:
+            _STANDARDIZATION_CACHE = StandardizationCache(
+                compute_catalog_version(), path=STANDARDIZATION_CACHE_PATH
+            )
+            atexit.register(_STANDARDIZATION_CACHE.flush)
+        return _STANDARDIZATION_CACHE
+
+def standardization_key(product_name: str) -> str:
+    """Clé de cache d'une désignation : le résultat ne dépend pas des espaces de bord"""
+    return product_name.strip()
+
+def standardize_product_for_bdc(product_name: str) -> Tuple[str, str, float, str]:
+    """
+    Standardise spécifiquement pour les produits BDC ULYS
+    
+    Les résultats sont mémorisés dans le cache de standardisation
+    (get_standardization_cache).
+    
+    Returns:
+        Tuple (produit_brut, produit_standard, confidence, status)
+    """
+    cache = get_standardization_cache()
+    key = standardization_key(product_name)
+    result = cache.get(key)
+    if result is None:
+        result = standardize_product_for_bdc_uncached(key)
+        cache.put(key, result)
+    return result
+
+# ============================================================
+# STANDARDISATION PAR LOT (LISTES D'ARTICLES)
+# ============================================================
+# Lignes d'en-tête de catégorie recopiées telles quelles (pas de standardisation)
+CATEGORY_MARKERS = ["VINS ROUGES", "VINS BLANCS", "VINS ROSES", "LIQUEUR", "CONSIGNE"]
+CATEGORY_CODE_MARKERS = ["122111", "122112", "122113"]
+
+def standardize_batch(product_names: List[str]) -> pd.DataFrame:
+    """
+    Standardise une liste de désignations en un seul appel
+    
+    Les désignations identiques (après suppression des espaces de bord)
+    ne sont standardisées qu'une seule fois ; celles absentes du cache et
+    sans règle BDC applicable sont matchées ensemble (rank_product_matches_batch).
+    
+    Returns:
+        DataFrame (produit_brut, produit_standard, confidence, status),
+        une ligne par désignation, dans l'ordre d'entrée
+    """
+    names = pd.Series(list(product_names), dtype=object).fillna("").astype(str).map(standardization_key)
+    
+    cache = get_standardization_cache()
+    results = {}
+    computed = []
+    to_match = []
+    for name in names.unique():
+        cached = cache.get(name)
+        if cached is not None:
+            results[name] = cached
+            continue
+        
+        # Même logique que standardize_product_for_bdc_uncached
+        computed.append(name)
+        rule = STANDARDIZATION_RULE_ENGINE.match(name.upper())
+        if rule:
+            results[name] = (name, rule["produit"], rule["confidence"], "matched")
+        elif not name:
+            results[name] = ("", "", 0.0, "empty")
+        else:
+            to_match.append(name)
+    
+    # Matching de toutes les désignations restantes (voir ProductCatalog.rank_many)
+    for ranking in rank_product_matches_batch(to_match):
+        name = ranking['original']
+        results[name] = (name, *classify_product_match(name, ranking['best_match'], ranking['confidence']))
+    
+    cache.put_many([(name, results[name]) for name in computed])
+    
+    return pd.DataFrame(
+        [results[name] for name in names],
+        columns=["produit_brut", "produit_standard", "confidence", "status"]
+    )
+
+def build_standardized_articles_df(raw_names: List[str], quantities: List[Any],
+                                   category_markers: List[str],
+                                   category_quantity: Optional[Any] = None,
+                                   standardized: Optional[List[Tuple[str, str, float, str]]] = None) -> pd.DataFrame:
+    """
+    Construit le tableau éditable des articles standardisés
+    (Produit Brute, Produit Standard, Quantité, Confiance, Auto)
+    
+    Les lignes contenant un marqueur de catégorie sont recopiées sans
+    standardisation, avec category_quantity comme quantité si fourni.
+    standardized (facultatif) fournit le résultat déjà calculé pour chaque
+    désignation (voir standardize_product_for_bdc_uncached) : le cache de
+    standardisation n'est alors ni lu ni rempli.
+    """
+    names = pd.Series(list(raw_names), dtype=object).fillna("")
+    quantities = pd.Series(list(quantities), dtype=object)
+    
+    pattern = "|".join(re.escape(marker) for marker in category_markers)
+    is_category = names.astype(str).str.upper().str.contains(pattern, regex=True)
+    
+    df = pd.DataFrame({
+        "Produit Brute": names,
+        "Produit Standard": names,
+        "Quantité": quantities,
+        "Confiance": "0%",
+        "Auto": False
+    })
+    if category_quantity is not None:
+        df.loc[is_category, "Quantité"] = category_quantity
+    
+    to_standardize = ~is_category
+    if to_standardize.any():
+        if standardized is None:
+            batch = standardize_batch(names[to_standardize].tolist())
+        else:
+            batch = pd.DataFrame([standardized[i] for i in range(len(names)) if to_standardize.iloc[i]],
+                                 columns=["produit_brut", "produit_standard", "confidence", "status"])
+        batch.index = df.index[to_standardize]
+        df.loc[to_standardize, "Produit Brute"] = batch["produit_brut"]
+        df.loc[to_standardize, "Produit Standard"] = batch["produit_standard"]
+        df.loc[to_standardize, "Confiance"] = (batch["confidence"] * 100).map("{:.1f}%".format)
+        df.loc[to_standardize, "Auto"] = batch["confidence"] >= 0.7
+    
+    return df
@@ -0,0 +1,846 @@
+"""
+Analyse OCR des documents avec OpenAI Vision
+
+Le client OpenAI est créé à la demande (import paresseux du SDK). Les valeurs
+annexes de l'analyse (texte brut, numéro manuscrit, quartier S2M, magasin
+ULYS, détails d'ajustement, erreurs) sont écrites dans un dictionnaire de
+contexte fourni par l'appelant plutôt que dans st.session_state.
+
+La réponse du modèle est contrainte par un schéma JSON (structured outputs) :
+elle est décodée et validée en une seule étape en un VisionResult. Elle peut
+aussi être diffusée (stream) : l'entête puis chaque article sont transmis à
+l'appelant dès qu'ils sont complets, avant la fin de la génération.
+"""
+import re
+import os
+import json
+import logging
+import threading
+from typing import Callable, Dict, Any, List, Optional, TypedDict
+
+from .documents import (
+    clean_adresse,
+    clean_quartier,
+    detect_document_type_from_text,
+    extract_fact_number_from_handwritten,
+    extract_motel_name_from_doit,
+    guess_document_type_from_text,
+)
+from .images import encode_image_to_base64, image_mime_type, make_thumbnail
+from .ocr_cache import OCRCache, compute_ocr_version
+from .resilience import should_fall_back
+
+logger = logging.getLogger(__name__)
+
+# Clés du contexte d'analyse renseignées par les fonctions OCR
+ANALYSIS_CONTEXT_KEYS = (
+    "ocr_raw_text",
+    "fact_manuscrit",
+    "quartier_s2m",
+    "nom_magasin_ulys",
+    "document_analysis_details",
+    "errors",
+)
+
+
+def new_analysis_context() -> Dict[str, Any]:
+    """Contexte d'analyse vide (mêmes valeurs initiales que la session Streamlit)"""
+    return {
+        "ocr_raw_text": None,
+        "fact_manuscrit": "",
+        "quartier_s2m": "",
+        "nom_magasin_ulys": "",
+        "document_analysis_details": {},
+        "errors": [],
+        "ocr_cache_hit": False,
+        "image_metrics": {},
+        "classified_subtype": None,
+        "ocr_fallback": "",
+        "ocr_backend": "",
+        "ocr_confidence": None,
+        "ocr_routing": {},
+    }
+
+
+# ============================================================
+# PROMPT ET PARAMÈTRES OPENAI VISION
+# ============================================================
+# PROMPT AMÉLIORÉ AVEC EXTRACTION "DOIT M :"
+VISION_PROMPT = """
+        ANALYSE CE DOCUMENT ET EXTRACT LES INFORMATIONS SUIVANTES:
+
+        IMPORTANT RÈGLE SPÉCIALE POUR LES BONS DE COMMANDE (BDC):
+        - Pour TOUS les BDC (DLP, S2M, ULYS), cherche TOUJOURS le numéro manuscrit écrit à la main
+        - Ce numéro est généralement écrit après "F" ou "Fact" (exemple: Fact 251193 → 251193)
+        - Il se trouve souvent en haut à droite de l'entête, parfois sur le côté droit
+        - Si tu vois deux valeurs manuscrites différentes (ex: f 4567 et Fact 7890), 
+          prends TOUJOURS la valeur de Fact 7890 (donc 7890)
+        - Si aucun "F" ou "Fact" manuscrit n'est trouvé, laisse ce champ vide
+        
+        IMPORTANT RÈGLE SPÉCIALE POUR LES FACTURES:
+        - Pour les FACTURES EN COMPTE, cherche le texte après "DOIT M :" ou "DOIT M:"
+        - Ce texte contient le nom du magasin/client
+        - Exemple: "DOIT M : Motel d'Antananarivo -anosy- Antananarivo" → 
+          doit_m = "Motel d'Antananarivo -anosy- Antananarivo"
+        
+        Pour TOUS les documents, extrais:
+        {
+            "type_document": "BDC" ou "FACTURE",
+            "document_subtype": "DLP", "S2M", "ULYS", ou "FACTURE",
+            "client": "...",
+            "adresse_livraison": "...",
+            "quartier_s2m": "...",  (uniquement si S2M: le quartier sous "SUPERMAKI")
+            "nom_magasin_ulys": "...",  (uniquement si ULYS: le nom du magasin)
+            "doit_m": "...",  (uniquement si FACTURE: texte après "DOIT M :")
+            "fact_manuscrit_trouve": "oui" ou "non",
+            "fact_manuscrit": "...",  (le numéro exact après F ou Fact, SANS le F/Fact)
+        }
+        
+        Puis selon le type:
+        
+        1. SI C'EST UNE FACTURE (FACTURE EN COMPTE):
+            "numero_facture": "...",
+            "date": "...",  (IMPORTANT: extraire la date de la facture, pas la date du scan)
+            "bon_commande": "...",
+            "articles": [
+                {
+                    "article_brut": "TEXT EXACT de l'article (colonne 'Désignation')",
+                    "quantite": nombre  (colonne 'Nb bills', PAS 'Btlls/colis')
+                }
+            ]
+        
+        2. SI C'EST UN BDC (DLP, S2M, ULYS):
+            "numero": "...",  (IMPORTANT: utiliser TOUJOURS le fact_manuscrit si disponible, sinon vide)
+            "date": "...",  (IMPORTANT: extraire la date du BDC, pas la date du scan)
+            "articles": [
+                {
+                    "article_brut": "TEXT EXACT de la colonne Désignation",
+                    "quantite": nombre
+                }
+            ]
+        
+        RÈGLES SPÉCIFIQUES POUR CHAQUE TYPE:
+        • DLP: client = "DLP", adresse = "Leader Price Akadimbahoaka"  (TOUJOURS CETTE ADRESSE POUR DLP)
+        • S2M: client = "S2M", adresse = "Supermaki " + quartier_s2m (nettoyer format)
+        • ULYS: client = "ULYS", adresse = nom_magasin_ulys
+        • FACTURE: 
+          - Pour les colonnes: utiliser "Désignation" pour article_brut et "Nb bills" pour quantité
+          - Si le client est "Autre client" (pas DLP, ULYS ou S2M), forcer client = adresse
+          - NOUVEAU: Si "doit_m" est présent, utiliser doit_m pour client et adresse
+        
+        IMPORTANT POUR LES FACTURES:
+        - Utiliser la colonne "Désignation" pour les articles
+        - Utiliser la colonne "Nb bills" pour la quantité (PAS "Btlls/colis")
+        
+        INDICES DÉCISIFS:
+        • "DISTRIBUTION LEADER PRICE" = TOUJOURS DLP
+        • "SUPERMAKI" = TOUJOURS S2M
+        • "BON DE COMMANDE FOURNISSEUR" = TOUJOURS ULYS
+        • "FACTURE EN COMPTE" = TOUJOURS FACTURE
+        • "DOIT M :" = TOUJOURS EXTRAIRE LE TEXTE APRÈS
+        
+        EXEMPLE CORRECT POUR UNE FACTURE:
+        Si tu vois "DOIT M : Motel d'Antananarivo -anosy- Antananarivo" → 
+        "doit_m": "Motel d'Antananarivo -anosy- Antananarivo"
+        Si client n'est pas DLP, ULYS, S2M → 
+        "client": "Motel d'Antananarivo -anosy- Antananarivo"
+        "adresse_livraison": "Motel d'Antananarivo -anosy- Antananarivo"
+        
+        IMPORTANT POUR LA DATE: 
+        - Extraire la date qui est écrite sur le document (facture ou BDC)
+        - Ne pas utiliser la date actuelle ou une date estimée
+        - Formater la date en format clair (ex: 15/01/2024)
+        """
+
+VISION_MODEL = "gpt-4o"
+VISION_MAX_TOKENS = 4000
+VISION_TEMPERATURE = 0.1
+
+# Modèle de secours quand VISION_MODEL reste indisponible (vide : pas de
+# secours) et, si non nul, grand côté maximal de l'image qui lui est envoyée
+OCR_FALLBACK_MODEL = os.environ.get("CHANFOUI_OCR_FALLBACK_MODEL", "gpt-4o-mini")
+OCR_FALLBACK_IMAGE_SIZE = int(os.environ.get("CHANFOUI_OCR_FALLBACK_IMAGE_SIZE", 0))
+
+
+# ============================================================
+# RÉPONSE STRUCTURÉE (SCHÉMA JSON)
+# ============================================================
+class VisionArticle(TypedDict):
+    article_brut: str
+    quantite: float
+
+
+class VisionResult(TypedDict):
+    """Réponse de l'analyse d'un document ; les champs sans objet sont des chaînes vides"""
+    type_document: str
+    document_subtype: str
+    client: str
+    adresse_livraison: str
+    quartier_s2m: str
+    nom_magasin_ulys: str
+    doit_m: str
+    fact_manuscrit_trouve: str
+    fact_manuscrit: str
+    numero_facture: str
+    numero: str
+    date: str
+    bon_commande: str
+    articles: List[VisionArticle]
+
+
+def _string_field(description: str, enum: Optional[List[str]] = None) -> Dict[str, Any]:
+    field = {"type": "string", "description": description}
+    if enum:
+        field["enum"] = enum
+    return field
+
+
+# Schéma strict : tous les champs sont requis, vides ("") s'ils ne s'appliquent pas au document
+VISION_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "type_document": _string_field("Type du document", ["BDC", "FACTURE"]),
+        "document_subtype": _string_field("Sous-type du document", ["DLP", "S2M", "ULYS", "FACTURE"]),
+        "client": _string_field("Client"),
+        "adresse_livraison": _string_field("Adresse de livraison"),
+        "quartier_s2m": _string_field("S2M uniquement : quartier sous SUPERMAKI"),
+        "nom_magasin_ulys": _string_field("ULYS uniquement : nom du magasin"),
+        "doit_m": _string_field("FACTURE uniquement : texte après DOIT M :"),
+        "fact_manuscrit_trouve": _string_field("Numéro manuscrit F/Fact trouvé", ["oui", "non"]),
+        "fact_manuscrit": _string_field("BDC : numéro manuscrit après F ou Fact, sans le F/Fact"),
+        "numero_facture": _string_field("FACTURE : numéro de facture"),
+        "numero": _string_field("BDC : numéro (le fact_manuscrit si disponible)"),
+        "date": _string_field("Date écrite sur le document, format JJ/MM/AAAA"),
+        "bon_commande": _string_field("FACTURE : numéro du bon de commande"),
+        "articles": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "article_brut": _string_field("Texte exact de la colonne Désignation"),
+                    "quantite": {"type": "number", "description": "FACTURE : colonne Nb bills ; BDC : quantité"},
+                },
+                "required": ["article_brut", "quantite"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": list(VisionResult.__annotations__),
+    "additionalProperties": False,
+}
+
+VISION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "document_extraction", "strict": True, "schema": VISION_RESPONSE_SCHEMA},
+}
+
+
+def parse_vision_response(content: Optional[str]) -> VisionResult:
+    """
+    Décode et valide la réponse structurée du modèle
+
+    Lève ValueError si la réponse est vide, tronquée ou ne respecte pas
+    VISION_RESPONSE_SCHEMA.
+    """
+    if not content:
+        raise ValueError("réponse vide")
+    data = json.loads(content)
+    if not isinstance(data, dict):
+        raise ValueError("la réponse n'est pas un objet JSON")
+
+    for name, field in VISION_RESPONSE_SCHEMA["properties"].items():
+        if name not in data:
+            raise ValueError(f"champ manquant : {name}")
+        if field["type"] == "string":
+            if not isinstance(data[name], str):
+                raise ValueError(f"champ {name} : chaîne attendue")
+            if "enum" in field and data[name] not in field["enum"]:
+                raise ValueError(f"champ {name} : valeur inattendue {data[name]!r}")
+
+    if not isinstance(data["articles"], list):
+        raise ValueError("champ articles : liste attendue")
+    for article in data["articles"]:
+        if not isinstance(article, dict) or not isinstance(article.get("article_brut"), str):
+            raise ValueError("article sans désignation")
+        quantite = article.get("quantite")
+        if isinstance(quantite, bool) or not isinstance(quantite, (int, float)):
+            raise ValueError(f"quantité invalide pour {article['article_brut']!r}")
+    return data
+
+
+# ============================================================
+# ANALYSE EN DEUX TEMPS : CLASSIFICATION PUIS EXTRACTION CIBLÉE
+# ============================================================
+# Désactivable (un seul appel avec VISION_PROMPT) : CHANFOUI_TWO_STAGE_OCR=0
+TWO_STAGE_OCR = os.environ.get("CHANFOUI_TWO_STAGE_OCR", "1").lower() not in ("0", "false", "non", "")
+
+CLASSIFICATION_MODEL = "gpt-4o-mini"
+CLASSIFICATION_MAX_TOKENS = 20
+CLASSIFICATION_IMAGE_SIZE = 512
+
+CLASSIFICATION_PROMPT = """
+        QUEL EST LE TYPE DE CE DOCUMENT ?
+        • "DISTRIBUTION LEADER PRICE" = DLP
+        • "SUPERMAKI" = S2M
+        • "BON DE COMMANDE FOURNISSEUR" = ULYS
+        • "FACTURE EN COMPTE" = FACTURE
+        Si aucun de ces indices n'est lisible, réponds UNKNOWN.
+        """
+
+CLASSIFICATION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "document_classification",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "document_subtype": _string_field("Sous-type du document", ["DLP", "S2M", "ULYS", "FACTURE", "UNKNOWN"]),
+            },
+            "required": ["document_subtype"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+_EXTRACTION_PROMPT_HEADER = """
+        EXTRAIS LES INFORMATIONS DE CE {document}.
+        Les champs qui ne concernent pas ce document restent vides ("").
+        DATE : celle écrite sur le document (ex: 15/01/2024), jamais la date du scan.
+"""
+
+_BDC_MANUSCRIT_RULES = """
+        NUMÉRO MANUSCRIT :
+        - fact_manuscrit = numéro écrit à la main après "F" ou "Fact" (souvent en haut à droite de l'entête), SANS le F/Fact
+        - Si deux valeurs manuscrites différentes (ex: f 4567 et Fact 7890), prends TOUJOURS celle de Fact (7890)
+        - numero = fact_manuscrit ; vide si aucun "F" ou "Fact" manuscrit
+        ARTICLES : article_brut = TEXTE EXACT de la colonne Désignation, quantite = nombre
+"""
+
+# Prompt réduit et budget de sortie de chaque sous-type
+EXTRACTION_PROMPTS = {
+    "DLP": _EXTRACTION_PROMPT_HEADER.format(document="BON DE COMMANDE DLP (DISTRIBUTION LEADER PRICE)") + """
+        type_document = "BDC", document_subtype = "DLP", client = "DLP"
+        adresse_livraison = "Leader Price Akadimbahoaka" (TOUJOURS)
+""" + _BDC_MANUSCRIT_RULES,
+    "S2M": _EXTRACTION_PROMPT_HEADER.format(document="BON DE COMMANDE S2M (SUPERMAKI)") + """
+        type_document = "BDC", document_subtype = "S2M", client = "S2M"
+        quartier_s2m = le quartier écrit sous "SUPERMAKI"
+        adresse_livraison = "Supermaki " + quartier_s2m
+""" + _BDC_MANUSCRIT_RULES,
+    "ULYS": _EXTRACTION_PROMPT_HEADER.format(document="BON DE COMMANDE FOURNISSEUR ULYS") + """
+        type_document = "BDC", document_subtype = "ULYS", client = "ULYS"
+        nom_magasin_ulys = le nom du magasin
+        adresse_livraison = nom_magasin_ulys
+""" + _BDC_MANUSCRIT_RULES,
+    "FACTURE": _EXTRACTION_PROMPT_HEADER.format(document="DOCUMENT : FACTURE EN COMPTE") + """
+        type_document = "FACTURE", document_subtype = "FACTURE"
+        numero_facture, bon_commande
+        doit_m = texte après "DOIT M :" ou "DOIT M:" (ex: "Motel d'Antananarivo -anosy- Antananarivo")
+        Si le client n'est pas DLP, ULYS ou S2M : client = adresse_livraison = doit_m
+        ARTICLES : article_brut = colonne "Désignation", quantite = colonne "Nb bills" (PAS "Btlls/colis")
+""",
+}
+EXTRACTION_MAX_TOKENS = {"DLP": 2000, "S2M": 2000, "ULYS": 2500, "FACTURE": 3000}
+
+# ============================================================
+# LECTURE INCRÉMENTALE DE LA RÉPONSE DIFFUSÉE
+# ============================================================
+# Callback des résultats partiels : ("header", champs de l'entête),
+# ("article", article complet) ou ("reset", {}) quand une nouvelle réponse commence
+PartialResultCallback = Callable[[str, Dict[str, Any]], None]
+
+ARTICLES_KEY_PATTERN = re.compile(r'"articles"\s*:\s*\[')
+
+
+class StreamingArticleParser:
+    """
+    Lecture incrémentale d'une réponse JSON conforme à VISION_RESPONSE_SCHEMA
+
+    Les champs de l'entête précèdent "articles" (ordre du schéma) : ils sont
+    transmis dès l'ouverture de la liste, puis chaque article dès son
+    accolade fermante. La réponse complète reste validée par
+    parse_vision_response une fois la génération terminée.
+    """
+
+    def __init__(self, partial_result: PartialResultCallback):
+        self.partial_result = partial_result
+        self.text = ""
+        self._position = 0
+        self._in_articles = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start = 0
+
+    def feed(self, delta: str):
+        self.text += delta
+        if not self._in_articles:
+            # La clé peut être coupée entre deux fragments : on relit la fin déjà reçue
+            match = ARTICLES_KEY_PATTERN.search(self.text, max(0, self._position - 16))
+            self._position = len(self.text)
+            if match is None:
+                return
+            self._in_articles = True
+            self._position = match.end()
+            try:
+                header = json.loads(self.text[:match.start()].rstrip().rstrip(",") + "}")
+            except ValueError:
+                header = None
+            if isinstance(header, dict):
+                self.partial_result("header", header)
+        self._scan()
+
+    def _scan(self):
+        """Repère les objets article complets (accolades hors chaînes) depuis la dernière position"""
+        text = self.text
+        for i in range(self._position, len(text)):
+            char = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                if self._depth == 0:
+                    self._object_start = i
+                self._depth += 1
+            elif char == "}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        article = json.loads(text[self._object_start:i + 1])
+                    except ValueError:
+                        continue
+                    if isinstance(article, dict):
+                        self.partial_result("article", article)
+        self._position = len(text)
+
+
+# Réponses brutes déjà obtenues, par image prétraitée et version du prompt ;
+# les appels de l'analyse en deux temps ont chacun leur variante de clé
+_OCR_CACHE: Optional[OCRCache] = None
+_OCR_CACHE_LOCK = threading.Lock()
+
+
+def get_ocr_cache() -> OCRCache:
+    """Cache des réponses OpenAI Vision partagé, ouvert (et son fichier créé) au premier usage"""
+    global _OCR_CACHE
+    with _OCR_CACHE_LOCK:
+        if _OCR_CACHE is None:
+            _OCR_CACHE = OCRCache(compute_ocr_version(VISION_PROMPT, VISION_MODEL, VISION_MAX_TOKENS,
+                                                      VISION_TEMPERATURE,
+                                                      json.dumps(VISION_RESPONSE_SCHEMA, sort_keys=True)))
+        return _OCR_CACHE
+
+
+CLASSIFICATION_CACHE_VARIANT = compute_ocr_version(CLASSIFICATION_PROMPT, CLASSIFICATION_MODEL,
+                                                   CLASSIFICATION_MAX_TOKENS, CLASSIFICATION_IMAGE_SIZE)
+EXTRACTION_CACHE_VARIANTS = {
+    subtype: compute_ocr_version(prompt, EXTRACTION_MAX_TOKENS[subtype])
+    for subtype, prompt in EXTRACTION_PROMPTS.items()
+}
+
+# ============================================================
+# OPENAI CONFIGURATION
+# ============================================================
+# Délai maximal d'une requête (une réponse Vision complète prend 10 à 30 s)
+# et nouvelles tentatives du SDK ; les limites de débit sont de plus gérées
+# globalement par l'ordonnanceur OCR (chanfoui.scheduler)
+OPENAI_TIMEOUT_SECONDS = float(os.environ.get("CHANFOUI_OPENAI_TIMEOUT", 90))
+OPENAI_MAX_RETRIES = int(os.environ.get("CHANFOUI_OPENAI_MAX_RETRIES", 2))
+
+# Clients partagés par tout le processus (sessions Streamlit et workers) :
+# chacun garde son pool de connexions HTTP keep-alive
+_OPENAI_CLIENTS: Dict[tuple, Any] = {}
+_OPENAI_CLIENTS_LOCK = threading.Lock()
+
+def get_openai_client(api_key: Optional[str] = None, timeout: Optional[float] = None,
+                      max_retries: Optional[int] = None):
+    """
+    Retourne le client OpenAI partagé pour cette clé et ces paramètres
+
+    Le client (et ses connexions) est créé au premier appel puis réutilisé ;
+    il peut être utilisé simultanément par plusieurs threads. Sans api_key,
+    la clé est lue dans la variable d'environnement OPENAI_API_KEY. Lève
+    RuntimeError si aucune clé n'est disponible. max_retries ne s'applique
+    qu'aux appels directs : l'ordonnanceur OCR en utilise une copie sans
+    reprise du SDK (voir scheduler.RateLimitedClient).
+    """
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Clé API OpenAI non configurée")
+    timeout = OPENAI_TIMEOUT_SECONDS if timeout is None else timeout
+    max_retries = OPENAI_MAX_RETRIES if max_retries is None else max_retries
+
+    registry_key = (api_key, timeout, max_retries)
+    with _OPENAI_CLIENTS_LOCK:
+        client = _OPENAI_CLIENTS.get(registry_key)
+        if client is None:
+            from openai import OpenAI
+
+            client = OpenAI(api_key=api_key, timeout=timeout, max_retries=max_retries)
+            _OPENAI_CLIENTS[registry_key] = client
+        return client
+
+def close_openai_clients():
+    """Ferme les connexions des clients partagés (fin du processus, tests)"""
+    with _OPENAI_CLIENTS_LOCK:
+        for client in _OPENAI_CLIENTS.values():
+            client.close()
+        _OPENAI_CLIENTS.clear()
+
+def request_vision_completion(client, prompt: str, image_bytes: bytes, model: str, max_tokens: int,
+                              response_format: Dict[str, Any], detail: Optional[str] = None,
+                              on_delta: Optional[Callable[[str], None]] = None) -> Optional[str]:
+    """
+    Appel OpenAI Vision (prompt + image) ; lève RuntimeError si le modèle refuse de répondre
+
+    Avec on_delta, la réponse est diffusée et chaque fragment de texte lui
+    est transmis dès sa réception ; le texte complet est renvoyé à la fin.
+    """
+    if client is None:
+        client = get_openai_client()
+
+    image_url = {"url": f"data:{image_mime_type(image_bytes)};base64,{encode_image_to_base64(image_bytes)}"}
+    if detail:
+        image_url["detail"] = detail
+    request = dict(
+        model=model,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": image_url}
+                ]
+            }
+        ],
+        max_tokens=max_tokens,
+        temperature=VISION_TEMPERATURE,
+        response_format=response_format
+    )
+
+    if on_delta is not None:
+        fragments, refusal = [], []
+        for chunk in client.chat.completions.create(stream=True, **request):
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if getattr(delta, "refusal", None):
+                refusal.append(delta.refusal)
+            if delta.content:
+                fragments.append(delta.content)
+                on_delta(delta.content)
+        if refusal:
+            raise RuntimeError(f"analyse refusée par le modèle ({''.join(refusal)})")
+        return "".join(fragments)
+
+    response = client.chat.completions.create(**request)
+    message = response.choices[0].message
+    if getattr(message, "refusal", None):
+        raise RuntimeError(f"analyse refusée par le modèle ({message.refusal})")
+    return message.content
+
+def classify_document(image_bytes: bytes, client=None) -> Optional[str]:
+    """
+    Sous-type du document (DLP, S2M, ULYS ou FACTURE) d'après une vignette, par un modèle économique
+
+    Retourne None si aucun sous-type n'est reconnu ou si la classification
+    échoue : l'extraction utilise alors le prompt complet.
+    """
+    try:
+        content = get_ocr_cache().get(image_bytes, CLASSIFICATION_CACHE_VARIANT)
+        cached = content is not None
+        if not cached:
+            content = request_vision_completion(
+                client, CLASSIFICATION_PROMPT, make_thumbnail(image_bytes, CLASSIFICATION_IMAGE_SIZE),
+                CLASSIFICATION_MODEL, CLASSIFICATION_MAX_TOKENS, CLASSIFICATION_RESPONSE_FORMAT, detail="low"
+            )
+        subtype = json.loads(content)["document_subtype"]
+    except Exception as e:
+        logger.warning("Classification du document impossible (%s)", e)
+        return None
+
+    if not cached:
+        get_ocr_cache().put(image_bytes, content, CLASSIFICATION_CACHE_VARIANT)
+    return subtype if subtype in EXTRACTION_PROMPTS else None
+
+def extract_document_fields(image_bytes: bytes, context: Dict[str, Any], client=None,
+                            subtype: Optional[str] = None,
+                            partial_result: Optional[PartialResultCallback] = None) -> VisionResult:
+    """
+    Extraction structurée : prompt réduit et budget du sous-type s'il est
+    connu, sinon VISION_PROMPT complet
+
+    Avec partial_result, la réponse est diffusée et lue au fil de l'eau (voir
+    StreamingArticleParser). Si VISION_MODEL reste indisponible (erreurs
+    transitoires épuisées, échéance, disjoncteur ouvert), la requête est
+    refaite avec OCR_FALLBACK_MODEL (et OCR_FALLBACK_IMAGE_SIZE) ; le modèle
+    utilisé est noté dans context["ocr_fallback"] et la réponse n'est pas
+    mémorisée. Lève ValueError si la réponse ne respecte pas le schéma ; elle
+    n'est alors pas mémorisée dans le cache OCR (get_ocr_cache).
+    """
+    if subtype in EXTRACTION_PROMPTS:
+        prompt, max_tokens = EXTRACTION_PROMPTS[subtype], EXTRACTION_MAX_TOKENS[subtype]
+        variant = EXTRACTION_CACHE_VARIANTS[subtype]
+    else:
+        prompt, max_tokens, variant = VISION_PROMPT, VISION_MAX_TOKENS, ""
+
+    def request(model: str, request_image: bytes) -> Optional[str]:
+        on_delta = None
+        if partial_result is not None:
+            partial_result("reset", {})
+            on_delta = StreamingArticleParser(partial_result).feed
+        return request_vision_completion(client, prompt, request_image, model, max_tokens,
+                                         VISION_RESPONSE_FORMAT, on_delta=on_delta)
+
+    content = get_ocr_cache().get(image_bytes, variant)
+    cached = content is not None
+    fallback = False
+    if cached:
+        context["ocr_cache_hit"] = True
+    else:
+        try:
+            content = request(VISION_MODEL, image_bytes)
+        except Exception as e:
+            if not OCR_FALLBACK_MODEL or not should_fall_back(e):
+                raise
+            logger.warning("%s indisponible (%s) : analyse avec %s", VISION_MODEL, e, OCR_FALLBACK_MODEL)
+            fallback = True
+            context["ocr_fallback"] = OCR_FALLBACK_MODEL
+            fallback_image = (make_thumbnail(image_bytes, OCR_FALLBACK_IMAGE_SIZE)
+                              if OCR_FALLBACK_IMAGE_SIZE else image_bytes)
+            content = request(OCR_FALLBACK_MODEL, fallback_image)
+    context["ocr_raw_text"] = content
+
+    data = parse_vision_response(content)
+    if not cached and not fallback:
+        get_ocr_cache().put(image_bytes, content, variant)
+    return data
+
+def apply_subtype_corrections(data: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Règles métier par sous-type appliquées au résultat d'un OCR (client et
+    adresse forcés, numéro manuscrit, DOIT M) ; quel que soit le moteur
+    """
+    document_subtype = data.get("document_subtype", "").upper()
+    
+    if document_subtype in ["DLP", "S2M", "ULYS"]:
+        fact_manuscrit = data.get("fact_manuscrit", "")
+    
+        context["fact_manuscrit"] = fact_manuscrit
+    
+        data["numero"] = fact_manuscrit
+    
+    # CORRECTION DLP: FORCER L'ADRESSE À "Leader Price Akadimbahoaka"
+    if document_subtype == "DLP":
+        data["client"] = "DLP"
+        data["adresse_livraison"] = "Leader Price Akadimbahoaka"
+    
+    # Correction S2M
+    elif document_subtype == "S2M":
+        data["client"] = "S2M"
+        quartier = data.get("quartier_s2m", "")
+        if quartier:
+            quartier_nettoye = clean_quartier(quartier)
+            adresse_nettoyee = clean_adresse(f"Supermaki {quartier_nettoye}")
+            data["adresse_livraison"] = adresse_nettoyee
+            context["quartier_s2m"] = quartier_nettoye
+        else:
+            adresse = data.get("adresse_livraison", "")
+            data["adresse_livraison"] = clean_adresse(adresse) if adresse else "Supermaki"
+    
+    # Correction ULYS
+    elif document_subtype == "ULYS":
+        data["client"] = "ULYS"
+        nom_magasin = data.get("nom_magasin_ulys", "")
+        if nom_magasin:
+            data["adresse_livraison"] = nom_magasin
+            context["nom_magasin_ulys"] = nom_magasin
+        else:
+            data["adresse_livraison"] = "ULYS Magasin"
+    
+    # NOUVELLE CORRECTION: Pour les factures avec "doit_m", forcer client = adresse = doit_m
+    elif document_subtype == "FACTURE":
+        client_value = data.get("client", "").upper()
+        adresse_value = data.get("adresse_livraison", "")
+        doit_m = data.get("doit_m", "")
+    
+        # Si le client n'est pas DLP, ULYS, S2M et on a un doit_m
+        if client_value not in ["DLP", "ULYS", "S2M"] and doit_m:
+            data["client"] = doit_m
+            data["adresse_livraison"] = doit_m
+        # Si le client n'est pas DLP, ULYS, S2M (même sans doit_m)
+        elif client_value not in ["DLP", "ULYS", "S2M"]:
+            data["client"] = adresse_value
+    
+    return data
+
+
+def openai_vision_ocr_improved(image_bytes: bytes, context: Optional[Dict[str, Any]] = None,
+                               client=None, partial_result: Optional[PartialResultCallback] = None) -> Dict:
+    """
+    Utilise OpenAI Vision pour analyser le document avec un prompt amélioré pour la détection V1.3
+
+    Avec TWO_STAGE_OCR, le sous-type est d'abord classé sur une vignette
+    (classify_document) puis extrait avec le prompt réduit de ce sous-type ;
+    une réponse ciblée non conforme est redemandée avec le prompt complet.
+    La réponse est contrainte par VISION_RESPONSE_SCHEMA puis validée par
+    parse_vision_response. Retourne None en cas d'échec ; le message est alors
+    ajouté à context["errors"]. Les réponses valides sont mémorisées dans le
+    cache OCR (get_ocr_cache). partial_result (facultatif) reçoit l'entête et les articles
+    au fil de la génération.
+    """
+    if context is None:
+        context = new_analysis_context()
+    try:
+        subtype = classify_document(image_bytes, client) if TWO_STAGE_OCR else None
+        context["classified_subtype"] = subtype
+
+        data = None
+        for extraction_subtype in ([subtype, None] if subtype else [None]):
+            try:
+                data = extract_document_fields(image_bytes, context, client, extraction_subtype, partial_result)
+                break
+            except ValueError as e:
+                logger.warning("Réponse OpenAI Vision non conforme au schéma (%s)", e)
+                parse_error = e
+        if data is None:
+            context.setdefault("errors", []).append(f"Réponse OpenAI Vision non conforme: {str(parse_error)}")
+            return guess_document_type_from_text(context.get("ocr_raw_text") or "", context)
+        
+        return apply_subtype_corrections(data, context)
+            
+    except Exception as e:
+        logger.exception("Erreur OpenAI Vision")
+        context.setdefault("errors", []).append(f"Erreur OpenAI Vision: {str(e)}")
+        return None
+
+#=============================================================
+def analyze_document_with_backup(image_bytes: bytes, context: Optional[Dict[str, Any]] = None,
+                                 client=None, progress: Optional[Callable[[str], None]] = None,
+                                 partial_result: Optional[PartialResultCallback] = None,
+                                 ocr: Optional[Callable[..., Optional[Dict]]] = None) -> Dict:
+    """
+    Analyse le document avec vérification de cohérence - VERSION MISE À JOUR
+
+    progress (facultatif) reçoit les étapes "ocr_request" puis "detection" ;
+    partial_result (facultatif) l'entête et les articles bruts au fil de la
+    génération, avant la vérification de cohérence. ocr est la fonction
+    d'OCR du moteur choisi (openai_vision_ocr_improved par défaut, même
+    signature ; voir chanfoui.backends).
+    """
+    if context is None:
+        context = new_analysis_context()
+    
+    if progress:
+        progress("ocr_request")
+    result = (ocr or openai_vision_ocr_improved)(image_bytes, context, client, partial_result)
+    
+    if not result:
+        return {"type_document": "DOCUMENT INCONNU", "articles": []}
+    
+    if progress:
+        progress("detection")
+
+    ocr_text = context.get("ocr_raw_text") or ""
+
+    # ============================================================
+    # 1. CAS BDC : extraction numéro manuscrit
+    # ============================================================
+    if ocr_text and result.get("type_document") == "BDC":
+        fact_manuscrit = extract_fact_number_from_handwritten(ocr_text)
+        
+        if fact_manuscrit and not result.get("fact_manuscrit"):
+            result["fact_manuscrit"] = fact_manuscrit
+            result["numero"] = fact_manuscrit
+            
+            context["document_analysis_details"] = {
+                "action": "Fact manuscrit extrait du texte brut",
+                "fact": fact_manuscrit
+            }
+
+    # ============================================================
+    # 2. CAS FACTURE : règle métier DOIT M (VERSION SÉCURISÉE)
+    # ============================================================
+    if ocr_text and result.get("type_document") == "FACTURE":
+        client_upper = result.get("client", "").upper()
+        adresse_upper = result.get("adresse_livraison", "").upper()
+
+        clients_bloques = ["DLP", "ULYS", "S2M"]
+
+        # Appliquer UNIQUEMENT pour autres clients
+        if client_upper not in clients_bloques:
+            doit_m_from_text = extract_motel_name_from_doit(ocr_text)
+
+            # 🔥 On corrige seulement si :
+            # - DOIT M existe
+            # - adresse absente OU adresse générique (MGTE)
+            if doit_m_from_text and (
+                not result.get("adresse_livraison")
+                or "MGTE" in adresse_upper
+            ):
+                result["doit_m"] = doit_m_from_text
+                result["client"] = doit_m_from_text
+                result["adresse_livraison"] = doit_m_from_text
+
+    # ============================================================
+    # 3. CONTRÔLE CROISÉ : détection par TEXTE vs IA
+    # ============================================================
+    if ocr_text:
+        text_detection = detect_document_type_from_text(ocr_text)
+        for key in ("quartier_s2m", "nom_magasin_ulys"):
+            if text_detection.get(key):
+                context[key] = text_detection[key]
+        
+        ai_subtype = result.get("document_subtype", "").upper()
+        text_type = text_detection["type"]
+
+        if text_type != "UNKNOWN" and ai_subtype != text_type:
+            context["document_analysis_details"] = {
+                "original_type": ai_subtype,
+                "adjusted_type": text_type,
+                "reason": "Contradiction détectée: détection par texte plus fiable",
+                "indicators": text_detection["indicators_found"]
+            }
+
+            if text_type == "DLP":
+                result["type_document"] = "BDC"
+                result["document_subtype"] = "DLP"
+                result["client"] = "DLP"
+                result["adresse_livraison"] = "Leader Price Akadimbahoaka"
+
+            elif text_type == "S2M":
+                result["type_document"] = "BDC"
+                result["document_subtype"] = "S2M"
+                result["client"] = "S2M"
+                quartier = context.get("quartier_s2m") or ""
+                result["adresse_livraison"] = clean_adresse(
+                    f"Supermaki {quartier}" if quartier else "Supermaki"
+                )
+
+            elif text_type == "ULYS":
+                result["type_document"] = "BDC"
+                result["document_subtype"] = "ULYS"
+                result["client"] = "ULYS"
+                nom_magasin = context.get("nom_magasin_ulys") or ""
+                result["adresse_livraison"] = nom_magasin if nom_magasin else "ULYS Magasin"
+
+            elif text_type == "FACTURE":
+                result["type_document"] = "FACTURE"
+                result["document_subtype"] = "FACTURE"
+
+                # Réappliquer proprement la règle DOIT M
+                client_upper = result.get("client", "").upper()
+                if client_upper not in ["DLP", "ULYS", "S2M"]:
+                    doit_m_from_text = extract_motel_name_from_doit(ocr_text)
+                    if doit_m_from_text:
+                        result["client"] = doit_m_from_text
+                        result["adresse_livraison"] = doit_m_from_text
+
+    return result
@@ -0,0 +1,152 @@
+"""
+Cache des réponses OCR adressé par le contenu
+
+Une ré-analyse de la même photo (rechargement de la page, nouvel envoi) ne
+doit pas payer un second appel OpenAI Vision. Les réponses brutes sont
+stockées dans un fichier SQLite local, sous la clé SHA-256 des octets de
+l'image prétraitée et de la version du prompt et du modèle. Les entrées
+expirent après une durée de vie (TTL) et les moins récemment utilisées sont
+évincées au-delà d'une taille totale maximale.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+OCR_CACHE_TTL_SECONDS = 30 * 24 * 3600
+OCR_CACHE_MAX_BYTES = 50 * 1024 * 1024
+OCR_CACHE_PATH = os.environ.get(
+    "CHANFOUI_OCR_CACHE",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 ".cache", "ocr_cache.sqlite")
+)
+
+
+def compute_ocr_version(*parts) -> str:
+    """Empreinte du prompt et des paramètres du modèle : change dès que l'un d'eux change"""
+    payload = "\x1f".join(str(part) for part in parts)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class OCRCache:
+    """
+    Cache persistant (SQLite) des réponses brutes d'OCR, clé = SHA-256(version + image)
+
+    Sans chemin, ou si la base ne peut pas être ouverte, le cache est inactif :
+    get() renvoie toujours None et put() ne fait rien.
+    """
+
+    def __init__(self, version: str, path: Optional[str] = OCR_CACHE_PATH,
+                 ttl_seconds: float = OCR_CACHE_TTL_SECONDS,
+                 max_bytes: int = OCR_CACHE_MAX_BYTES):
+        self.version = version
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._open(path)
+
+    def _open(self, path: str):
+        """Ouvre la base SQLite et purge les entrées expirées"""
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(path, check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_cache ("
+                "key TEXT PRIMARY KEY, raw_text TEXT, size INTEGER, "
+                "created_at REAL, accessed_at REAL)"
+            )
+            db.execute("DELETE FROM ocr_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            db.commit()
+            self._db = db
+        except sqlite3.Error:
+            # Système de fichiers en lecture seule ou base corrompue : pas de cache
+            logger.warning("Cache OCR indisponible (%s)", path)
+            self._db = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._db is not None
+
+    def key(self, image_bytes: bytes, variant: str = "") -> str:
+        """Clé de cache d'une image prétraitée (variant distingue les prompts d'une même version)"""
+        digest = hashlib.sha256(self.version.encode("ascii"))
+        if variant:
+            digest.update(variant.encode("utf-8") + b"\x1f")
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def get(self, image_bytes: bytes, variant: str = "") -> Optional[str]:
+        """Réponse brute mémorisée pour cette image, ou None"""
+        if self._db is None:
+            return None
+        key = self.key(image_bytes, variant)
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._db.execute(
+                    "SELECT raw_text FROM ocr_cache WHERE key = ? AND created_at >= ?",
+                    (key, now - self.ttl_seconds)
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                self._db.execute("UPDATE ocr_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                self._db.commit()
+                self.hits += 1
+                return row[0]
+            except sqlite3.Error:
+                self._db = None
+                return None
+
+    def put(self, image_bytes: bytes, raw_text: str, variant: str = ""):
+        """Mémorise la réponse brute puis évince les entrées les moins récentes au-delà de max_bytes"""
+        if self._db is None or not raw_text:
+            return
+        key = self.key(image_bytes, variant)
+        now = time.time()
+        size = len(raw_text.encode("utf-8"))
+        with self._lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO ocr_cache VALUES (?, ?, ?, ?, ?)",
+                    (key, raw_text, size, now, now)
+                )
+                self._evict()
+                self._db.commit()
+            except sqlite3.Error:
+                self._db = None
+
+    def _evict(self):
+        """Supprime les entrées expirées puis les moins récemment utilisées au-delà de max_bytes"""
+        self._db.execute("DELETE FROM ocr_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        stale = []
+        for key, size in self._db.execute("SELECT key, size FROM ocr_cache ORDER BY accessed_at"):
+            stale.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM ocr_cache WHERE key = ?", stale)
+
+    def clear(self):
+        with self._lock:
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM ocr_cache")
+                    self._db.commit()
+                except sqlite3.Error:
+                    self._db = None
@@ -0,0 +1,300 @@
+"""
+Pipeline de traitement d'un document
+
+Enchaîne prétraitement de l'image, analyse OCR, standardisation des articles
+et préparation des lignes Google Sheets, avec les mêmes valeurs par défaut
+que celles pré-remplies par l'interface Streamlit. Les pages d'un document
+(PDF ou plusieurs photos) sont analysées en parallèle puis fusionnées en un
+seul résultat avant la standardisation. En mode diffusé, chaque article est
+standardisé dès sa réception, pendant que le modèle génère les suivants.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional, Union
+
+import pandas as pd
+
+from .documents import (
+    clean_adresse,
+    format_date_french,
+    get_month_from_date,
+    map_client,
+    normalize_document_type,
+    prepare_rows_for_sheet,
+)
+from .backends import OCRBackend, analyze_page
+from .matching import CATEGORY_MARKERS, build_standardized_articles_df, standardize_product_for_bdc_uncached
+from .ocr import PartialResultCallback, new_analysis_context
+
+# Type de document (clé de SHEET_GIDS) associé à chaque sous-type détecté
+DOCUMENT_SUBTYPE_TYPES = {
+    "DLP": "BDC LEADERPRICE",
+    "S2M": "BDC S2M",
+    "ULYS": "BDC ULYS",
+    "FACTURE": "FACTURE EN COMPTE",
+}
+
+KNOWN_CLIENTS = ["ULYS", "S2M", "DLP"]
+
+# Pages d'un même document analysées simultanément (avec un client de
+# l'ordonnanceur, les appels OpenAI restent bornés par sa concurrence)
+PAGE_CONCURRENCY = 4
+
+# Valeurs du contexte d'analyse reprises de la première page qui les renseigne
+FIRST_PAGE_CONTEXT_KEYS = ("fact_manuscrit", "quartier_s2m", "nom_magasin_ulys", "document_analysis_details",
+                           "ocr_fallback", "ocr_backend")
+
+# Étapes signalées au callback progress : libellé et avancement (en %)
+PIPELINE_STAGES = {
+    "preprocess": ("Prétraitement de l'image...", 10),
+    "ocr_request": ("Analyse par IA...", 20),
+    "detection": ("Détection du type et vérification de cohérence...", 80),
+    "standardization": ("Standardisation des produits...", 90),
+    "done": ("Finalisation...", 100),
+}
+
+
+def resolve_document_type(result: Dict[str, Any]) -> str:
+    """Type de document final (clé de SHEET_GIDS) à partir du résultat de l'analyse"""
+    document_subtype = result.get("document_subtype", "").upper()
+    if document_subtype in DOCUMENT_SUBTYPE_TYPES:
+        return DOCUMENT_SUBTYPE_TYPES[document_subtype]
+    return normalize_document_type(result.get("type_document", "DOCUMENT INCONNU"))
+
+
+def build_articles_df(result: Dict[str, Any]) -> pd.DataFrame:
+    """Tableau des articles standardisés extraits par l'analyse"""
+    articles = result.get("articles") or []
+    return build_standardized_articles_df(
+        [article.get("article_brut", article.get("article", "")) for article in articles],
+        [article.get("quantite", 0) for article in articles],
+        CATEGORY_MARKERS,
+        category_quantity=0
+    )
+
+
+def build_streamed_articles_df(articles: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Tableau provisoire des articles reçus au fil de la génération
+
+    Les articles portent la standardisation calculée sans cache par
+    page_partial_result (clé standardisation) : une réponse pas encore
+    validée ne remplit pas le cache de standardisation.
+    """
+    return build_standardized_articles_df(
+        [article.get("article_brut", "") for article in articles],
+        [article.get("quantite", 0) for article in articles],
+        CATEGORY_MARKERS,
+        category_quantity=0,
+        standardized=[article.get("standardisation") or standardize_product_for_bdc_uncached(
+            article.get("article_brut", "")) for article in articles]
+    )
+
+
+def build_sheet_data(result: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+    """
+    Informations du document telles que pré-remplies dans l'interface
+
+    Sans intervention d'un opérateur, un client qui n'est ni ULYS, ni S2M, ni
+    DLP est conservé tel qu'extrait (l'adresse pour les factures).
+    """
+    context = context or {}
+    document_subtype = result.get("document_subtype", "").upper()
+
+    extracted_client = result.get("client", "")
+    if document_subtype in KNOWN_CLIENTS:
+        extracted_client = document_subtype
+    mapped_client = map_client(extracted_client)
+
+    date = format_date_french(result.get("date", ""))
+
+    if "FACTURE" in resolve_document_type(result):
+        adresse = result.get("adresse_livraison", "")
+        return {
+            "client": mapped_client if mapped_client in KNOWN_CLIENTS else adresse,
+            "numero_facture": result.get("numero_facture", ""),
+            "bon_commande": result.get("bon_commande", ""),
+            "adresse_livraison": adresse,
+            "date": date,
+            "mois": result.get("mois", get_month_from_date(result.get("date", "")))
+        }
+
+    adresse = result.get("adresse_livraison", "")
+    if document_subtype == "DLP":
+        adresse = "Leader Price Akadimbahoaka"
+    elif document_subtype == "S2M":
+        quartier = context.get("quartier_s2m") or ""
+        if quartier:
+            adresse = clean_adresse(f"Supermaki {quartier}")
+        else:
+            adresse = clean_adresse(adresse) if adresse else "Supermaki"
+    elif document_subtype == "ULYS":
+        adresse = context.get("nom_magasin_ulys") or "ULYS Magasin"
+
+    return {
+        "client": mapped_client if mapped_client in KNOWN_CLIENTS else extracted_client,
+        "numero": result.get("fact_manuscrit", "") or result.get("numero", ""),
+        "date": date,
+        "adresse_livraison": adresse
+    }
+
+
+def merge_page_results(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Résultat unique d'un document de plusieurs pages
+
+    L'entête (type, client, numéro, date...) est celui de la première page qui
+    renseigne chaque champ ; les articles de toutes les pages sont mis bout à
+    bout dans l'ordre des pages. Les pages dont l'analyse a échoué sont ignorées.
+    """
+    analyzed = [result for result in results
+                if result.get("type_document") != "DOCUMENT INCONNU" or result.get("articles")]
+    merged: Dict[str, Any] = {}
+    articles = []
+    for result in analyzed:
+        for key, value in result.items():
+            if key != "articles" and value and not merged.get(key):
+                merged[key] = value
+        articles.extend(result.get("articles") or [])
+    merged.setdefault("type_document", "DOCUMENT INCONNU")
+    merged["articles"] = articles
+    return merged
+
+
+def merge_page_contexts(context: Dict[str, Any], page_contexts: List[Dict[str, Any]]):
+    """Reporte dans context les contextes d'analyse des pages (texte brut, erreurs, mesures)"""
+    multiple = len(page_contexts) > 1
+    texts = [page_context.get("ocr_raw_text") for page_context in page_contexts]
+    if any(texts):
+        context["ocr_raw_text"] = "\n\n".join(
+            f"--- Page {number} ---\n{text or ''}" if multiple else (text or "")
+            for number, text in enumerate(texts, 1)
+        )
+    for key in FIRST_PAGE_CONTEXT_KEYS:
+        for page_context in page_contexts:
+            if page_context.get(key):
+                context[key] = page_context[key]
+                break
+    for number, page_context in enumerate(page_contexts, 1):
+        for error in page_context.get("errors", []):
+            context.setdefault("errors", []).append(f"Page {number} : {error}" if multiple else error)
+    context["ocr_cache_hit"] = all(page_context.get("ocr_cache_hit") for page_context in page_contexts)
+    confidences = [page_context.get("ocr_confidence") for page_context in page_contexts]
+    if all(confidence is not None for confidence in confidences):
+        context["ocr_confidence"] = min(confidences)
+    # Routage hybride : une page envoyée à OpenAI Vision suffit à marquer le document
+    routings = [page_context["ocr_routing"] for page_context in page_contexts if page_context.get("ocr_routing")]
+    if routings:
+        escalated = [routing for routing in routings if routing["backend"] != "local"]
+        context["ocr_routing"] = dict((escalated or routings)[0], escalated_pages=len(escalated))
+
+    page_metrics = [page_context.get("image_metrics") or {} for page_context in page_contexts]
+    if not multiple:
+        context["image_metrics"].update(page_metrics[0])
+    elif all(page_metrics):
+        context["image_metrics"].update(page_metrics[0])
+        for key in ("original_bytes", "sent_bytes", "correction_ms", "duration_ms"):
+            context["image_metrics"][key] = sum(metrics.get(key, 0) for metrics in page_metrics)
+        context["image_metrics"]["pages"] = len(page_metrics)
+
+
+def page_partial_result(partial_result: Optional[PartialResultCallback],
+                        page_number: int) -> Optional[PartialResultCallback]:
+    """
+    Relais des résultats partiels d'une page : ajoute le numéro de page et
+    standardise chaque article dès sa réception, dans le worker (clé
+    standardisation, voir build_streamed_articles_df). Les articles diffusés
+    ne sont pas encore validés par le schéma : la standardisation se fait
+    sans cache.
+    """
+    if partial_result is None:
+        return None
+
+    def forward(kind: str, payload: Dict[str, Any]):
+        payload = dict(payload, page=page_number)
+        if kind == "article":
+            payload["standardisation"] = standardize_product_for_bdc_uncached(str(payload.get("article_brut") or ""))
+        partial_result(kind, payload)
+    return forward
+
+
+def analyze_pages(pages: List[bytes], client=None, context: Optional[Dict[str, Any]] = None,
+                  progress: Optional[Callable[[str], None]] = None,
+                  correct_geometry: Optional[bool] = None,
+                  partial_result: Optional[PartialResultCallback] = None,
+                  backend: Union[str, OCRBackend, None] = None) -> Dict[str, Any]:
+    """
+    Prétraite et analyse les pages d'un document, en parallèle s'il y en a plusieurs
+
+    Chaque page a son propre contexte d'analyse ; les résultats et les
+    contextes sont ensuite fusionnés (voir merge_page_results et
+    merge_page_contexts) dans le résultat renvoyé et dans context.
+    partial_result (facultatif) reçoit l'entête et les articles de chaque
+    page au fil de la génération, avec leur numéro de page (clé page).
+    backend désigne le moteur d'OCR (voir chanfoui.backends).
+    """
+    if context is None:
+        context = new_analysis_context()
+    if progress is None:
+        progress = lambda stage: None
+
+    def analyze(page: bytes, page_context: Dict[str, Any], page_number: int,
+                page_progress=None) -> Dict[str, Any]:
+        return analyze_page(page, page_context, client, backend, page_progress,
+                            page_partial_result(partial_result, page_number), correct_geometry)
+
+    page_contexts = [new_analysis_context() for _ in pages]
+    progress("preprocess")
+    if len(pages) == 1:
+        results = [analyze(pages[0], page_contexts[0], 1, progress)]
+    else:
+        progress("ocr_request")
+        with ThreadPoolExecutor(max_workers=min(PAGE_CONCURRENCY, len(pages)),
+                                thread_name_prefix="chanfoui-page") as executor:
+            results = list(executor.map(analyze, pages, page_contexts, range(1, len(pages) + 1)))
+        progress("detection")
+
+    merge_page_contexts(context, page_contexts)
+    return merge_page_results(results)
+
+
+def process_document(image_bytes: Union[bytes, List[bytes]], client=None, editeur: str = "",
+                     context: Optional[Dict[str, Any]] = None,
+                     progress: Optional[Callable[[str], None]] = None,
+                     correct_geometry: Optional[bool] = None,
+                     partial_result: Optional[PartialResultCallback] = None,
+                     backend: Union[str, OCRBackend, None] = None) -> Dict[str, Any]:
+    """
+    Traite une image de document (ou la liste de ses pages) de bout en bout
+
+    Retourne un dictionnaire avec document_type, result (analyse brute),
+    data (informations du document), articles (DataFrame standardisé),
+    rows (lignes prêtes pour Google Sheets) et context (contexte d'analyse).
+    progress (facultatif) reçoit chaque étape de PIPELINE_STAGES au moment
+    où elle démarre. correct_geometry active ou non la correction OpenCV
+    (voir images.preprocess_image) ; partial_result active la diffusion de
+    la réponse et backend choisit le moteur d'OCR (voir analyze_pages).
+    """
+    if context is None:
+        context = new_analysis_context()
+    if progress is None:
+        progress = lambda stage: None
+
+    pages = [image_bytes] if isinstance(image_bytes, (bytes, bytearray)) else list(image_bytes)
+    context.setdefault("image_metrics", {})
+    result = analyze_pages(pages, client, context, progress, correct_geometry, partial_result, backend)
+
+    progress("standardization")
+    document_type = resolve_document_type(result)
+    data = build_sheet_data(result, context)
+    articles = build_articles_df(result)
+    rows = prepare_rows_for_sheet(document_type, data, articles, editeur)
+    progress("done")
+
+    return {
+        "document_type": document_type,
+        "result": result,
+        "data": data,
+        "articles": articles,
+        "rows": rows,
+        "context": context,
+    }
@@ -0,0 +1,102 @@
+"""
+Politique de résilience des appels OpenAI
+
+Classement des erreurs transitoires (limite de débit, réseau, serveur),
+délai demandé par l'API et disjoncteur (circuit breaker) : après une série
+d'échecs transitoires sur un modèle, ses appels sont refusés immédiatement
+pendant un temps de repos, ce qui permet de basculer aussitôt sur un modèle
+de secours au lieu d'accumuler les attentes. Utilisé par l'ordonnanceur OCR
+(chanfoui.scheduler) et par l'analyse OCR (chanfoui.ocr).
+"""
+import threading
+import time
+from typing import Optional
+
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+RETRYABLE_ERROR_NAMES = ("RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError")
+
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_SECONDS = 30.0
+
+
+class CircuitOpenError(RuntimeError):
+    """Appel refusé sans être tenté : le disjoncteur du modèle est ouvert"""
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Vrai pour les erreurs OpenAI transitoires (limite de débit, réseau, serveur)"""
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return type(error).__name__ == "RateLimitError" or getattr(error, "status_code", None) == 429
+
+
+def should_fall_back(error: Exception) -> bool:
+    """Vrai si un autre modèle a une chance de réussir là où l'appel a échoué"""
+    return isinstance(error, CircuitOpenError) or is_retryable_error(error)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Délai demandé par l'API (en-tête Retry-After), s'il est présent"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after") if hasattr(headers, "get") else None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Disjoncteur : fermé, ouvert après failure_threshold échecs transitoires
+    consécutifs, puis semi-ouvert après reset_seconds (un seul appel d'essai ;
+    son succès referme le disjoncteur, son échec le rouvre)
+    """
+
+    def __init__(self, name: str = "", failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_progress = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        """Lève CircuitOpenError si l'appel ne doit pas être tenté"""
+        with self._lock:
+            state = self._state()
+            if state == "open" or (state == "half_open" and self._trial_in_progress):
+                raise CircuitOpenError(f"disjoncteur ouvert pour {self.name or 'ce modèle'}")
+            if state == "half_open":
+                self._trial_in_progress = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_progress or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_progress = False
@@ -0,0 +1,297 @@
+"""
+Ordonnanceur des appels OCR concurrents
+
+Les appels OpenAI Vision durent 10 à 30 s : l'ordonnanceur les exécute dans
+un pool de threads à concurrence bornée et renvoie un Future par document.
+Les erreurs de limite de débit (429) et les erreurs serveur transitoires sont
+réessayées avec un délai exponentiel ; un 429 suspend tous les workers
+jusqu'à la fin du délai demandé par l'API (en-tête Retry-After). Le nombre
+d'appels OpenAI simultanés est borné par max_concurrency pour l'ensemble des
+clients enveloppés, pages d'un même document comprises. Chaque
+appel OpenAI a une échéance globale (tentatives comprises) et chaque modèle
+un disjoncteur (voir chanfoui.resilience) ; les compteurs d'appels,
+d'échecs et de reprises sont exposés par metrics_snapshot(). Les clients
+enveloppés ne réessaient pas eux-mêmes (max_retries=0 du SDK) : seul
+l'ordonnanceur gère reprises, délais et échéance.
+"""
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from .pipeline import process_document
+from .resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    is_rate_limit_error,
+    is_retryable_error,
+    retry_after_seconds,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _Completions:
+    """chat.completions.create avec échéance, disjoncteur et nouvelles tentatives partagées entre workers"""
+
+    def __init__(self, scheduler: "OCRScheduler", completions):
+        self._scheduler = scheduler
+        self._completions = completions
+
+    def create(self, **kwargs):
+        deadline = time.monotonic() + self._scheduler.call_deadline
+        requested_timeout = kwargs.get("timeout")
+
+        def attempt():
+            # Le délai de chaque tentative ne dépasse pas l'échéance de l'appel
+            remaining = max(1.0, deadline - time.monotonic())
+            timeout = remaining if requested_timeout is None else min(requested_timeout, remaining)
+            return self._completions.create(**dict(kwargs, timeout=timeout))
+
+        streaming = bool(kwargs.get("stream"))
+        result = self._scheduler.call_with_backoff(attempt, circuit=kwargs.get("model"), deadline=deadline,
+                                                   defer_success=streaming, hold_slot=streaming)
+        if streaming:
+            return self._scheduler.monitor_stream(result, circuit=kwargs.get("model"), deadline=deadline,
+                                                  release_slot=True)
+        return result
+
+
+class _Chat:
+    def __init__(self, scheduler: "OCRScheduler", chat):
+        self.completions = _Completions(scheduler, chat.completions)
+
+
+class RateLimitedClient:
+    """Enveloppe d'un client OpenAI dont les appels passent par l'ordonnanceur"""
+
+    def __init__(self, scheduler: "OCRScheduler", client):
+        # Une seule couche de reprise : celle de l'ordonnanceur (les reprises du
+        # SDK multiplieraient les tentatives, dépasseraient l'échéance et
+        # absorberaient les 429 avant la pause globale et le disjoncteur)
+        if hasattr(client, "with_options"):
+            client = client.with_options(max_retries=0)
+        self._client = client
+        self.chat = _Chat(scheduler, client.chat)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class OCRScheduler:
+    """
+    Pool de workers OCR à concurrence bornée
+
+    submit_document() renvoie un Future dont le résultat est celui de
+    pipeline.process_document ; submit() accepte n'importe quelle fonction
+    recevant le client en argument nommé.
+    """
+
+    def __init__(self, max_concurrency: int = 4, max_retries: int = 4,
+                 base_delay: float = 2.0, max_delay: float = 60.0,
+                 call_deadline: float = 180.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.call_deadline = call_deadline
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                            thread_name_prefix="chanfoui-ocr")
+        # Appels OpenAI en cours, tous workers et toutes pages confondus
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._metrics = Counter()
+        self._wrapped: Dict[int, tuple] = {}
+
+    def wrap(self, client) -> RateLimitedClient:
+        """Client dont les appels chat.completions.create sont réessayés par l'ordonnanceur"""
+        if isinstance(client, RateLimitedClient):
+            return client
+        with self._lock:
+            # Une enveloppe par client (les copies sans reprise partagent ses connexions)
+            entry = self._wrapped.get(id(client))
+            if entry is None or entry[0] is not client:
+                entry = (client, RateLimitedClient(self, client))
+                self._wrapped[id(client)] = entry
+            return entry[1]
+
+    def _wait_if_paused(self, deadline: Optional[float] = None):
+        """Attend la fin de la pause globale (429) ; TimeoutError si elle dépasse deadline"""
+        with self._lock:
+            now = time.monotonic()
+            delay = self._paused_until - now
+        if delay <= 0:
+            return
+        if deadline is not None and now + delay >= deadline:
+            self._count("deadline_exceeded")
+            raise TimeoutError("échéance de l'appel OpenAI atteinte avant la fin de la pause sur limite de débit")
+        time.sleep(delay)
+
+    def _pause(self, delay: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def _count(self, name: str):
+        with self._lock:
+            self._metrics[name] += 1
+
+    def circuit_breaker(self, name: str) -> CircuitBreaker:
+        """Disjoncteur partagé de ce modèle (ou de ce service)"""
+        with self._lock:
+            if name not in self._breakers:
+                self._breakers[name] = CircuitBreaker(name)
+            return self._breakers[name]
+
+    def metrics_snapshot(self) -> Dict[str, Any]:
+        """Compteurs (appels, échecs, reprises, échéances dépassées, refus du disjoncteur) et état des disjoncteurs"""
+        with self._lock:
+            snapshot = dict(self._metrics)
+            breakers = list(self._breakers.values())
+        snapshot["circuits"] = {breaker.name: breaker.state for breaker in breakers}
+        return snapshot
+
+    def call_with_backoff(self, func: Callable, *args, circuit: Optional[str] = None,
+                          deadline: Optional[float] = None, defer_success: bool = False,
+                          hold_slot: bool = False, **kwargs):
+        """
+        Appelle func en réessayant les erreurs transitoires avec un délai exponentiel
+
+        circuit nomme le disjoncteur à consulter (CircuitOpenError s'il est
+        ouvert) ; aucune nouvelle tentative n'est lancée au-delà de deadline
+        (instant time.monotonic()), et une pause globale qui la dépasse lève
+        aussitôt TimeoutError. Avec defer_success (réponse diffusée), le
+        succès n'est signalé au disjoncteur qu'en fin de lecture (voir
+        monitor_stream).
+
+        Chaque tentative occupe une des max_concurrency places d'appel
+        (jamais pendant les délais d'attente). Avec hold_slot, la place reste
+        occupée après un succès : elle est libérée en fin de lecture de la
+        réponse diffusée (voir monitor_stream).
+        """
+        breaker = self.circuit_breaker(circuit) if circuit else None
+        attempt = 0
+        while True:
+            # Pause avant le disjoncteur : un appel d'essai (semi-ouvert) est toujours tenté
+            self._wait_if_paused(deadline)
+            if breaker is not None:
+                try:
+                    breaker.before_call()
+                except CircuitOpenError:
+                    self._count("circuit_rejections")
+                    raise
+            self._count("calls")
+            self._slots.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                self._slots.release()
+                retryable = is_retryable_error(e)
+                if breaker is not None:
+                    # Une erreur non transitoire (requête invalide...) prouve que le service répond
+                    if retryable:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                if attempt >= self.max_retries or not retryable:
+                    self._count("failures")
+                    raise
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    self._count("deadline_exceeded")
+                    raise
+                if is_rate_limit_error(e):
+                    self._count("rate_limited")
+                    self._pause(delay)
+                attempt += 1
+                self._count("retries")
+                logger.warning("Appel OpenAI en échec (%s), nouvelle tentative %d/%d dans %.1f s",
+                               e, attempt, self.max_retries, delay)
+                time.sleep(delay)
+            else:
+                if not hold_slot:
+                    self._slots.release()
+                if breaker is not None and not defer_success:
+                    breaker.record_success()
+                return result
+
+    def monitor_stream(self, stream, circuit: Optional[str] = None, deadline: Optional[float] = None,
+                       release_slot: bool = False):
+        """
+        Parcourt une réponse diffusée et signale son issue au disjoncteur
+
+        Le succès est signalé en fin de lecture. Une erreur pendant la lecture
+        (après l'ouverture réussie du flux) est comptée et signalée comme une
+        erreur d'appel, puis relevée sans nouvelle tentative : les fragments
+        déjà transmis ne peuvent pas être repris. Au-delà de deadline, la
+        lecture est interrompue (TimeoutError). Avec release_slot, la place
+        d'appel conservée par call_with_backoff(hold_slot=True) est libérée
+        en fin de lecture, quelle qu'en soit l'issue.
+        """
+        breaker = self.circuit_breaker(circuit) if circuit else None
+        try:
+            yield from self._monitored_chunks(stream, breaker, deadline)
+        finally:
+            if release_slot:
+                self._slots.release()
+
+    def _monitored_chunks(self, stream, breaker: Optional[CircuitBreaker], deadline: Optional[float]):
+        try:
+            for chunk in stream:
+                yield chunk
+                if deadline is not None and time.monotonic() > deadline:
+                    self._count("deadline_exceeded")
+                    raise TimeoutError("échéance de l'appel OpenAI dépassée pendant la réponse diffusée")
+            if breaker is not None:
+                breaker.record_success()
+        except Exception as e:
+            self._count("stream_failures")
+            if breaker is not None:
+                if is_retryable_error(e) or isinstance(e, TimeoutError):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+            raise
+        except GeneratorExit:
+            # Lecture abandonnée par l'appelant : le service a répondu, on libère la connexion
+            if breaker is not None:
+                breaker.record_success()
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+            raise
+
+    def submit(self, func: Callable, *args, client=None, **kwargs) -> Future:
+        """Exécute func(*args, client=<client enveloppé>, **kwargs) dans le pool"""
+        if client is not None:
+            client = self.wrap(client)
+        return self._executor.submit(func, *args, client=client, **kwargs)
+
+    def submit_document(self, image_bytes: Union[bytes, List[bytes]], client, editeur: str = "",
+                        context: Optional[Dict[str, Any]] = None,
+                        progress: Optional[Callable[[str], None]] = None,
+                        correct_geometry: Optional[bool] = None,
+                        partial_result: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                        backend: Optional[str] = None) -> Future:
+        """Traite une image de document, ou ses pages, dans le pool (voir pipeline.process_document)"""
+        return self.submit(process_document, image_bytes, client=client, editeur=editeur,
+                           context=context, progress=progress, correct_geometry=correct_geometry,
+                           partial_result=partial_result, backend=backend)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
@@ -0,0 +1,131 @@
+"""
+Google Sheets : configuration, ouverture du classeur et détection des doublons
+
+gspread n'est importé qu'à l'ouverture du classeur.
+"""
+from typing import List, Tuple, Dict, Any
+
+from dateutil import parser
+
+
+# ============================================================
+# GOOGLE SHEETS CONFIGURATION - VERSION PRODUCTION
+# ============================================================
+SHEET_ID = "1h4xT-cw9Ys1HbkhMWVtRnDOxsZ0fBOaskjPgRyIj3K8"
+
+SHEET_GIDS = {
+    "FACTURE EN COMPTE": 541435939,
+    "BDC LEADERPRICE": 541435939,
+    "BDC S2M": 541435939,
+    "BDC ULYS": 541435939
+}
+
+def open_spreadsheet(sa_info: Dict[str, Any], sheet_id: str = SHEET_ID):
+    """Ouvre le classeur de production avec les identifiants du compte de service"""
+    import gspread
+
+    gc = gspread.service_account_from_dict(sa_info)
+    return gc.open_by_key(sheet_id)
+
+def get_worksheet_by_gid(spreadsheet, gid: int):
+    """Retourne l'onglet d'identifiant gid, ou None s'il n'existe pas"""
+    for worksheet in spreadsheet.worksheets():
+        if int(worksheet.id) == gid:
+            return worksheet
+    return None
+
+# ============================================================
+# FONCTIONS DE DÉTECTION DE DOUBLONS - FILTRE 3: Même logique pour BDC et factures
+# ============================================================
+def check_for_duplicates(document_type: str, extracted_data: dict, worksheet) -> Tuple[bool, List[Dict]]:
+    """
+    Vérifie si un document existe déjà dans Google Sheets
+
+    Les erreurs d'accès à la feuille sont propagées à l'appelant.
+    """
+    return find_duplicates(document_type, extracted_data, worksheet.get_all_values())
+
+def find_duplicates(document_type: str, extracted_data: dict,
+                    all_data: List[List[str]]) -> Tuple[bool, List[Dict]]:
+    """
+    Recherche un document dans les valeurs déjà lues d'une feuille
+
+    Permet de vérifier plusieurs documents avec une seule lecture de la feuille.
+    """
+    if len(all_data) <= 1:
+        return False, []
+    
+    client_col = 2
+    current_client = extracted_data.get('client', '')
+    
+    if "FACTURE" in document_type.upper():
+        doc_num_col = 3
+        current_doc_num = extracted_data.get('numero_facture', '')
+    else:
+        doc_num_col = 3
+        current_doc_num = extracted_data.get('numero', '')
+    
+    duplicates = []
+    for i, row in enumerate(all_data[1:], start=2):
+        if len(row) > max(doc_num_col, client_col):
+            row_client = row[client_col] if len(row) > client_col else ''
+            row_doc_num = row[doc_num_col] if len(row) > doc_num_col else ''
+            
+            if (row_client == current_client and 
+                row_doc_num == current_doc_num and 
+                current_client != '' and current_doc_num != ''):
+                
+                match_type = 'Client et Numéro identiques'
+                
+                if "ULYS" in current_client.upper() and "BDC" in document_type.upper():
+                    date_col = 1
+                    current_date = ""
+                    date_facture = extracted_data.get('date', '')
+                    if date_facture:
+                        try:
+                            date_obj = parser.parse(date_facture, dayfirst=True)
+                            current_date = date_obj.strftime("%d/%m/%Y")
+                        except:
+                            current_date = ""
+                    
+                    row_date = row[date_col] if len(row) > date_col else ''
+                    
+                    if row_date == current_date and current_date != '':
+                        match_type = 'Client, Numéro et Date identiques'
+                
+                duplicates.append({
+                    'row_number': i,
+                    'data': row,
+                    'match_type': match_type
+                })
+    
+    return len(duplicates) > 0, duplicates
+
+def find_table_range(worksheet, num_columns=8):
+    """Trouve la plage de table dans la feuille avec un nombre de colonnes spécifique"""
+    try:
+        all_data = worksheet.get_all_values()
+        
+        if not all_data:
+            return "A1:H1"
+        
+        headers = ["Mois", "Date", "Client", "N* facture", "Magasin", "Désignation", "Quantité", "Editeur"]
+        
+        first_row = all_data[0] if all_data else []
+        header_found = any(header in str(first_row) for header in headers)
+        
+        if header_found:
+            last_row = len(all_data) + 1
+            if len(all_data) <= 1:
+                return "A2:H2"
+            else:
+                return f"A{last_row}:H{last_row}"
+        else:
+            for i, row in enumerate(all_data, start=1):
+                if not any(cell.strip() for cell in row):
+                    return f"A{i}:H{i}"
+            
+            return f"A{len(all_data)+1}:H{len(all_data)+1}"
+            
+    except Exception:
+        return "A2:H2"
@@ -0,0 +1,4 @@
+import os
+
+# Pas de cache de standardisation persistant pendant les tests
+os.environ["CHANFOUI_STANDARDIZATION_CACHE"] = ""
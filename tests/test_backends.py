@@ -0,0 +1,121 @@
+"""Routage hybride : évaluation de la lecture locale, escalade et secours"""
+from pathlib import Path
+
+import pytest
+
+from chanfoui import backends
+from chanfoui.backends import HybridBackend, OCRBackend, analyze_page, assess_local_reading
+from chanfoui.local_ocr import parse_article_lines
+from chanfoui.matching import get_standardization_cache
+from chanfoui.ocr import new_analysis_context
+
+FIXTURES = Path(__file__).parent / "fixtures"
+FAILED = {"type_document": "DOCUMENT INCONNU", "articles": []}
+
+
+def local_reading(text, confidence=0.9):
+    """Résultat et contexte d'une lecture locale du texte donné"""
+    context = new_analysis_context()
+    context["ocr_raw_text"] = text
+    context["ocr_confidence"] = confidence
+    result = {"type_document": "BDC", "document_subtype": "DLP", "fact_manuscrit": "10452",
+              "articles": parse_article_lines(text)}
+    return result, context
+
+
+class FakeBackend(OCRBackend):
+    """Moteur qui renvoie un résultat fixé et compte ses lectures"""
+
+    def __init__(self, name, result, context_values=None):
+        self.name = name
+        self.label = name
+        self.result = result
+        self.context_values = context_values or {}
+        self.calls = 0
+
+    def recognize(self, image_bytes, context, client=None, partial_result=None):
+        return self.result
+
+    def analyze(self, page, context, client=None, progress=None, partial_result=None, correct_geometry=None):
+        self.calls += 1
+        context["ocr_backend"] = self.name
+        context.update(self.context_values)
+        if self.result is FAILED:
+            context["errors"].append(f"{self.name} en échec")
+        return self.result
+
+
+def test_reliable_local_reading():
+    result, context = local_reading((FIXTURES / "bdc_dlp.txt").read_text(encoding="utf-8"))
+    assessment = assess_local_reading(result, context)
+    assert assessment["reasons"] == []
+    assert assessment["matched_ratio"] == 1.0
+
+
+def test_assessment_does_not_fill_standardization_cache():
+    cache = get_standardization_cache()
+    cache.clear()
+    result, context = local_reading("Désignation Qté\nV1n r0ug C0t d3 F1anr 12\n")
+    assess_local_reading(result, context)
+    assert len(cache) == 0
+
+
+@pytest.mark.parametrize("text, confidence, reason", [
+    ("Désignation Qté\nV1n r0ug C0t d3 F1anr 12\n", 0.9, "0% des articles reconnus"),
+    ("DISTRIBUTION LEADER PRICE\nDésignation Qté\n", 0.9, "aucun article lu"),
+    ((FIXTURES / "bdc_dlp.txt").read_text(encoding="utf-8"), 0.5, "confiance OCR 50%"),
+])
+def test_unreliable_local_reading(text, confidence, reason):
+    result, context = local_reading(text, confidence)
+    assert reason in assess_local_reading(result, context)["reasons"]
+
+
+def hybrid(local_result, vision_result, confidence=0.9):
+    text = (FIXTURES / "bdc_dlp.txt").read_text(encoding="utf-8")
+    local = FakeBackend("local", local_result, {"ocr_raw_text": text, "ocr_confidence": confidence})
+    local.available = lambda: True
+    vision = FakeBackend("openai", vision_result)
+    return HybridBackend(local, vision), local, vision
+
+
+def test_hybrid_keeps_reliable_local_reading():
+    result, _ = local_reading((FIXTURES / "bdc_dlp.txt").read_text(encoding="utf-8"))
+    backend, local, vision = hybrid(result, FAILED)
+    context = new_analysis_context()
+    assert backend.analyze(b"page", context) is result
+    assert (local.calls, vision.calls) == (1, 0)
+    assert context["ocr_routing"]["backend"] == "local"
+
+
+def test_hybrid_escalates_unsure_reading():
+    result, _ = local_reading((FIXTURES / "bdc_dlp.txt").read_text(encoding="utf-8"))
+    vision_result = dict(result, articles=result["articles"][:1])
+    backend, local, vision = hybrid(result, vision_result, confidence=0.5)
+    context = new_analysis_context()
+    assert backend.analyze(b"page", context) is vision_result
+    assert context["ocr_routing"]["backend"] == "openai"
+    assert context["ocr_backend"] == "openai"
+
+
+def test_hybrid_reuses_local_reading_when_vision_fails(monkeypatch):
+    result, _ = local_reading((FIXTURES / "bdc_dlp.txt").read_text(encoding="utf-8"))
+    backend, local, vision = hybrid(result, FAILED, confidence=0.5)
+    monkeypatch.setattr(backends, "_LOCAL_BACKEND", local)
+    context = new_analysis_context()
+    assert analyze_page(b"page", context, backend=backend) is result
+    assert (local.calls, vision.calls) == (1, 1)
+    assert context["ocr_backend"] == "local"
+    assert context["ocr_fallback"] == "local"
+    assert context["errors"] == []
+    assert context["ocr_routing"]["backend"] == "local"
+
+
+def test_vision_failure_falls_back_to_local_ocr(monkeypatch):
+    result, _ = local_reading((FIXTURES / "bdc_dlp.txt").read_text(encoding="utf-8"))
+    local = FakeBackend("local", result)
+    local.available = lambda: True
+    vision = FakeBackend("openai", FAILED)
+    monkeypatch.setattr(backends, "_LOCAL_BACKEND", local)
+    context = new_analysis_context()
+    assert analyze_page(b"page", context, backend=vision) is result
+    assert context["ocr_fallback"] == "local"
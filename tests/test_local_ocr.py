@@ -0,0 +1,73 @@
+"""Lecture des textes Tesseract : tableau d'articles, entête et document complet"""
+from pathlib import Path
+
+import pytest
+
+from chanfoui import local_ocr
+from chanfoui.local_ocr import parse_article_lines, parse_document_header
+from chanfoui.ocr import new_analysis_context
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def read_fixture(name):
+    return (FIXTURES / name).read_text(encoding="utf-8")
+
+
+def test_invoice_quantity_is_read_from_nb_bills_column():
+    articles = parse_article_lines(read_fixture("facture_en_compte.txt"))
+    assert articles == [
+        {"article_brut": "COTE DE FIANAR ROUGE 75CL", "quantite": 120.0},
+        {"article_brut": "MAROPARASY BLANC 75CL", "quantite": 36.0},
+        {"article_brut": "CONSIGNE CHAN FOUI 75CL", "quantite": 120.0},
+    ]
+
+
+@pytest.mark.parametrize("header", ["Nb bills", "Nb btlls", "Nbbils", "Nb b1lls", "Qté", "Quantité"])
+def test_quantity_header_variants(header):
+    text = f"Désignation Btlls/colis {header} Prix\nMAROPARASY BLANC 75CL 6 36 14000\n"
+    assert parse_article_lines(text)[0]["quantite"] == 36.0
+
+
+def test_order_quantity_is_counted_after_last_designation_header():
+    articles = parse_article_lines(read_fixture("bdc_dlp.txt"))
+    assert [article["quantite"] for article in articles] == [24.0, 12.0]
+    assert articles[0]["article_brut"] == "Vin rouge Côte de Fianar 75cl"
+
+
+def test_without_table_header_first_number_is_the_quantity():
+    text = "COTE DE FIANAR ROUGE 75CL 48 12500\n12 0\nTotal 600000\nMAROPARASY BLANC 75CL 6 14000\n"
+    assert parse_article_lines(text) == [{"article_brut": "COTE DE FIANAR ROUGE 75CL", "quantite": 48.0}]
+
+
+def test_invoice_header():
+    header = parse_document_header(read_fixture("facture_en_compte.txt"))
+    assert header == {"date": "03/09/2024", "numero_facture": "004512", "bon_commande": "", "doit_m": "MOTEL ANOSY"}
+
+
+def test_order_header_expands_two_digit_year():
+    header = parse_document_header(read_fixture("bdc_dlp.txt"))
+    assert header["date"] == "12/08/2024"
+    assert header["bon_commande"] == "BC24-0871"
+    assert header["doit_m"] == ""
+
+
+def test_local_ocr_builds_vision_result(monkeypatch):
+    monkeypatch.setattr(local_ocr, "run_tesseract", lambda image_bytes: (read_fixture("bdc_dlp.txt"), 0.91))
+    context = new_analysis_context()
+    result = local_ocr.local_ocr(b"page", context)
+    assert result["type_document"] == "BDC"
+    assert result["document_subtype"] == "DLP"
+    assert result["fact_manuscrit"] == "10452"
+    assert len(result["articles"]) == 2
+    assert context["ocr_confidence"] == 0.91
+    assert not context["errors"]
+
+
+def test_local_ocr_failure_is_reported_in_context(monkeypatch):
+    def unavailable(image_bytes):
+        raise RuntimeError("Tesseract n'est pas installé")
+    monkeypatch.setattr(local_ocr, "run_tesseract", unavailable)
+    context = new_analysis_context()
+    assert local_ocr.local_ocr(b"page", context) is None
+    assert context["errors"] == ["Erreur OCR local: Tesseract n'est pas installé"]
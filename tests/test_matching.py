@@ -0,0 +1,65 @@
+"""Catalogue précompilé (classement unitaire et par lot) et cache de standardisation"""
+from chanfoui import matching
+from chanfoui.matching import (
+    STANDARD_PRODUCTS,
+    StandardizationCache,
+    compute_code_version,
+    find_best_match,
+    rank_product_matches,
+    rank_product_matches_batch,
+)
+
+DESIGNATIONS = [
+    "COTE DE FIANAR ROUGE 75CL",
+    "COTE DE FLANAR ROSE 75CL",
+    "MAROPARASY BLANC DOUX 750ML NU",
+    "JUS DE RAISIN ROUGE 200ML",
+    "XYZ 12",
+    "",
+]
+
+
+def test_batch_ranking_matches_single_ranking():
+    batch = rank_product_matches_batch(DESIGNATIONS)
+    assert batch == [rank_product_matches(designation) for designation in DESIGNATIONS]
+
+
+def test_best_match_and_alternatives():
+    ranking = rank_product_matches("COTE DE FIANAR ROUGE 75CL", top_k=3)
+    assert ranking["best_match"] == "Côte de Fianar Rouge 75 cl"
+    assert len(ranking["matches"]) <= 3
+    scores = [score for _, score in ranking["matches"]]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_no_match_below_threshold():
+    product, confidence = find_best_match("XYZ 12", STANDARD_PRODUCTS)
+    assert product is None
+    assert confidence < 0.6
+
+
+def test_cache_persists_in_batches_and_reloads_recently_used_entries(tmp_path):
+    path = str(tmp_path / "standardization.sqlite")
+    cache = StandardizationCache("v1", maxsize=3, path=path)
+    for i in range(5):
+        cache.put(f"designation {i}", (f"designation {i}", "produit", 0.9, "matched"))
+    assert StandardizationCache("v1", path=path)._entries == {}  # pas encore enregistré
+
+    cache.get("designation 2")
+    cache.flush()
+    reopened = StandardizationCache("v1", maxsize=1, path=path)
+    assert list(reopened._entries) == ["designation 2"]
+
+
+def test_cache_drops_entries_of_other_versions(tmp_path):
+    path = str(tmp_path / "standardization.sqlite")
+    cache = StandardizationCache("v1", path=path)
+    cache.put("designation", ("designation", "produit", 0.9, "matched"))
+    cache.flush()
+    assert len(StandardizationCache("v2", path=path)) == 0
+    assert len(StandardizationCache("v1", path=path)) == 0
+
+
+def test_catalog_version_covers_matching_code():
+    assert compute_code_version()
+    assert matching.compute_catalog_version() != compute_code_version()
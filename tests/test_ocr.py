@@ -0,0 +1,87 @@
+"""Lecture incrémentale de la réponse OpenAI Vision diffusée"""
+import json
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from chanfoui.ocr import VISION_RESPONSE_FORMAT, StreamingArticleParser, request_vision_completion
+from chanfoui.scheduler import OCRScheduler
+
+RESPONSE = {
+    "type_document": "BDC",
+    "document_subtype": "DLP",
+    "client": "DLP",
+    "fact_manuscrit": "10452",
+    "articles": [
+        {"article_brut": "VIN ROUGE COTE DE FIANAR 75CL", "quantite": 12},
+        {"article_brut": 'CONS. CHAN FOUI {bouteille} "75"', "quantite": 3},
+        {"article_brut": "MAROPARASY ROUGE 70 CL", "quantite": 6},
+    ],
+}
+
+
+def parse_in_fragments(text, size):
+    events = []
+    parser = StreamingArticleParser(lambda kind, payload: events.append((kind, payload)))
+    for start in range(0, len(text), size):
+        parser.feed(text[start:start + size])
+    return parser, events
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_header_then_each_article_as_soon_as_complete(size):
+    text = json.dumps(RESPONSE, ensure_ascii=False)
+    parser, events = parse_in_fragments(text, size)
+    assert parser.text == text
+    assert events[0] == ("header", {key: value for key, value in RESPONSE.items() if key != "articles"})
+    assert events[1:] == [("article", article) for article in RESPONSE["articles"]]
+
+
+def test_article_is_sent_on_its_closing_brace():
+    events = []
+    parser = StreamingArticleParser(lambda kind, payload: events.append(kind))
+    parser.feed('{"type_document": "BDC", "artic')
+    assert events == []
+    parser.feed('les": [{"article_brut": "VIN }", "quantite": 2')
+    assert events == ["header"]
+    parser.feed('}, {"article_brut": "BIE')
+    assert events == ["header", "article"]
+
+
+def test_invalid_header_is_skipped():
+    events = []
+    parser = StreamingArticleParser(lambda kind, payload: events.append((kind, payload)))
+    parser.feed('{"type_document": "BDC" "client": "DLP", "articles": [{"article_brut": "VIN", "quantite": 1}]}')
+    assert events == [("article", {"article_brut": "VIN", "quantite": 1})]
+
+
+class FakeStreamingClient:
+    """Client dont la réponse diffusée découpe text en fragments de size caractères"""
+
+    def __init__(self, text, size=5):
+        self.chat = SimpleNamespace(completions=self)
+        self.text = text
+        self.size = size
+
+    def create(self, **kwargs):
+        assert kwargs["stream"] is True
+        return iter([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=self.text[i:i + self.size],
+                                                                                    refusal=None))])
+                     for i in range(0, len(self.text), self.size)])
+
+
+def test_streamed_completion_through_scheduler():
+    image = BytesIO()
+    Image.new("L", (8, 8), 255).save(image, "PNG")
+    text = json.dumps(RESPONSE, ensure_ascii=False)
+    events = []
+    parser = StreamingArticleParser(lambda kind, payload: events.append(kind))
+    with OCRScheduler() as scheduler:
+        client = scheduler.wrap(FakeStreamingClient(text))
+        content = request_vision_completion(client, "prompt", image.getvalue(), "gpt", 1000,
+                                            VISION_RESPONSE_FORMAT, on_delta=parser.feed)
+        assert scheduler.metrics_snapshot()["circuits"] == {"gpt": "closed"}
+    assert content == text
+    assert events == ["header", "article", "article", "article"]
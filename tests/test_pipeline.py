@@ -0,0 +1,23 @@
+"""Résultats partiels des pages : standardisation sans cache des articles diffusés"""
+from chanfoui.matching import get_standardization_cache
+from chanfoui.pipeline import build_articles_df, build_streamed_articles_df, page_partial_result
+
+
+def test_streamed_articles_do_not_fill_standardization_cache():
+    cache = get_standardization_cache()
+    cache.clear()
+    events = []
+    forward = page_partial_result(lambda kind, payload: events.append((kind, payload)), 2)
+    forward("header", {"type_document": "BDC"})
+    forward("article", {"article_brut": "VIN ROUGE COTE DE FIANAR 75CL", "quantite": 12})
+    forward("article", {"article_brut": "VINS ROUGES", "quantite": 0})
+
+    assert [kind for kind, _ in events] == ["header", "article", "article"]
+    assert all(payload["page"] == 2 for _, payload in events)
+    articles = [payload for kind, payload in events if kind == "article"]
+    streamed = build_streamed_articles_df(articles)
+    assert len(cache) == 0
+
+    # Même tableau que celui de la réponse complète validée
+    expected = build_articles_df({"articles": articles})
+    assert streamed.to_dict("records") == expected.to_dict("records")
@@ -0,0 +1,83 @@
+"""Classement des erreurs OpenAI et disjoncteur"""
+from types import SimpleNamespace
+
+import pytest
+
+from chanfoui.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    is_rate_limit_error,
+    is_retryable_error,
+    retry_after_seconds,
+    should_fall_back,
+)
+
+
+class APIError(Exception):
+    """Erreur du SDK OpenAI réduite à son code HTTP et à ses en-têtes"""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"erreur {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (APIError(429), True),
+    (APIError(503), True),
+    (APIConnectionError("réseau coupé"), True),
+    (APIError(400), False),
+    (ValueError("réponse invalide"), False),
+])
+def test_retryable_errors(error, retryable):
+    assert is_retryable_error(error) is retryable
+    assert should_fall_back(error) is retryable
+
+
+def test_rate_limit_and_retry_after():
+    assert is_rate_limit_error(APIError(429, {"retry-after": "7"}))
+    assert not is_rate_limit_error(APIError(503))
+    assert retry_after_seconds(APIError(429, {"retry-after": "7"})) == 7.0
+    assert retry_after_seconds(APIError(429, {"retry-after": "bientôt"})) is None
+    assert retry_after_seconds(APIError(429)) is None
+    assert should_fall_back(CircuitOpenError("disjoncteur ouvert"))
+
+
+def test_circuit_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("gpt", failure_threshold=3, reset_seconds=60)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(3):
+        assert breaker.state == "closed"
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_half_open_trial_closes_or_reopens_circuit():
+    breaker = CircuitBreaker("gpt", failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.state == "half_open"
+    breaker.before_call()
+    # Un seul appel d'essai à la fois
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+    breaker.reset_seconds = 60
+    breaker.record_failure()
+    assert breaker.state == "open"
+    breaker.reset_seconds = 0
+    breaker.before_call()
+    breaker.record_failure()
+    breaker.reset_seconds = 60
+    assert breaker.state == "open"
@@ -0,0 +1,266 @@
+"""Ordonnanceur OCR : reprises, pause sur limite de débit, échéance, disjoncteur et réponses diffusées"""
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from chanfoui.resilience import CIRCUIT_FAILURE_THRESHOLD, CircuitOpenError
+from chanfoui.scheduler import OCRScheduler
+
+
+class APIError(Exception):
+    """Erreur du SDK OpenAI réduite à son code HTTP et à ses en-têtes"""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"erreur {status_code}")
+        self.status_code = status_code
+        headers = {} if retry_after is None else {"retry-after": str(retry_after)}
+        self.response = SimpleNamespace(headers=headers)
+
+
+class FakeCall:
+    """Appel qui lève les erreurs données, dans l'ordre, puis renvoie "ok" """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+class FakeStream:
+    """Réponse diffusée : renvoie ses fragments puis lève error s'il est donné"""
+
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+        self.closed = False
+
+    def __iter__(self):
+        yield from self.chunks
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    """Client OpenAI dont chat.completions.create renvoie les réponses données, dans l'ordre"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.chat = SimpleNamespace(completions=self)
+
+    def with_options(self, **options):
+        self.options = options
+        return self
+
+    def create(self, **kwargs):
+        self.requests.append(kwargs)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class FakeClock:
+    """Horloge time.monotonic avancée par les attentes (time.sleep), qu'elle mémorise"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr("chanfoui.scheduler.time.monotonic", clock.monotonic)
+    monkeypatch.setattr("chanfoui.scheduler.time.sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def sleeps(clock):
+    """Délais demandés par l'ordonnanceur, sans attente réelle"""
+    return clock.sleeps
+
+
+@pytest.fixture
+def scheduler():
+    with OCRScheduler(max_concurrency=2, max_retries=3, base_delay=2.0, max_delay=60.0) as scheduler:
+        yield scheduler
+
+
+def test_transient_errors_are_retried_with_exponential_backoff(scheduler, sleeps):
+    call = FakeCall(APIError(503), APIError(502))
+    assert scheduler.call_with_backoff(call) == "ok"
+    assert call.calls == 3
+    assert 1.0 <= sleeps[0] <= 2.0
+    assert 2.0 <= sleeps[1] <= 4.0
+    metrics = scheduler.metrics_snapshot()
+    assert metrics["retries"] == 2
+    assert "failures" not in metrics
+
+
+def test_retries_are_bounded(scheduler, sleeps):
+    call = FakeCall(*(APIError(500) for _ in range(10)))
+    with pytest.raises(APIError):
+        scheduler.call_with_backoff(call)
+    assert call.calls == scheduler.max_retries + 1
+    assert scheduler.metrics_snapshot()["failures"] == 1
+
+
+def test_non_transient_error_is_not_retried(scheduler, sleeps):
+    call = FakeCall(APIError(400))
+    with pytest.raises(APIError):
+        scheduler.call_with_backoff(call)
+    assert call.calls == 1
+    assert sleeps == []
+
+
+def test_retry_after_is_used_as_delay(scheduler, sleeps):
+    assert scheduler.call_with_backoff(FakeCall(APIError(429, retry_after=10))) == "ok"
+    assert sleeps == [10.0]
+    assert scheduler.metrics_snapshot()["rate_limited"] == 1
+
+
+def test_rate_limit_pauses_every_caller(scheduler, clock):
+    # Pause posée par le 429 d'un autre worker (celui-ci attend encore)
+    scheduler._pause(10)
+    clock.now += 4
+    assert scheduler.call_with_backoff(FakeCall()) == "ok"
+    assert clock.sleeps == [6.0]
+
+
+def test_retry_delay_beyond_deadline_gives_up(scheduler, clock):
+    call = FakeCall(APIError(429, retry_after=10))
+    with pytest.raises(APIError):
+        scheduler.call_with_backoff(call, deadline=clock.now + 5)
+    assert call.calls == 1
+    assert clock.sleeps == []
+    assert scheduler.metrics_snapshot()["deadline_exceeded"] == 1
+
+
+def test_pause_beyond_deadline_raises_without_calling(scheduler, clock):
+    scheduler._pause(10)
+    call = FakeCall()
+    with pytest.raises(TimeoutError):
+        scheduler.call_with_backoff(call, deadline=clock.now + 5)
+    assert call.calls == 0
+    assert clock.sleeps == []
+    assert scheduler.metrics_snapshot()["deadline_exceeded"] == 1
+
+
+def test_circuit_opens_and_rejects_calls(sleeps):
+    with OCRScheduler(max_retries=CIRCUIT_FAILURE_THRESHOLD) as scheduler:
+        call = FakeCall(*(APIError(503) for _ in range(CIRCUIT_FAILURE_THRESHOLD)))
+        with pytest.raises(CircuitOpenError):
+            scheduler.call_with_backoff(call, circuit="gpt")
+        assert call.calls == CIRCUIT_FAILURE_THRESHOLD
+        assert scheduler.metrics_snapshot()["circuits"] == {"gpt": "open"}
+
+        other = FakeCall()
+        with pytest.raises(CircuitOpenError):
+            scheduler.call_with_backoff(other, circuit="gpt")
+        assert other.calls == 0
+        assert scheduler.metrics_snapshot()["circuit_rejections"] == 2
+        # Les autres modèles ne sont pas concernés
+        assert scheduler.call_with_backoff(FakeCall(), circuit="gpt-mini") == "ok"
+
+
+def test_half_open_circuit_closes_after_successful_trial(scheduler, sleeps):
+    breaker = scheduler.circuit_breaker("gpt")
+    breaker.reset_seconds = 0
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == "half_open"
+    assert scheduler.call_with_backoff(FakeCall(), circuit="gpt") == "ok"
+    assert breaker.state == "closed"
+
+
+def test_wrapped_client_disables_sdk_retries_and_bounds_timeout(scheduler):
+    client = FakeClient("réponse")
+    wrapped = scheduler.wrap(client)
+    assert scheduler.wrap(client) is wrapped
+    assert wrapped.chat.completions.create(model="gpt", timeout=600) == "réponse"
+    assert client.options == {"max_retries": 0}
+    assert client.requests[0]["timeout"] <= scheduler.call_deadline
+
+
+def test_stream_success_is_reported_at_end_of_reading(scheduler):
+    stream = FakeStream(["a", "b"])
+    wrapped = scheduler.wrap(FakeClient(stream))
+    chunks = wrapped.chat.completions.create(model="gpt", stream=True)
+    assert list(chunks) == ["a", "b"]
+    assert scheduler.metrics_snapshot()["circuits"] == {"gpt": "closed"}
+
+
+def test_stream_failure_is_counted_and_closes_stream(scheduler):
+    stream = FakeStream(["a"], error=APIError(502))
+    wrapped = scheduler.wrap(FakeClient(stream))
+    breaker = scheduler.circuit_breaker("gpt")
+    chunks = wrapped.chat.completions.create(model="gpt", stream=True)
+    with pytest.raises(APIError):
+        list(chunks)
+    assert stream.closed
+    assert breaker._failures == 1
+    assert scheduler.metrics_snapshot()["stream_failures"] == 1
+
+
+def test_stream_beyond_deadline_is_interrupted(scheduler):
+    stream = FakeStream(["a", "b", "c"])
+    chunks = scheduler.monitor_stream(stream, circuit="gpt", deadline=time.monotonic() - 1)
+    with pytest.raises(TimeoutError):
+        list(chunks)
+    assert stream.closed
+    assert scheduler.metrics_snapshot()["deadline_exceeded"] == 1
+
+
+def test_concurrent_calls_share_scheduler_limit(scheduler):
+    lock = threading.Lock()
+    state = {"active": 0, "peak": 0}
+
+    def call():
+        with lock:
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+        time.sleep(0.02)
+        with lock:
+            state["active"] -= 1
+        return "ok"
+
+    # Chaque document analyse ses pages dans son propre pool, comme pipeline.analyze_pages
+    def document():
+        threads = [threading.Thread(target=scheduler.call_with_backoff, args=(call,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    futures = [scheduler.submit(lambda client=None: document()) for _ in range(2)]
+    for future in futures:
+        future.result()
+    assert state["peak"] == scheduler.max_concurrency
+
+
+def test_stream_slot_is_released_after_reading(scheduler):
+    wrapped = scheduler.wrap(FakeClient(*(FakeStream(["a"]) for _ in range(3))))
+    for _ in range(3):
+        assert list(wrapped.chat.completions.create(model="gpt", stream=True)) == ["a"]
+    # Toutes les places sont de nouveau libres
+    acquired = [scheduler._slots.acquire(blocking=False) for _ in range(scheduler.max_concurrency)]
+    assert all(acquired)